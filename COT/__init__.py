@@ -41,15 +41,21 @@ Command modules
   COT.inject_config
   COT.install_helpers
   COT.remove_file
+  COT.verify
 
 Helper library modules
 ----------------------
 .. autosummary::
   :toctree:
 
+  COT.compression
   COT.data_validation
+  COT.digest
+  COT.file_copy
   COT.file_reference
+  COT.http_file
   COT.platforms
+  COT.xml_backend
 
 User interface modules
 ----------------------
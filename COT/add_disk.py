@@ -235,6 +235,7 @@ otherwise, will create a new disk entry.""")
         group.add_argument('-o', '--output',
                            help="""Name/path of new OVF/OVA package to """
                            """create instead of updating the existing OVF""")
+        self.add_package_arguments(p)
 
         group = p.add_argument_group("disk-related options")
 
@@ -125,6 +125,7 @@ create a new file entry.""")
         p.add_argument('-o', '--output',
                        help="""Name/path of new VM package to create """
                        """instead of updating the existing package""")
+        self.add_package_arguments(p)
         p.add_argument('-f', '--file-id',
                        help="""File ID string within the package """
                        """(default: same as filename)""")
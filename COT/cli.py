@@ -492,6 +492,7 @@ class CLI(UI):
         from COT.inject_config import COTInjectConfig
         from COT.install_helpers import COTInstallHelpers
         from COT.remove_file import COTRemoveFile
+        from COT.verify import COTVerify
         for klass in [
                 COTAddDisk,
                 COTAddFile,
@@ -504,6 +505,7 @@ class CLI(UI):
                 COTInjectConfig,
                 COTInstallHelpers,
                 COTRemoveFile,
+                COTVerify,
         ]:
             instance = klass(self)
             # the subparser stores a reference to the instance (args.instance)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+#
+# compression.py - Compression and decompression of file data
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Compression and decompression of the files in an OVF package.
+
+The OVF standard permits the files referenced by an OVF descriptor to be
+stored compressed with gzip (``ovf:compression="gzip"``). Disk images,
+especially mostly-empty raw images, typically compress very well.
+
+Compression is performed a block at a time using a pool of threads
+(:mod:`zlib` releases the GIL while compressing), in the same manner as
+`pigz`_: each block is compressed independently, primed with the end of the
+preceding block so that little compression is lost, and the results are
+concatenated into a single standard gzip stream. Decompression is
+inherently sequential, and is done by streaming through :mod:`gzip`.
+
+**Functions**
+
+.. autosummary::
+  :nosignatures:
+
+  gzip_compress
+  open_decompressed
+
+**Constants**
+
+.. autosummary::
+  COMPRESSION_TYPES
+  COMPRESSION_BLOCK_SIZE
+
+.. _pigz: http://zlib.net/pigz/
+"""
+
+import collections
+import gzip
+import logging
+import struct
+import zlib
+
+from COT.digest import default_workers
+
+logger = logging.getLogger(__name__)
+
+COMPRESSION_TYPES = ('gzip', )
+"""Compression algorithms supported for files in an OVF package."""
+
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+"""Number of bytes of input to compress at a time in each thread."""
+
+# Maximum distance a deflate back-reference can reach
+_DICTIONARY_SIZE = 32 * 1024
+
+# Magic, deflate method, no flags, no timestamp, no extra flags, unknown OS
+_GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def _deflate_block(block, level):
+    """Compress a single block of data as part of a larger deflate stream.
+
+    Args:
+      block (tuple): ``(data, dictionary, last)``, where ``dictionary`` is
+          the data immediately preceding this block (if any) and ``last``
+          indicates whether this is the final block of the stream.
+      level (int): Compression level, 1 (fastest) to 9 (smallest).
+
+    Returns:
+      bytes: Raw deflate data, ending on a byte boundary.
+    """
+    (data, dictionary, last) = block
+    args = [level, zlib.DEFLATED, -zlib.MAX_WBITS]
+    if dictionary:
+        # zdict is only supported in Python 3.3 and later
+        try:
+            compressor = zlib.compressobj(*(args + [zlib.DEF_MEM_LEVEL,
+                                                    zlib.Z_DEFAULT_STRATEGY,
+                                                    dictionary]))
+        except TypeError:
+            compressor = zlib.compressobj(*args)
+    else:
+        compressor = zlib.compressobj(*args)
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def _read_blocks(file_obj, block_size):
+    """Read the given file a block at a time, for :func:`_deflate_block`.
+
+    Args:
+      file_obj (file): File object opened for binary reading.
+      block_size (int): Number of bytes per block.
+
+    Yields:
+      tuple: ``(data, dictionary, last)``
+    """
+    dictionary = b''
+    data = file_obj.read(block_size)
+    while True:
+        next_data = file_obj.read(block_size) if data else b''
+        last = not next_data
+        yield (data, dictionary, last)
+        if last:
+            return
+        dictionary = data[-_DICTIONARY_SIZE:]
+        data = next_data
+
+
+def _ordered_map(func, items, workers, lookahead):
+    """Call ``func`` on each of ``items`` using a single pool of threads.
+
+    Unlike :func:`COT.digest.parallel_map`, ``items`` is consumed lazily,
+    with at most ``lookahead`` calls outstanding at a time, so that
+    producing further items overlaps with processing earlier ones while
+    memory usage stays bounded.
+
+    Args:
+      func (function): Function to call
+      items (iterable): Arguments to pass to ``func``, one at a time.
+      workers (int): Maximum number of threads to use.
+      lookahead (int): Maximum number of items to have in progress.
+
+    Yields:
+      tuple: ``(item, result)``, in the same order as ``items``.
+    """
+    pool = None
+    if workers > 1:
+        # Some platforms lack the semaphore support needed by the pool
+        try:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(workers)
+        except (ImportError, OSError) as e:
+            logger.debug("Unable to create thread pool (%s), "
+                         "working sequentially instead", e)
+    if pool is None:
+        for item in items:
+            yield (item, func(item))
+        return
+    pending = collections.deque()
+    try:
+        for item in items:
+            pending.append((item, pool.apply_async(func, (item, ))))
+            if len(pending) >= lookahead:
+                (item, result) = pending.popleft()
+                yield (item, result.get())
+        while pending:
+            (item, result) = pending.popleft()
+            yield (item, result.get())
+    finally:
+        pool.close()
+        pool.join()
+
+
+def gzip_compress(src_obj, dst_obj, workers=None,
+                  block_size=COMPRESSION_BLOCK_SIZE, level=6):
+    """Compress data from one file object into another in gzip format.
+
+    Args:
+      src_obj (file): File object opened for binary reading.
+      dst_obj (file): File object opened for binary writing.
+      workers (int): Maximum number of blocks to compress simultaneously.
+          If not specified, uses :func:`COT.digest.default_workers`.
+      block_size (int): Number of bytes to compress at a time per thread.
+      level (int): Compression level, 1 (fastest) to 9 (smallest).
+
+    Returns:
+      int: Number of (uncompressed) bytes read from ``src_obj``.
+    """
+    if workers is None:
+        workers = default_workers()
+
+    def _deflate(block):
+        """Compress a single block at the requested level."""
+        return _deflate_block(block, level)
+
+    dst_obj.write(_GZIP_HEADER)
+    crc = 0
+    size = 0
+    # Only read a few blocks ahead, to limit memory usage
+    for (block, compressed) in _ordered_map(
+            _deflate, _read_blocks(src_obj, block_size), workers,
+            max(workers, 1) * 4):
+        crc = zlib.crc32(block[0], crc)
+        size += len(block[0])
+        dst_obj.write(compressed)
+    dst_obj.write(struct.pack('<II', crc & 0xffffffff, size & 0xffffffff))
+    logger.debug("Compressed %d bytes using up to %d threads", size, workers)
+    return size
+
+
+def open_decompressed(file_obj, compression):
+    """Get a file object that streams the decompressed contents of a file.
+
+    Args:
+      file_obj (file): File object opened for binary reading.
+      compression (str): One of :data:`COMPRESSION_TYPES`, or ``None``.
+
+    Returns:
+      file: File object for reading decompressed data, or ``file_obj``
+      itself if ``compression`` is ``None``.
+
+    Raises:
+      NotImplementedError: if ``compression`` is not supported.
+    """
+    if compression is None:
+        return file_obj
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file_obj, mode='rb')
+    raise NotImplementedError("Unsupported compression type '{0}'"
+                              .format(compression))
@@ -56,12 +56,12 @@
   NIC_TYPES
 """
 
-import xml.etree.ElementTree as ET
-import hashlib
 import re
-import sys
 from distutils.util import strtobool
 
+from COT.digest import CHECKSUM_TYPES, digest_stream, path_identity
+from COT.xml_backend import ET, tostring
+
 
 def to_string(obj):
     """Get string representation of an object, special-case for XML Element.
@@ -84,10 +84,7 @@ def to_string(obj):
         <hello key="value" />
     """
     if ET.iselement(obj):
-        if sys.version_info[0] >= 3:
-            return ET.tostring(obj, encoding='unicode')
-        else:
-            return ET.tostring(obj)
+        return tostring(obj)
     else:
         return str(obj)
 
@@ -347,21 +344,27 @@ def check_for_conflict(label, li):
     return obj
 
 
-def file_checksum(path_or_obj, checksum_type):
+def file_checksum(path_or_obj, checksum_type, cache=None):
     """Get the checksum of the given file.
 
     Args:
       path_or_obj (str): File path to checksum OR an opened file object
-      checksum_type (str): Supported values are 'md5' and 'sha1'.
+      checksum_type (str): Supported values are 'md5', 'sha1', 'sha256',
+          and 'sha512'.
+      cache (COT.digest.DigestCache): If specified, and ``path_or_obj`` is
+          a file path, look up the checksum in this cache before computing
+          it, and store the computed checksum into this cache.
     Returns:
       str: Hexadecimal file checksum
     """
-    # pylint: disable=redefined-variable-type
-    if checksum_type == 'md5':
-        h = hashlib.md5()
-    elif checksum_type == 'sha1':
-        h = hashlib.sha1()
-    else:
+    key = None
+    if cache is not None and not hasattr(path_or_obj, 'read'):
+        key = path_identity(path_or_obj)
+        checksum = cache.get(key, checksum_type)
+        if checksum is not None:
+            return checksum
+
+    if checksum_type not in CHECKSUM_TYPES:
         raise NotImplementedError(
             "No support for generating checksum type {0}"
             .format(checksum_type))
@@ -373,19 +376,15 @@ def file_checksum(path_or_obj, checksum_type):
     except AttributeError:
         file_obj = open(path_or_obj, 'rb')
 
-    blocksize = 65536
-
     try:
-        while True:
-            buf = file_obj.read(blocksize)
-            if len(buf) == 0:
-                break
-            h.update(buf)
+        checksum = digest_stream(file_obj, [checksum_type])[checksum_type]
     finally:
         if file_obj != path_or_obj:
             file_obj.close()
 
-    return h.hexdigest()
+    if cache is not None:
+        cache.put(key, checksum_type, checksum)
+    return checksum
 
 
 def mac_address(string):
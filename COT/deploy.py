@@ -408,7 +408,7 @@ class COTDeploy(COTReadOnlySubmodule):
                 description="Deploy an OVF or OVA to create a virtual machine "
                 "on a specified server.")
 
-            p.add_argument('PACKAGE', help="OVF descriptor or OVA file")
+            p.add_argument('PACKAGE', help="OVF descriptor or OVA file or URL")
 
             self.subparsers = p.add_subparsers(
                 prog="cot deploy",
@@ -0,0 +1,529 @@
+#!/usr/bin/env python
+#
+# digest.py - Computing and caching file digests (checksums)
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Computing and caching of file digests (checksums).
+
+Computing the digest of a multi-gigabyte disk image is expensive, and most
+operations on an OVF or OVA carry over most of the referenced files
+unchanged from input to output. The :class:`DigestCache` remembers digests
+that have previously been computed, keyed on the identity of the file
+(its path or archive and offset, size, modification time, and inode),
+so that unchanged files do not need to be re-read.
+
+:func:`digest_files` computes the digests of many files at once, using a
+pool of threads (the :mod:`hashlib` functions release the GIL while hashing,
+so files can be hashed in parallel), consulting the cache for each file.
+Any number of digest algorithms can be computed from a single read of
+each file, so producing (for example) both SHA1 and SHA256 checksums of
+a multi-gigabyte disk image costs no more I/O than producing either alone.
+The holes in sparse files (see :func:`COT.file_copy.data_extents`) are
+hashed as runs of zeros without being read at all.
+
+By default, the cache is only kept in memory for the life of the process.
+To also reuse digests across runs of COT, set the ``COT_DIGEST_CACHE``
+environment variable to the path of a file (such as
+``~/.cache/cot/digests.json``) to persist the cache to. Unset it, or set it
+to an empty string, to stop using the persisted cache; the file can then be
+deleted.
+
+**Classes**
+
+.. autosummary::
+  :nosignatures:
+
+  DigestCache
+  HashingReader
+
+**Functions**
+
+.. autosummary::
+  :nosignatures:
+
+  default_digest_cache
+  default_workers
+  digest_files
+  digest_stream
+  parallel_map
+  path_identity
+
+**Constants**
+
+.. autosummary::
+  CHECKSUM_TYPES
+  DEFAULT_BLOCK_SIZE
+  RACY_INTERVAL
+"""
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+from verboselogs import VerboseLogger
+
+from COT.file_copy import data_extents
+
+logging.setLoggerClass(VerboseLogger)
+
+logger = logging.getLogger(__name__)
+
+RACY_INTERVAL = 2
+"""Files modified less than this many seconds ago are not cacheable.
+
+A file may be modified again within the granularity of the filesystem's
+timestamps without its modification time changing, so we can't trust
+that a very recently modified file will remain unchanged.
+"""
+
+
+CHECKSUM_TYPES = ('md5', 'sha1', 'sha256', 'sha512')
+"""Digest algorithms supported by COT."""
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+"""Default number of bytes to read from a file at a time when hashing it."""
+
+
+def path_identity(path, kind='file'):
+    """Get a tuple identifying the current contents of the given file.
+
+    Args:
+      path (str): File path
+      kind (str): Prefix to distinguish different kinds of identity.
+    Returns:
+      tuple: (kind, realpath, size, mtime, device, inode), or ``None`` if the
+      file was modified too recently (see :data:`RACY_INTERVAL`) to be
+      reliably identified.
+    """
+    stat = os.stat(path)
+    if time.time() - stat.st_mtime < RACY_INTERVAL:
+        return None
+    return (kind, os.path.realpath(path), stat.st_size, stat.st_mtime,
+            stat.st_dev, stat.st_ino)
+
+
+class DigestCache(object):
+    """Least-recently-used cache of file digests keyed on file identity.
+
+    Keys are tuples such as those returned by :func:`path_identity` or the
+    ``identity`` property of :class:`~COT.file_reference.FileOnDisk` and
+    :class:`~COT.file_reference.FileInTAR`. A key of ``None`` denotes
+    a file that can't be cached, and is silently ignored.
+    """
+
+    DEFAULT_MAX_ENTRIES = 1024
+    """Default maximum number of files to remember digests for."""
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        """Create a digest cache, loading any persisted entries.
+
+        Args:
+          path (str): File to persist the cache to, or ``None`` to only
+              cache in memory.
+          max_entries (int): Maximum number of files to remember.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        # json.dumps(key) -> [last_used_time, {checksum_type: hexdigest}]
+        self._entries = {}
+        self._dirty = False
+        if self.path:
+            self._entries = self._read()
+            self._prune()
+
+    def __len__(self):
+        """Number of files whose digests are cached.
+
+        Returns:
+          int: Number of entries
+        """
+        return len(self._entries)
+
+    @staticmethod
+    def _keystr(key):
+        """Convert a tuple key to the string used internally."""
+        return json.dumps(list(key))
+
+    def get(self, key, checksum_type):
+        """Look up a previously cached digest.
+
+        Args:
+          key (tuple): File identity
+          checksum_type (str): Digest algorithm, such as 'sha1'
+        Returns:
+          str: Hexadecimal digest, or ``None`` if not cached.
+        """
+        if key is None:
+            return None
+        entry = self._entries.get(self._keystr(key))
+        if entry is None or checksum_type not in entry[1]:
+            return None
+        entry[0] = time.time()
+        self._dirty = True
+        logger.debug("Found cached %s digest of %s", checksum_type, key)
+        return entry[1][checksum_type]
+
+    def get_many(self, key, checksum_types):
+        """Look up several previously cached digests of the same file.
+
+        Args:
+          key (tuple): File identity
+          checksum_types (list): Digest algorithms, such as 'sha1'
+        Returns:
+          dict: ``{checksum_type: hexdigest}`` for those digests that
+          were found in the cache.
+        """
+        found = {}
+        for checksum_type in checksum_types:
+            hexdigest = self.get(key, checksum_type)
+            if hexdigest is not None:
+                found[checksum_type] = hexdigest
+        return found
+
+    def put(self, key, checksum_type, hexdigest):
+        """Remember the digest of the given file.
+
+        Args:
+          key (tuple): File identity
+          checksum_type (str): Digest algorithm, such as 'sha1'
+          hexdigest (str): Hexadecimal digest
+        """
+        if key is None:
+            return
+        keystr = self._keystr(key)
+        entry = self._entries.setdefault(keystr, [0, {}])
+        entry[0] = time.time()
+        entry[1][checksum_type] = hexdigest
+        self._dirty = True
+        self._prune()
+
+    def clear(self):
+        """Forget all cached digests."""
+        self._entries = {}
+        self._dirty = True
+
+    def _prune(self):
+        """Evict the least recently used entries beyond :attr:`max_entries`."""
+        excess = len(self._entries) - self.max_entries
+        if excess <= 0:
+            return
+        lru = sorted(self._entries, key=lambda k: self._entries[k][0])
+        for keystr in lru[:excess]:
+            del self._entries[keystr]
+
+    def _read(self, warn=True):
+        """Read the persisted cache contents from :attr:`path`.
+
+        Args:
+          warn (bool): Whether to log a warning if the file is unreadable.
+        Returns:
+          dict: Cache entries, or an empty dict if none could be read.
+        """
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            return dict((keystr, list(entry))
+                        for (keystr, entry) in data['entries'].items())
+        except (IOError, OSError, ValueError, KeyError,
+                AttributeError, TypeError) as e:
+            if warn and os.path.exists(self.path):
+                logger.warning("Ignoring unreadable digest cache %s: %s",
+                               self.path, e)
+            return {}
+
+    def save(self):
+        """Persist the cache to :attr:`path`, if any.
+
+        Entries persisted in the meantime by other processes are merged in.
+        Errors are logged but otherwise ignored, as the cache is only an
+        optimization.
+        """
+        if not self.path or not self._dirty:
+            return
+        for (keystr, entry) in self._read(warn=False).items():
+            mine = self._entries.get(keystr)
+            if mine is None:
+                self._entries[keystr] = entry
+            else:
+                mine[0] = max(mine[0], entry[0])
+                for (checksum_type, hexdigest) in entry[1].items():
+                    mine[1].setdefault(checksum_type, hexdigest)
+        self._prune()
+        cache_dir = os.path.dirname(os.path.abspath(self.path))
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            (fd, tmp_path) = tempfile.mkstemp(dir=cache_dir,
+                                              prefix=".digests")
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'entries': self._entries}, f)
+            os.rename(tmp_path, self.path)
+            self._dirty = False
+            logger.debug("Saved %d cached digests to %s",
+                         len(self._entries), self.path)
+        except (IOError, OSError) as e:
+            logger.warning("Unable to save digest cache to %s: %s",
+                           self.path, e)
+
+
+class HashingReader(object):
+    """Wrapper around a file object, hashing all data read through it.
+
+    This allows a file's digests to be computed from the same reads used to
+    copy its contents elsewhere (such as into a TAR archive), rather than
+    reading the file a second time just to checksum it.
+    """
+
+    def __init__(self, file_obj, checksum_types):
+        """Wrap the given file object.
+
+        Args:
+          file_obj (file): File object opened for binary reading.
+          checksum_types (list): Digest algorithms, such as ``['sha1']``.
+        """
+        self.file_obj = file_obj
+        self._digests = dict((checksum_type, hashlib.new(checksum_type))
+                             for checksum_type in checksum_types)
+
+    def read(self, size=-1):
+        """Read (and hash) up to ``size`` bytes from the wrapped file.
+
+        Args:
+          size (int): Number of bytes to read, or -1 to read all.
+        Returns:
+          bytes: Data read.
+        """
+        data = self.file_obj.read(size)
+        for digest in self._digests.values():
+            digest.update(data)
+        return data
+
+    def hexdigests(self):
+        """Get the digests of all data read so far.
+
+        Returns:
+          dict: ``{checksum_type: hexdigest}``
+        """
+        return dict((checksum_type, digest.hexdigest())
+                    for (checksum_type, digest) in self._digests.items())
+
+
+_default_cache = None
+
+
+def default_digest_cache():
+    """Get the shared default :class:`DigestCache` instance.
+
+    Returns:
+      DigestCache: Cache persisted to the file named by the
+      ``COT_DIGEST_CACHE`` environment variable, if set, else in-memory only.
+    """
+    global _default_cache  # pylint: disable=global-statement
+    if _default_cache is None:
+        path = os.environ.get('COT_DIGEST_CACHE')
+        if path:
+            path = os.path.expanduser(path)
+        _default_cache = DigestCache(path or None)
+    return _default_cache
+
+
+def default_workers():
+    """Get the default number of threads to use for hashing or copying files.
+
+    Returns:
+      int: Number of CPUs available, or 1 if this can't be determined.
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _sparse_extents(file_obj):
+    """Find the holes, if any, in the rest of the given file object.
+
+    Helper function for :func:`digest_stream`.
+
+    Args:
+      file_obj (file): File object opened for binary reading.
+    Returns:
+      list: ``(offset, length, is_data)`` tuples from
+      :func:`~COT.file_copy.data_extents` covering the rest of the file,
+      or ``None`` if the file isn't a regular file or has no holes.
+    """
+    try:
+        fd = file_obj.fileno()
+        position = file_obj.tell()
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+    extents = data_extents(fd, position)
+    if not any(not is_data for (_, _, is_data) in extents):
+        return None
+    return extents
+
+
+def _digest_sparse(file_obj, extents, digests, block_size):
+    """Update the given digests from a sparse file, without reading holes.
+
+    Helper function for :func:`digest_stream`.
+
+    Args:
+      file_obj (file): File object opened for binary reading.
+      extents (list): Result of :func:`_sparse_extents`.
+      digests (list): Hash objects to update.
+      block_size (int): Number of bytes to read or hash at a time.
+    """
+    zeros = memoryview(b'\0' * block_size)
+    for (offset, length, is_data) in extents:
+        if is_data:
+            file_obj.seek(offset)
+        while length > 0:
+            if is_data:
+                data = file_obj.read(min(length, block_size))
+                if not data:
+                    raise EOFError("File ended unexpectedly at offset {0}"
+                                   .format(file_obj.tell()))
+            else:
+                data = zeros[:min(length, block_size)]
+            for digest in digests:
+                digest.update(data)
+            length -= len(data)
+    file_obj.seek(0, os.SEEK_END)
+
+
+def digest_stream(file_obj, checksum_types, block_size=DEFAULT_BLOCK_SIZE):
+    """Compute one or more digests of the contents of the given file object.
+
+    All requested digests are computed from a single pass over the file.
+    If the file is sparse, its holes are hashed without being read.
+
+    Args:
+      file_obj (file): File object opened for binary reading.
+      checksum_types (list): Digest algorithms, such as ``['sha1']``
+          or ``['sha1', 'sha256']``. See :data:`CHECKSUM_TYPES`.
+      block_size (int): Number of bytes to read at a time.
+    Returns:
+      dict: ``{checksum_type: hexdigest}``
+    """
+    digests = dict((checksum_type, hashlib.new(checksum_type))
+                   for checksum_type in checksum_types)
+    extents = _sparse_extents(file_obj)
+    if extents is not None:
+        _digest_sparse(file_obj, extents, digests.values(), block_size)
+    elif hasattr(file_obj, 'readinto'):
+        # Reuse a single buffer rather than allocating one per read.
+        buf = bytearray(block_size)
+        view = memoryview(buf)
+        while True:
+            count = file_obj.readinto(buf)
+            if not count:
+                break
+            for digest in digests.values():
+                digest.update(view[:count])
+    else:
+        while True:
+            data = file_obj.read(block_size)
+            if not data:
+                break
+            for digest in digests.values():
+                digest.update(data)
+    return dict((checksum_type, digest.hexdigest())
+                for (checksum_type, digest) in digests.items())
+
+
+def parallel_map(func, items, workers):
+    """Call ``func`` on each of ``items`` using a pool of threads.
+
+    Args:
+      func (function): Function to call
+      items (list): Arguments to pass to ``func``, one at a time.
+      workers (int): Maximum number of threads to use.
+    Returns:
+      list: Results of ``func``, in the same order as ``items``.
+    """
+    workers = min(workers, len(items))
+    if workers <= 1:
+        return [func(item) for item in items]
+    # Some platforms lack the semaphore support needed by the pool
+    try:
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(workers)
+    except (ImportError, OSError) as e:
+        logger.debug("Unable to create thread pool (%s), "
+                     "working sequentially instead", e)
+        return [func(item) for item in items]
+    try:
+        return pool.map(func, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def digest_files(file_refs, checksum_types, cache=None, workers=None,
+                 block_size=DEFAULT_BLOCK_SIZE):
+    """Compute the digests of several files in parallel.
+
+    Each file is read at most once, no matter how many digest algorithms
+    are requested.
+
+    Args:
+      file_refs (list): :class:`~COT.file_reference.FileOnDisk`,
+          :class:`~COT.file_reference.FileInTAR`, or similar objects.
+      checksum_types (list): Digest algorithms, such as ``['sha1']``
+          or ``['sha1', 'sha256']``. See :data:`CHECKSUM_TYPES`.
+      cache (DigestCache): If specified, files whose digests are found in
+          this cache will not be re-read, and newly computed digests will be
+          stored into this cache.
+      workers (int): Maximum number of files to hash simultaneously.
+          If not specified, uses :func:`default_workers`.
+      block_size (int): Number of bytes to read at a time from each file.
+    Returns:
+      list: ``{checksum_type: hexdigest}`` dicts, in the same order as
+      ``file_refs``.
+    """
+    if workers is None:
+        workers = default_workers()
+    results = [{} for _ in file_refs]
+    keys = [None] * len(file_refs)
+    if cache is not None:
+        for (index, file_ref) in enumerate(file_refs):
+            keys[index] = file_ref.identity
+            results[index] = cache.get_many(keys[index], checksum_types)
+    missing = [[checksum_type for checksum_type in checksum_types
+                if checksum_type not in result] for result in results]
+    pending = [index for index in range(len(file_refs)) if missing[index]]
+
+    def _digest(index):
+        """Compute the missing digest(s) of a single file."""
+        file_ref = file_refs[index]
+        file_obj = file_ref.open('rb')
+        try:
+            return digest_stream(file_obj, missing[index], block_size)
+        finally:
+            file_ref.close()
+
+    logger.verbose("Computing %s digests of %d file(s) (%d cached) "
+                   "using up to %d threads", "/".join(checksum_types),
+                   len(pending), len(file_refs) - len(pending), workers)
+    for (index, digests) in zip(pending,
+                                parallel_map(_digest, pending, workers)):
+        results[index].update(digests)
+        if cache is not None:
+            for (checksum_type, hexdigest) in digests.items():
+                cache.put(keys[index], checksum_type, hexdigest)
+    return results
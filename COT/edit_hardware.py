@@ -642,6 +642,7 @@ class COTEditHardware(COTSubmodule):
         g.add_argument('-o', '--output',
                        help="Name/path of new OVF/OVA package to create "
                        "instead of updating the existing OVF")
+        self.add_package_arguments(p)
         g.add_argument('-v', '--virtual-system-type',
                        action='append', nargs='+',
                        type=no_whitespace, metavar=('TYPE', 'TYPE2'),
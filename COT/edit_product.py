@@ -160,6 +160,7 @@ Edit product information attributes of the given OVF or OVA""")
         p.add_argument('-o', '--output',
                        help="Name/path of new OVF/OVA package to create "
                        "instead of updating the existing OVF")
+        self.add_package_arguments(p)
         p.add_argument('-c', '--product-class',
                        help='Product class, such as "com.cisco.csr1000v"')
         p.add_argument('-p', '--product',
@@ -345,6 +345,7 @@ the program will run interactively.""",
         g.add_argument('-o', '--output',
                        help="Name/path of new OVF/OVA package to create "
                        "instead of updating the existing OVF")
+        self.add_package_arguments(p)
 
         g = p.add_argument_group("property setting options")
 
@@ -0,0 +1,577 @@
+#!/usr/bin/env python
+#
+# file_copy.py - Efficient copying of file data
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Efficient copying of file data, keeping it in the kernel where possible.
+
+Disk images are often many gigabytes in size, and copying them through
+Python-level reads and writes wastes a great deal of CPU time. Where the
+operating system supports it, the functions in this module instead ask the
+kernel to copy the data directly, trying each of the following strategies in
+turn and falling back to the next if the current one is unsupported:
+
+``reflink``
+  Clone the file, sharing the underlying storage (copy-on-write filesystems
+  such as Btrfs and XFS only; entire files only).
+``copy_file_range``
+  :func:`os.copy_file_range` (Linux, Python 3.8+).
+``sendfile``
+  :func:`os.sendfile` (Linux, Python 3.3+).
+``buffered``
+  Ordinary reads and writes, which work everywhere.
+
+Each function returns the name of the strategy that was used.
+
+Copies are sparse-aware: where the operating system can report the holes in
+a file (:data:`os.SEEK_DATA` and :data:`os.SEEK_HOLE`), only the regions
+that actually contain data are copied, and the holes are recreated in the
+destination rather than being filled in with zeros. This keeps the raw and
+flat disk images that COT creates and packages from ballooning to their
+full capacity on disk.
+
+**Functions**
+
+.. autosummary::
+  :nosignatures:
+
+  available_strategies
+  copy_file
+  copy_into_tarfile
+  copy_range
+  data_extents
+  link_or_copy_file
+
+**Constants**
+
+.. autosummary::
+  COPY_STRATEGIES
+  COPY_CHUNK_SIZE
+  LINK_MODES
+"""
+
+import copy
+import errno
+import io
+import logging
+import os
+import shutil
+import stat
+import sys
+import tarfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+_replace = getattr(os, 'replace', os.rename)
+
+COPY_STRATEGIES = ('reflink', 'copy_file_range', 'sendfile', 'buffered')
+"""Copy strategies supported by this module, in order of preference."""
+
+LINK_MODES = ('auto', 'copy', 'hardlink', 'reflink')
+"""Modes supported by :func:`link_or_copy_file`."""
+
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+"""Maximum number of bytes to copy in a single system call."""
+
+FICLONE = 0x40049409
+"""Linux ioctl request number for cloning a file (``_IOW(0x94, 9, int)``)."""
+
+# Errors indicating that a strategy is unsupported for the given files,
+# rather than that something has actually gone wrong.
+_UNSUPPORTED_ERRNOS = set(getattr(errno, name) for name in [
+    'ENOSYS', 'EXDEV', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP', 'ENOTTY',
+    'EBADF', 'ETXTBSY', 'EPERM', 'EMLINK',
+] if hasattr(errno, name))
+
+
+def available_strategies():
+    """Get the copy strategies supported by this platform and Python.
+
+    Returns:
+      list: Strategy names, a subset of :data:`COPY_STRATEGIES`, in order of
+      preference. Always includes ``'buffered'``.
+    """
+    linux = sys.platform.startswith('linux')
+    strategies = []
+    if fcntl is not None and linux:
+        strategies.append('reflink')
+    if hasattr(os, 'copy_file_range'):
+        strategies.append('copy_file_range')
+    if hasattr(os, 'sendfile') and linux:
+        # Other platforms only support sendfile() to a socket
+        strategies.append('sendfile')
+    strategies.append('buffered')
+    return strategies
+
+
+def _copy_chunk_copy_file_range(src_fd, dst_fd, src_offset, dst_offset,
+                                count):
+    """Copy up to ``count`` bytes with :func:`os.copy_file_range`."""
+    return os.copy_file_range(src_fd, dst_fd, count, src_offset, dst_offset)
+
+
+def _copy_chunk_sendfile(src_fd, dst_fd, src_offset, dst_offset, count):
+    """Copy up to ``count`` bytes with :func:`os.sendfile`."""
+    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, src_offset, count)
+
+
+def _copy_chunk_buffered(src_fd, dst_fd, src_offset, dst_offset, count):
+    """Copy up to ``count`` bytes through an ordinary buffer."""
+    os.lseek(src_fd, src_offset, os.SEEK_SET)
+    data = os.read(src_fd, min(count, 1024 * 1024))
+    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+    written = 0
+    while written < len(data):
+        written += os.write(dst_fd, data[written:])
+    return written
+
+
+_CHUNK_COPIERS = {
+    'copy_file_range': _copy_chunk_copy_file_range,
+    'sendfile': _copy_chunk_sendfile,
+    'buffered': _copy_chunk_buffered,
+}
+
+
+def _seek(fd, offset, whence):
+    """Like :func:`os.lseek`, but return ``None`` if there is no more data.
+
+    Raises:
+      ValueError: if ``whence`` is unsupported for this file.
+    """
+    try:
+        return os.lseek(fd, offset, whence)
+    except (IOError, OSError) as e:
+        if e.errno == errno.ENXIO:
+            return None
+        if e.errno in _UNSUPPORTED_ERRNOS:
+            raise ValueError(str(e))
+        raise
+
+
+def data_extents(fd, offset=0, length=None):
+    """Find the data regions and holes in a range of an open file.
+
+    Uses :data:`os.SEEK_DATA` and :data:`os.SEEK_HOLE` where available.
+    If the platform or filesystem cannot report holes, the entire range
+    is reported as data. The file position of ``fd`` is left unchanged.
+
+    Args:
+      fd (int): File descriptor of a regular file.
+      offset (int): Offset to start searching from.
+      length (int): Length of the range to search. Defaults to the rest of
+          the file.
+
+    Returns:
+      list: Tuples of ``(offset, length, is_data)``, in order, together
+      covering the whole requested range. Adjacent tuples always differ in
+      ``is_data``. Any portion of the range beyond the end of the file is
+      reported as a hole.
+    """
+    if length is None:
+        length = os.fstat(fd).st_size - offset
+    if length <= 0:
+        return []
+    if (not hasattr(os, 'SEEK_DATA') or
+            not stat.S_ISREG(os.fstat(fd).st_mode)):
+        return [(offset, length, True)]
+
+    original_position = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        return _find_extents(fd, offset, offset + length)
+    except ValueError as e:
+        logger.debug("Unable to find holes in file: %s", e)
+        return [(offset, length, True)]
+    finally:
+        os.lseek(fd, original_position, os.SEEK_SET)
+
+
+def _find_extents(fd, position, end):
+    """Worker function for :func:`data_extents`."""
+    extents = []
+    while position < end:
+        data_start = _seek(fd, position, os.SEEK_DATA)
+        if data_start is None or data_start >= end:
+            extents.append((position, end - position, False))
+            break
+        if data_start > position:
+            extents.append((position, data_start - position, False))
+        data_end = min(_seek(fd, data_start, os.SEEK_HOLE), end)
+        extents.append((data_start, data_end - data_start, True))
+        position = data_end
+    return extents
+
+
+def _copy_extent(src_fd, dst_fd, count, src_offset, dst_offset, strategies):
+    """Copy a contiguous range of bytes, falling back between strategies.
+
+    Helper function for :func:`copy_range`.
+
+    Returns:
+      list: The given ``strategies``, less any found to be unsupported.
+      The first entry is the strategy that completed the copy.
+    """
+    copied = 0
+    while True:
+        strategy = strategies[0]
+        try:
+            while copied < count:
+                result = _CHUNK_COPIERS[strategy](
+                    src_fd, dst_fd, src_offset + copied, dst_offset + copied,
+                    min(count - copied, COPY_CHUNK_SIZE))
+                if result == 0:
+                    raise EOFError("Unexpected end of file after {0} of {1} "
+                                   "bytes".format(copied, count))
+                copied += result
+            return strategies
+        except (IOError, OSError) as e:
+            if e.errno not in _UNSUPPORTED_ERRNOS or len(strategies) == 1:
+                raise
+            logger.debug("Copy strategy '%s' unsupported (%s), "
+                         "falling back to '%s'", strategy, e, strategies[1])
+            strategies = strategies[1:]
+
+
+def copy_range(src_fd, dst_fd, count, src_offset=0, dst_offset=0,
+               strategies=None, sparse=False):
+    """Copy a range of bytes from one open file to another.
+
+    Args:
+      src_fd (int): File descriptor to copy from.
+      dst_fd (int): File descriptor to copy to.
+      count (int): Number of bytes to copy.
+      src_offset (int): Offset in ``src_fd`` to start copying from.
+      dst_offset (int): Offset in ``dst_fd`` to start copying to.
+      strategies (list): Copy strategies to try, in order. Defaults to
+          :func:`available_strategies`. ``'reflink'`` is ignored, as it
+          only applies to entire files.
+      sparse (bool): If True, skip over any holes in the source range
+          (see :func:`data_extents`) rather than copying them, extending
+          ``dst_fd`` if needed so that the skipped regions read as zeros.
+          Only appropriate if the destination range is not yet part of
+          ``dst_fd`` (i.e., at or beyond its current end).
+
+    Returns:
+      str: Name of the strategy that completed the copy.
+
+    Raises:
+      EOFError: if ``src_fd`` contains fewer than ``count`` bytes
+          starting at ``src_offset``.
+      OSError: if copying fails for any reason other than the strategy
+          being unsupported, or if the ``'buffered'`` strategy fails.
+    """
+    if strategies is None:
+        strategies = available_strategies()
+    strategies = [s for s in strategies if s in _CHUNK_COPIERS]
+    if not sparse:
+        return _copy_extent(src_fd, dst_fd, count, src_offset, dst_offset,
+                            strategies)[0]
+
+    available = os.fstat(src_fd).st_size - src_offset
+    if available < count:
+        raise EOFError("Only {0} of {1} bytes available to copy"
+                       .format(max(available, 0), count))
+    for (offset, length, is_data) in data_extents(src_fd, src_offset, count):
+        if is_data:
+            strategies = _copy_extent(src_fd, dst_fd, length, offset,
+                                      dst_offset + offset - src_offset,
+                                      strategies)
+    if os.fstat(dst_fd).st_size < dst_offset + count:
+        os.ftruncate(dst_fd, dst_offset + count)
+    return strategies[0]
+
+
+def _reflink(src_fd, dst_fd):
+    """Clone the entire contents of one file into another.
+
+    Args:
+      src_fd (int): File descriptor to clone from.
+      dst_fd (int): File descriptor to clone to.
+
+    Returns:
+      bool: True if successful, False if unsupported for these files.
+
+    Raises:
+      IOError: if cloning failed for some other reason.
+    """
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except (IOError, OSError) as e:
+        if e.errno not in _UNSUPPORTED_ERRNOS:
+            raise
+        logger.debug("Unable to reflink: %s", e)
+        return False
+
+
+def _temp_path(dst_path):
+    """Get a temporary file path alongside the given destination path.
+
+    Files are created under this path and then moved into place, so that an
+    existing file at ``dst_path`` (which may be a hard link to another file)
+    is replaced rather than overwritten.
+
+    Args:
+      dst_path (str): Destination file path.
+
+    Returns:
+      str: Temporary file path in the same directory.
+    """
+    return "{0}.{1}.tmp".format(dst_path, os.getpid())
+
+
+def copy_file(src_path, dst_path, strategies=None):
+    """Copy a file and its permission bits, like :func:`shutil.copy`.
+
+    Unlike :func:`shutil.copy`, any holes in a sparse source file are
+    preserved in the copy, and any existing file at ``dst_path`` is
+    atomically replaced rather than overwritten in place.
+
+    Args:
+      src_path (str): File to copy.
+      dst_path (str): Destination directory or file path.
+      strategies (list): Copy strategies to try, in order. Defaults to
+          :func:`available_strategies`.
+
+    Returns:
+      str: Name of the strategy that completed the copy.
+
+    Raises:
+      shutil.Error: if ``src_path`` and ``dst_path`` are the same file.
+    """
+    if strategies is None:
+        strategies = available_strategies()
+    if os.path.isdir(dst_path):
+        dst_path = os.path.join(dst_path, os.path.basename(src_path))
+    if os.path.exists(dst_path) and os.path.samefile(src_path, dst_path):
+        raise shutil.Error("{0} and {1} are the same file"
+                           .format(src_path, dst_path))
+    temp_path = _temp_path(dst_path)
+    try:
+        with open(src_path, 'rb') as src:
+            with open(temp_path, 'wb') as dst:
+                if 'reflink' in strategies and _reflink(src.fileno(),
+                                                        dst.fileno()):
+                    strategy = 'reflink'
+                else:
+                    strategy = copy_range(src.fileno(), dst.fileno(),
+                                          os.fstat(src.fileno()).st_size,
+                                          strategies=strategies, sparse=True)
+        shutil.copymode(src_path, temp_path)
+        _replace(temp_path, dst_path)
+    finally:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+    logger.debug("Copied %s to %s using %s", src_path, dst_path, strategy)
+    return strategy
+
+
+def _try_reflink_file(src_path, dst_path):
+    """Try to create ``dst_path`` as a reflink clone of ``src_path``.
+
+    Any existing file at ``dst_path`` is atomically replaced.
+
+    Args:
+      src_path (str): File to clone.
+      dst_path (str): File path to create or overwrite.
+
+    Returns:
+      bool: True if successful, False if unsupported.
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return False
+    temp_path = _temp_path(dst_path)
+    try:
+        with open(src_path, 'rb') as src:
+            with open(temp_path, 'wb') as dst:
+                success = _reflink(src.fileno(), dst.fileno())
+        if success:
+            shutil.copymode(src_path, temp_path)
+            _replace(temp_path, dst_path)
+    finally:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+    return success
+
+
+def _try_hardlink_file(src_path, dst_path):
+    """Try to create ``dst_path`` as a hard link to ``src_path``.
+
+    Any existing file at ``dst_path`` is atomically replaced.
+
+    Args:
+      src_path (str): File to link to.
+      dst_path (str): File path to create or overwrite.
+
+    Returns:
+      bool: True if successful, False if unsupported.
+    """
+    if not hasattr(os, 'link'):
+        return False
+    temp_path = dst_path
+    if os.path.lexists(dst_path):
+        temp_path = _temp_path(dst_path)
+    try:
+        os.link(src_path, temp_path)
+    except (IOError, OSError) as e:
+        if e.errno not in _UNSUPPORTED_ERRNOS:
+            raise
+        logger.debug("Unable to hardlink: %s", e)
+        return False
+    if temp_path != dst_path:
+        _replace(temp_path, dst_path)
+    return True
+
+
+def _try_link_file(src_path, dst_path, mode):
+    """Try to link ``dst_path`` to ``src_path`` as requested.
+
+    Helper function for :func:`link_or_copy_file`.
+
+    Args:
+      src_path (str): File to link to.
+      dst_path (str): File path to create or overwrite.
+      mode (str): ``'hardlink'`` or ``'reflink'``.
+
+    Returns:
+      str: ``mode`` if successful, else ``None``.
+    """
+    dst_dir = os.path.dirname(os.path.abspath(dst_path))
+    if os.stat(src_path).st_dev != os.stat(dst_dir).st_dev:
+        logger.debug("%s and %s are on different filesystems",
+                     src_path, dst_dir)
+        return None
+    if mode == 'reflink' and _try_reflink_file(src_path, dst_path):
+        return 'reflink'
+    if mode == 'hardlink' and _try_hardlink_file(src_path, dst_path):
+        return 'hardlink'
+    return None
+
+
+def link_or_copy_file(src_path, dst_path, mode='auto'):
+    """Link a file to a new location if possible, otherwise copy it.
+
+    Args:
+      src_path (str): File to link or copy.
+      dst_path (str): Destination directory or file path.
+      mode (str): One of :data:`LINK_MODES`:
+
+          ``'auto'``
+            Create a reflink clone if supported, else copy the file.
+            Either way, the result is independent of ``src_path``.
+          ``'copy'``
+            Always copy the file, as with :func:`copy_file`.
+          ``'hardlink'``, ``'reflink'``
+            Create the requested type of link, falling back to copying
+            the file (with a warning) if this is not possible. A hard link
+            shares its contents with ``src_path``, so later changes to
+            either file in place affect both.
+
+    Returns:
+      str: ``'hardlink'``, ``'reflink'``, or the name of the copy strategy
+      used (see :func:`copy_file`). If ``dst_path`` already refers to the
+      same file as ``src_path``, returns ``'hardlink'`` without doing
+      anything.
+
+    Raises:
+      ValueError: if ``mode`` is not a recognized value.
+    """
+    if mode not in LINK_MODES:
+        raise ValueError("Unknown link mode '{0}'".format(mode))
+    if os.path.isdir(dst_path):
+        dst_path = os.path.join(dst_path, os.path.basename(src_path))
+    if os.path.exists(dst_path) and os.path.samefile(src_path, dst_path):
+        if (mode != 'hardlink' and
+                os.path.realpath(src_path) != os.path.realpath(dst_path)):
+            # Break the existing link rather than copying onto ourselves
+            os.remove(dst_path)
+        else:
+            logger.debug("%s is already linked to %s", dst_path, src_path)
+            return 'hardlink'
+    if mode == 'copy':
+        return copy_file(src_path, dst_path, strategies=[
+            s for s in available_strategies() if s != 'reflink'])
+    if mode == 'auto':
+        # copy_file() makes a reflink clone where possible
+        return copy_file(src_path, dst_path)
+
+    strategy = _try_link_file(src_path, dst_path, mode)
+    if strategy is None:
+        logger.warning("Unable to %s %s to %s; copying it instead",
+                       mode, src_path, dst_path)
+        return copy_file(src_path, dst_path)
+    logger.debug("Linked %s to %s using %s", src_path, dst_path, strategy)
+    return strategy
+
+
+# File object types that tarfile uses for uncompressed archives on disk.
+# Compressed archives wrap these in a (de)compressor, which we mustn't bypass.
+_PLAIN_FILE_TYPES = (io.FileIO, io.BufferedWriter, io.BufferedRandom)
+try:
+    _PLAIN_FILE_TYPES += (file, )     # noqa: F821 (Python 2 only)
+except NameError:
+    pass
+
+
+def copy_into_tarfile(tarf, tarinfo, src_fd, src_offset=0, strategies=None):
+    """Add a file to a TAR archive, copying its contents within the kernel.
+
+    Equivalent to ``tarf.addfile(tarinfo, fileobj)``, but copies the data
+    with :func:`copy_range` rather than through Python-level reads and
+    writes, and leaves any holes in the source file as holes in the
+    archive file. Falls back to :meth:`tarfile.TarFile.addfile` if the
+    archive is compressed or is not a regular file on disk.
+
+    Args:
+      tarf (tarfile.TarFile): Archive open for writing.
+      tarinfo (tarfile.TarInfo): Header describing the file to add.
+      src_fd (int): File descriptor to read the file contents from.
+      src_offset (int): Offset in ``src_fd`` of the file contents.
+      strategies (list): Copy strategies to try, in order. Defaults to
+          :func:`available_strategies`.
+
+    Returns:
+      str: Name of the strategy that completed the copy.
+    """
+    fileobj = tarf.fileobj
+    if not isinstance(fileobj, _PLAIN_FILE_TYPES):
+        with io.open(os.dup(src_fd), 'rb') as src:
+            src.seek(src_offset)
+            tarf.addfile(tarinfo, src)
+        return 'buffered'
+
+    # This mirrors the implementation of TarFile.addfile()
+    tarinfo = copy.copy(tarinfo)
+    buf = tarinfo.tobuf(tarf.format, tarf.encoding, tarf.errors)
+    fileobj.write(buf)
+    tarf.offset += len(buf)
+    fileobj.flush()
+    position = fileobj.tell()
+    strategy = copy_range(src_fd, fileobj.fileno(), tarinfo.size,
+                          src_offset=src_offset, dst_offset=position,
+                          strategies=strategies, sparse=True)
+    fileobj.seek(position + tarinfo.size)
+    blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+    if remainder > 0:
+        fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+        blocks += 1
+    tarf.offset += blocks * tarfile.BLOCKSIZE
+    tarf.members.append(tarinfo)
+    return strategy
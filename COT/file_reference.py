@@ -14,19 +14,115 @@
 # of COT, including this file, may be copied, modified, propagated, or
 # distributed except according to the terms contained in the LICENSE.txt file.
 
-"""Wrapper classes to abstract away differences between file sources."""
+"""Wrapper classes to abstract away differences between file sources.
 
+**Classes**
+
+.. autosummary::
+  :nosignatures:
+
+  FileReference
+  FileOnDisk
+  FileInTAR
+  FileInStream
+  FileSpan
+  SpanReader
+  TarIndex
+  TarMemberReader
+  TarStream
+
+**Functions**
+
+.. autosummary::
+  :nosignatures:
+
+  chunk_file_name
+
+**Constants**
+
+.. autosummary::
+  STREAM_PATH
+"""
+
+import bisect
+import io
 import logging
 import os
 import shutil
 import tarfile
+import threading
+import time
 
 from contextlib import closing
 
+from COT.compression import open_decompressed
+from COT.digest import (
+    HashingReader, default_workers, parallel_map, path_identity,
+)
+from COT.file_copy import copy_into_tarfile, copy_range, link_or_copy_file
+from COT.http_file import is_url, open_url
+
 logger = logging.getLogger(__name__)
 
+STREAM_PATH = '-'
+"""Path denoting standard input, when reading, or standard output."""
+
+
+if hasattr(os, 'pread'):
+    _pread = os.pread
+else:
+    def _pread(fd, size, offset):
+        """Fallback for :func:`os.pread` on platforms/versions without it."""
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+
+def _stream_copy(file_ref, dest_path):
+    """Copy the contents of a file reference by reading it sequentially.
+
+    Used for remote files, which can't be copied by the kernel.
+
+    Args:
+      file_ref (FileReference): File to copy.
+      dest_path (str): Destination file path.
+    """
+    with open(dest_path, 'wb') as dest:
+        try:
+            shutil.copyfileobj(file_ref.open('rb'), dest, 1024 * 1024)
+        finally:
+            file_ref.close()
+
+
+class FileReference(object):
+    """Base class for references to a file, wherever it is stored."""
+
+    compression = None
+    """Compression (one of :data:`COT.compression.COMPRESSION_TYPES`)
+    applied to the stored contents of this file, or ``None``."""
+
+    def open(self, mode):
+        """Open the file and return a reference to the file object.
+
+        Args:
+          mode (str): Mode such as 'r', 'w', 'a', 'w+', etc.
+        Returns:
+          file: File object
+        """
+        raise NotImplementedError("open() not implemented")
+
+    def open_decompressed(self):
+        """Open the file for reading its contents after any decompression.
 
-class FileOnDisk(object):
+        Use :meth:`close` to close the file when done.
+
+        Returns:
+          file: File object that decompresses the stored contents as they
+          are read, according to :attr:`compression`.
+        """
+        return open_decompressed(self.open('rb'), self.compression)
+
+
+class FileOnDisk(FileReference):
     """Wrapper for a 'real' file on disk."""
 
     def __init__(self, file_path, filename=None):
@@ -92,6 +188,21 @@ class FileOnDisk(object):
         """The size of this file, in bytes."""
         return os.path.getsize(self.file_path)
 
+    @property
+    def extents(self):
+        """List of ``(path, offset, length)`` locations of this file's data."""
+        size = self.size
+        return [(self.file_path, 0, size)] if size else []
+
+    @property
+    def identity(self):
+        """Tuple identifying the current contents of this file.
+
+        Used as a key for caching file digests; see
+        :func:`COT.digest.path_identity`.
+        """
+        return path_identity(self.file_path)
+
     def open(self, mode):
         """Open the file and return a reference to the file object.
 
@@ -107,51 +218,398 @@ class FileOnDisk(object):
         """Close the file previously opened."""
         self.obj.close()
 
-    def copy_to(self, dest_dir):
+    def copy_to(self, dest_dir, link_mode='copy'):
         """Copy this file to the given destination directory.
 
         Args:
           dest_dir (str): Destination directory or filename.
+          link_mode (str): Whether to hardlink or reflink the file rather
+              than copying it; see :func:`COT.file_copy.link_or_copy_file`.
         """
         if self.file_path == os.path.join(dest_dir, self.filename):
             return
         logger.info("Copying %s to %s", self.file_path, dest_dir)
-        shutil.copy(self.file_path, dest_dir)
+        strategy = link_or_copy_file(self.file_path, dest_dir, link_mode)
+        logger.verbose("Copied %s using %s", self.filename, strategy)
 
-    def add_to_archive(self, tarf):
+    def add_to_archive(self, tarf, checksum_types=()):
         """Copy this file into the given tarfile object.
 
         Args:
           tarf (tarfile.TarFile): Add this file to that archive.
+          checksum_types (list): Digest algorithms (such as 'sha1') to
+              compute from the file contents as they are copied.
+        Returns:
+          dict: ``{checksum_type: hexdigest}`` for each of ``checksum_types``
         """
         logger.info("Adding %s to TAR file as %s",
                     self.file_path, self.filename)
-        tarf.add(self.file_path, self.filename)
+        tarinfo = tarf.gettarinfo(self.file_path, self.filename)
+        with open(self.file_path, 'rb') as file_obj:
+            if not checksum_types:
+                strategy = copy_into_tarfile(tarf, tarinfo, file_obj.fileno())
+                logger.verbose("Copied %s using %s", self.filename, strategy)
+                return {}
+            reader = HashingReader(file_obj, checksum_types)
+            tarf.addfile(tarinfo, reader)
+        return reader.hexdigests()
 
 
-class FileInTAR(object):
-    """Wrapper for a file inside a TAR archive or OVA."""
+class TarIndex(object):
+    """Index of the members of a TAR archive, built with a single header scan.
 
-    def __init__(self, tarfile_path, filename):
-        """Create a reference to a file contained in a TAR archive.
+    Many :class:`FileInTAR` objects may refer to the same (potentially very
+    large) archive; by sharing a single index between them, the TAR headers
+    only need to be walked once, rather than once per query per file.
+
+    The index remembers the size and modification time of the archive
+    and transparently rebuilds itself if the archive changes on disk.
+    The archive may also be an ``http://`` or ``https://`` URL, in which case
+    only the TAR headers are downloaded (see :mod:`COT.http_file`); such an
+    archive is assumed not to change while in use.
+    """
+
+    def __init__(self, tarfile_path):
+        """Scan the given TAR archive and index its members.
+
+        Args:
+          tarfile_path (str): Path or URL of TAR archive to index
+
+        Raises:
+          IOError: if ``tarfile_path`` doesn't reference a TAR file.
+        """
+        self.tarfile_path = tarfile_path
+        self._remote = open_url(tarfile_path) if is_url(tarfile_path) else None
+        self._stat = None
+        self._members = []
+        self._by_name = {}
+        self.refresh()
+
+    def _stat_key(self):
+        """Get the (size, mtime, inode) of the archive, for change detection.
+
+        Returns:
+          tuple: (size, mtime, inode)
+        """
+        if self._remote is not None:
+            return (self._remote.size, self._remote.validator, None)
+        stat = os.stat(self.tarfile_path)
+        return (stat.st_size, stat.st_mtime, stat.st_ino)
+
+    def refresh(self, force=False):
+        """Rebuild the index if the archive has changed since it was built.
+
+        Args:
+          force (bool): If True, rebuild the index unconditionally.
+
+        Raises:
+          IOError: if ``tarfile_path`` doesn't reference a TAR file.
+        """
+        stat_key = self._stat_key()
+        if stat_key == self._stat and not force:
+            return
+        logger.debug("Indexing members of TAR file %s", self.tarfile_path)
+        if self._remote is not None:
+            self._members = self._remote_members()
+        else:
+            if not tarfile.is_tarfile(self.tarfile_path):
+                raise IOError("{0} is not a valid TAR file."
+                              .format(self.tarfile_path))
+            with closing(tarfile.open(self.tarfile_path, 'r')) as tarf:
+                self._members = tarf.getmembers()
+        self._by_name = {}
+        # If a name appears more than once, the last entry wins,
+        # same as tarfile.getmember().
+        for mem in self._members:
+            self._by_name[os.path.normpath(mem.name)] = mem
+        self._stat = stat_key
+
+    def _remote_members(self):
+        """Read the headers of a remote archive.
+
+        Returns:
+          list: :class:`tarfile.TarInfo` members, in archive order.
+        Raises:
+          IOError: if the remote file is not a TAR file.
+        """
+        reader = io.BufferedReader(
+            SpanReader([(self.tarfile_path, 0, self._remote.size)]))
+        try:
+            # Only the headers are read, as tarfile seeks past the data
+            with closing(tarfile.open(fileobj=reader, mode='r:')) as tarf:
+                return tarf.getmembers()
+        except tarfile.TarError:
+            raise IOError("{0} is not a valid TAR file."
+                          .format(self.tarfile_path))
+        finally:
+            reader.close()
+
+    @property
+    def identity(self):
+        """Tuple identifying the current contents of this archive.
+
+        See :func:`COT.digest.path_identity` and
+        :attr:`COT.http_file.HTTPFile.identity`.
+        """
+        if self._remote is not None:
+            return self._remote.identity
+        return path_identity(self.tarfile_path, 'tar')
+
+    @property
+    def members(self):
+        """List of :class:`tarfile.TarInfo` members, in archive order."""
+        self.refresh()
+        return list(self._members)
+
+    def getmember(self, filename):
+        """Look up the given member of the archive.
+
+        Args:
+          filename (str): File name in the TAR archive. Names are compared
+              after normalization, so ``'./foo.txt'`` matches ``'foo.txt'``.
+        Returns:
+          tarfile.TarInfo: Member header (name, size, offset, offset_data)
+        Raises:
+          KeyError: if no such member exists.
+        """
+        self.refresh()
+        return self._by_name[os.path.normpath(filename)]
+
+    def __contains__(self, filename):
+        """Check whether the given filename is a member of the archive.
+
+        Args:
+          filename (str): File name in the TAR archive.
+        Returns:
+          bool: True if the archive contains such a member, else False.
+        """
+        try:
+            self.getmember(filename)
+            return True
+        except KeyError:
+            return False
+
+
+class SpanReader(io.RawIOBase):
+    """Read-only file object for a series of byte ranges of other files.
+
+    Presents data stored in several places, such as a member of a TAR
+    archive or the chunks of an OVF chunked file, as a single seekable
+    stream, using positional reads (:func:`os.pread`) on each file.
+    Files may also be ``http://`` or ``https://`` URLs, which are read
+    using :meth:`COT.http_file.HTTPFile.pread`.
+    """
+
+    def __init__(self, extents):
+        """Open the files containing the given byte ranges for reading.
+
+        Args:
+          extents (list): ``(path, offset, length)`` tuples, in order.
+              Each path may be a local file path or a URL.
+
+        Raises:
+          OSError: if any of the local files cannot be opened.
+          IOError: if any of the remote files cannot be accessed.
+        """
+        super(SpanReader, self).__init__()
+        self._extents = [extent for extent in extents if extent[2] > 0]
+        self._starts = []
+        self._size = 0
+        for extent in self._extents:
+            self._starts.append(self._size)
+            self._size += extent[2]
+        self._pos = 0
+        self._fds = {}
+        try:
+            for (path, _, _) in self._extents:
+                if path in self._fds:
+                    continue
+                if is_url(path):
+                    self._fds[path] = open_url(path)
+                else:
+                    self._fds[path] = os.open(
+                        path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        except (OSError, IOError):
+            self.close()
+            raise
+
+    def readable(self):
+        """Spans are always readable.
+
+        Returns:
+          bool: True
+        """
+        return True
+
+    def seekable(self):
+        """Spans are always seekable.
+
+        Returns:
+          bool: True
+        """
+        return True
+
+    def tell(self):
+        """Get the current position within the span.
+
+        Returns:
+          int: Offset from the start of the span
+        """
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """Change the current position within the span.
+
+        Args:
+          offset (int): Offset relative to ``whence``
+          whence (int): :data:`io.SEEK_SET`, :data:`io.SEEK_CUR`, or
+              :data:`io.SEEK_END`
+        Returns:
+          int: New offset from the start of the span
+        Raises:
+          ValueError: if ``whence`` is invalid or the resulting position
+              would be negative.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self._size + offset
+        else:
+            raise ValueError("Invalid whence ({0})".format(whence))
+        if pos < 0:
+            raise ValueError("Negative seek position {0}".format(pos))
+        self._pos = pos
+        return self._pos
+
+    def _locate(self, size):
+        """Find where to read up to ``size`` bytes from the current position.
+
+        Args:
+          size (int): Maximum number of bytes desired.
+        Returns:
+          tuple: ``(fd, offset, count)`` to read, where ``count`` is limited
+          to the end of the extent containing the current position and
+          will be 0 at the end of the span. ``fd`` is a file descriptor, or
+          a :class:`~COT.http_file.HTTPFile` for a remote file.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if self._pos >= self._size or size == 0:
+            return (None, 0, 0)
+        index = bisect.bisect_right(self._starts, self._pos) - 1
+        (path, offset, length) = self._extents[index]
+        skip = self._pos - self._starts[index]
+        return (self._fds[path], offset + skip, min(size, length - skip))
+
+    def read(self, size=-1):
+        """Read up to ``size`` bytes from the current position.
+
+        Args:
+          size (int): Number of bytes to read; if negative or omitted,
+              read to the end of the span.
+        Returns:
+          bytes: Data read, which will be empty at the end of the span.
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        remaining = max(self._size - self._pos, 0)
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        pieces = []
+        while size > 0:
+            (fd, offset, count) = self._locate(size)
+            if isinstance(fd, int):
+                data = _pread(fd, count, offset)
+            else:
+                data = fd.pread(count, offset)
+            if not data:
+                break
+            pieces.append(data)
+            self._pos += len(data)
+            size -= len(data)
+        return b''.join(pieces)
+
+    def readinto(self, buf):
+        """Read bytes from the current position into the given buffer.
+
+        Args:
+          buf (bytearray): Buffer to fill
+        Returns:
+          int: Number of bytes read, which will be 0 at the end of the span.
+        """
+        (fd, offset, count) = self._locate(len(buf))
+        if count == 0:
+            return 0
+        if not hasattr(os, 'preadv') or not isinstance(fd, int):
+            data = self.read(count)
+            buf[:len(data)] = data
+            return len(data)
+        # Read directly into the caller's buffer, avoiding a copy
+        count = os.preadv(fd, [memoryview(buf)[:count]], offset)
+        self._pos += count
+        return count
+
+    def close(self):
+        """Close the underlying file descriptors."""
+        if not self.closed:
+            for fd in self._fds.values():
+                if isinstance(fd, int):
+                    os.close(fd)
+            self._fds = {}
+        super(SpanReader, self).close()
+
+
+class TarMemberReader(SpanReader):
+    """Read-only file object for a single member of an uncompressed TAR.
+
+    Since the members of an OVA are stored uncompressed and contiguously,
+    the member's bytes can be served directly from the archive at the data
+    offset recorded in its header, using positional reads (:func:`os.pread`)
+    rather than going through :mod:`tarfile` and its bookkeeping.
+    """
+
+    def __init__(self, tarfile_path, member):
+        """Open the TAR archive for reading the given member.
 
         Args:
           tarfile_path (str): Path to TAR archive to read
+          member (tarfile.TarInfo): Header of the member to read
+        """
+        super(TarMemberReader, self).__init__(
+            [(tarfile_path, member.offset_data, member.size)])
+        self.name = member.name
+
+
+class FileInTAR(FileReference):
+    """Wrapper for a file inside a (local or remote) TAR archive or OVA."""
+
+    def __init__(self, tarfile_path, filename, tar_index=None):
+        """Create a reference to a file contained in a TAR archive.
+
+        Args:
+          tarfile_path (str): Path or URL of TAR archive to read
           filename (str): File name in the TAR archive.
+          tar_index (TarIndex): Existing index of ``tarfile_path`` to share
+              with other references into the same archive. If not specified,
+              a new index will be created.
 
         Raises:
           IOError: if ``tarfile_path`` doesn't reference a TAR file,
               or the TAR file does not contain ``filename``.
         """
-        if not tarfile.is_tarfile(tarfile_path):
-            raise IOError("{0} is not a valid TAR file.".format(tarfile_path))
+        if tar_index is None:
+            tar_index = TarIndex(tarfile_path)
+        self.tar_index = tar_index
         self.tarfile_path = tarfile_path
         self.filename = os.path.normpath(filename)
         if not self.exists:
             raise IOError("{0} does not exist in {1}"
                           .format(filename, tarfile_path))
         self.file_path = None
-        self.tarf = None
         self.obj = None
 
     def __eq__(self, other):
@@ -182,25 +640,52 @@ class FileInTAR(object):
     @property
     def exists(self):
         """True if the file exists in the TAR archive, else False."""
-        with closing(tarfile.open(self.tarfile_path, 'r')) as tarf:
-            try:
-                tarf.getmember(self.filename)
-                return True
-            except KeyError:
-                # Perhaps an issue with 'foo.txt' versus './foo.txt'?
-                for mem in tarf.getmembers():
-                    if os.path.normpath(mem.name) == self.filename:
-                        logger.verbose("Found {0} at {1} in TAR file"
-                                       .format(self.filename, mem.name))
-                        self.filename = mem.name
-                        return True
-                return False
+        try:
+            mem = self.member
+        except KeyError:
+            return False
+        # Perhaps an issue with 'foo.txt' versus './foo.txt'?
+        if mem.name != self.filename:
+            logger.verbose("Found {0} at {1} in TAR file"
+                           .format(self.filename, mem.name))
+            self.filename = mem.name
+        return True
+
+    @property
+    def member(self):
+        """The :class:`tarfile.TarInfo` header describing this file.
+
+        Raises:
+          KeyError: if the file is not present in the TAR archive.
+        """
+        return self.tar_index.getmember(self.filename)
 
     @property
     def size(self):
         """The size of this file in bytes."""
-        with closing(tarfile.open(self.tarfile_path, 'r')) as tarf:
-            return tarf.getmember(self.filename).size
+        return self.member.size
+
+    @property
+    def extents(self):
+        """List of ``(path, offset, length)`` locations of this file's data."""
+        member = self.member
+        if not member.size:
+            return []
+        return [(self.tarfile_path, member.offset_data, member.size)]
+
+    @property
+    def identity(self):
+        """Tuple identifying the current contents of this file.
+
+        Used as a key for caching file digests. Consists of the identity of
+        the TAR archive (see :func:`COT.digest.path_identity`) plus the
+        location of this file within the archive.
+        """
+        archive_identity = self.tar_index.identity
+        if archive_identity is None:
+            return None
+        member = self.member
+        return archive_identity + (member.offset_data, member.size)
 
     def open(self, mode):
         """Open the TAR and return a reference to the relevant file object.
@@ -215,43 +700,742 @@ class FileInTAR(object):
         # We can only extract a file object from a TAR file in read mode.
         if mode != 'r' and mode != 'rb':
             raise ValueError("FileInTar.open() only supports 'r'/'rb' mode")
-        self.tarf = tarfile.open(self.tarfile_path, 'r')
-        self.obj = self.tarf.extractfile(self.filename)
+        self.obj = io.BufferedReader(TarMemberReader(self.tarfile_path,
+                                                     self.member))
         return self.obj
 
     def close(self):
         """Close the file object previously opened."""
-        if self.tarf is not None:
-            self.tarf.close()
-            self.tarf = None
         if self.obj is not None:
             self.obj.close()
             self.obj = None
 
-    def copy_to(self, dest_dir):
+    def copy_to(self, dest_dir, link_mode='copy'):
         """Extract this file to the given destination directory.
 
         Args:
           dest_dir (str): Destination directory or filename.
+          link_mode (str): Ignored, as a file inside a TAR archive can
+              only be copied, not linked.
         """
-        with closing(tarfile.open(self.tarfile_path, 'r')) as tarf:
-            logger.info("Extracting %s from %s to %s",
-                        self.filename, self.tarfile_path, dest_dir)
-            tarf.extract(self.filename, dest_dir)
+        # pylint: disable=unused-argument
+        if os.path.isdir(dest_dir):
+            dest_path = os.path.join(dest_dir, self.filename)
+        else:
+            dest_path = dest_dir
+        if not os.path.isdir(os.path.dirname(dest_path)):
+            os.makedirs(os.path.dirname(dest_path))
+        logger.info("Extracting %s from %s to %s",
+                    self.filename, self.tarfile_path, dest_dir)
+        member = self.member
+        if is_url(self.tarfile_path):
+            _stream_copy(self, dest_path)
+            strategy = 'download'
+        else:
+            with open(self.tarfile_path, 'rb') as src:
+                with open(dest_path, 'wb') as dest:
+                    strategy = copy_range(src.fileno(), dest.fileno(),
+                                          member.size,
+                                          src_offset=member.offset_data,
+                                          sparse=True)
+        os.utime(dest_path, (member.mtime, member.mtime))
+        logger.verbose("Extracted %s using %s", self.filename, strategy)
 
-    def add_to_archive(self, tarf):
+    def add_to_archive(self, tarf, checksum_types=()):
         """Copy this file into the given tarfile object.
 
         Args:
           tarf (tarfile.TarFile): Add this file to that archive.
+          checksum_types (list): Digest algorithms (such as 'sha1') to
+              compute from the file contents as they are copied.
+        Returns:
+          dict: ``{checksum_type: hexdigest}`` for each of ``checksum_types``
         """
+        logger.info("Copying %s directly from %s to TAR file",
+                    self.filename, self.tarfile_path)
+        if not checksum_types and not is_url(self.tarfile_path):
+            member = self.member
+            with open(self.tarfile_path, 'rb') as src:
+                strategy = copy_into_tarfile(tarf, member, src.fileno(),
+                                             src_offset=member.offset_data)
+            logger.verbose("Copied %s using %s", self.filename, strategy)
+            return {}
         self.open('r')
         try:
-            logger.info("Copying %s directly from %s to TAR file",
-                        self.filename, self.tarfile_path)
-            tarf.addfile(self.tarf.getmember(self.filename), self.obj)
+            reader = HashingReader(self.obj, checksum_types)
+            tarf.addfile(self.member, reader)
+        finally:
+            self.close()
+        return reader.hexdigests()
+
+
+class TarStream(object):
+    """Sequential reader of the members of a TAR archive from a stream.
+
+    Allows an OVA to be read from a pipe, such as standard input, which
+    can't be seeked. Each member can only be read as the stream reaches it,
+    so to read members out of order, any :attr:`wanted` member that is
+    passed over on the way to another member is spilled to a temporary
+    file in :attr:`spill_dir`, to be read later. Other members are skipped.
+
+    Only one member can be read from the stream at a time; opening another
+    member blocks until the previous one is closed.
+    """
+
+    def __init__(self, file_obj):
+        """Start reading a TAR archive from the given stream.
+
+        Args:
+          file_obj (file): Binary stream to read from.
+
+        Raises:
+          IOError: if the stream doesn't contain a TAR archive.
+        """
+        try:
+            self._tarf = tarfile.open(fileobj=file_obj, mode='r|')
+        except tarfile.TarError as e:
+            raise IOError("Stream does not contain a valid TAR archive: {0}"
+                          .format(e))
+        self.wanted = set()
+        """Names of members to spill to disk, if passed over, for later."""
+        self.spill_dir = None
+        """Directory to spill passed-over :attr:`wanted` members into."""
+        self._current = None
+        self._ended = False
+        self._spilled = {}
+        self._passed = set()
+        self._lock = threading.Lock()
+
+    def _next(self):
+        """Advance the stream to its next member, which must be safe.
+
+        Returns:
+          tarfile.TarInfo: Header of the next member, or ``None`` at the
+          end of the archive.
+
+        Raises:
+          IOError: if the member's path is absolute or escapes the archive.
+        """
+        if self._ended:
+            return None
+        member = self._tarf.next()
+        if member is None:
+            self._ended = True
+        else:
+            norm_path = os.path.normpath(member.name)
+            if (os.path.isabs(norm_path) or norm_path == os.pardir or
+                    norm_path.startswith(os.pardir + os.sep)):
+                raise IOError("TAR stream contains unsafe file path '{0}'"
+                              .format(member.name))
+        return member
+
+    def _pass_current(self):
+        """Move past the current member, spilling it to disk if wanted."""
+        member = self._current
+        name = os.path.normpath(member.name)
+        if name not in self.wanted or not member.isfile():
+            self._current = None
+            self._passed.add(name)
+            return
+        if self.spill_dir is None:
+            raise IOError("Unable to read {0} out of order from the stream"
+                          .format(name))
+        self._current = None
+        path = os.path.join(self.spill_dir, 'stream', name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        logger.verbose("Saving %s from the stream to read later", name)
+        with open(path, 'wb') as dest:
+            shutil.copyfileobj(self._tarf.extractfile(member), dest,
+                               1024 * 1024)
+        self._spilled[name] = (member, path)
+
+    def _find(self, filename):
+        """Advance the stream to the given member, if not already passed.
+
+        Args:
+          filename (str): File name in the TAR archive.
+        Returns:
+          tarfile.TarInfo: Header of the member.
+        Raises:
+          IOError: if the member was already passed over, or not found.
+        """
+        name = os.path.normpath(filename)
+        while True:
+            if name in self._spilled:
+                return self._spilled[name][0]
+            if name in self._passed:
+                raise IOError("{0} has already been read from the stream"
+                              .format(name))
+            if self._current is not None:
+                if os.path.normpath(self._current.name) == name:
+                    return self._current
+                self._pass_current()
+            self._current = self._next()
+            if self._current is None:
+                raise IOError("{0} was not found in the TAR stream"
+                              .format(name))
+
+    def peek(self):
+        """Get the header of the next member to be read from the stream.
+
+        Returns:
+          tarfile.TarInfo: Header of the member, or ``None`` at the end of
+          the archive.
+        """
+        with self._lock:
+            if self._current is None:
+                self._current = self._next()
+            return self._current
+
+    def may_contain(self, filename):
+        """Check whether the given member might still be read from the stream.
+
+        Args:
+          filename (str): File name in the TAR archive.
+        Returns:
+          bool: False if the member was already read or passed over, or
+          if the end of the stream was reached without finding it.
+        """
+        return os.path.normpath(filename) not in self._passed
+
+    def getmember(self, filename):
+        """Look up the given member, advancing the stream as needed.
+
+        Args:
+          filename (str): File name in the TAR archive.
+        Returns:
+          tarfile.TarInfo: Header of the member.
+        Raises:
+          IOError: if the member can no longer be read, or was not found.
+        """
+        with self._lock:
+            return self._find(filename)
+
+    def open(self, filename):
+        """Open the given member for reading.
+
+        Args:
+          filename (str): File name in the TAR archive.
+        Returns:
+          file: File object, which must be closed before any other member
+          can be read.
+        Raises:
+          IOError: if the member can no longer be read, or was not found.
+        """
+        self._lock.acquire()
+        try:
+            member = self._find(filename)
+            name = os.path.normpath(filename)
+            if name in self._spilled:
+                spilled = open(self._spilled[name][1], 'rb')
+                self._lock.release()
+                return spilled
+            self._current = None
+            self._passed.add(name)
+            return _StreamMemberReader(self._tarf.extractfile(member),
+                                       self._lock)
+        except Exception:
+            self._lock.release()
+            raise
+
+
+class _StreamMemberReader(io.RawIOBase):
+    """File object for the member at the head of a :class:`TarStream`.
+
+    Holds the stream's lock until closed.
+    """
+
+    def __init__(self, file_obj, lock):
+        """Wrap the given file object.
+
+        Args:
+          file_obj (file): Member file object from :mod:`tarfile`.
+          lock (threading.Lock): Acquired lock to release when closed.
+        """
+        super(_StreamMemberReader, self).__init__()
+        self._file_obj = file_obj
+        self._lock = lock
+
+    def readable(self):
+        """Streams are always readable.
+
+        Returns:
+          bool: True
+        """
+        return True
+
+    def readinto(self, buf):
+        """Read bytes into the given buffer.
+
+        Args:
+          buf (bytearray): Buffer to fill
+        Returns:
+          int: Number of bytes read, which will be 0 at the end of the file.
+        """
+        data = self._file_obj.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        """Release the stream for reading other members."""
+        if not self.closed:
+            self._lock.release()
+        super(_StreamMemberReader, self).close()
+
+
+class FileInStream(FileReference):
+    """Wrapper for a file in a TAR archive being read from a stream.
+
+    See :class:`TarStream`. The file can only be read once, and is not
+    available to be read again unless it was spilled to disk.
+    """
+
+    def __init__(self, tar_stream, filename, size=None):
+        """Create a reference to a file in a TAR stream.
+
+        The stream is not read until the file's contents are needed.
+
+        Args:
+          tar_stream (TarStream): Stream containing the file.
+          filename (str): File name in the TAR archive.
+          size (int): Expected size of the file, if known in advance.
+        """
+        self.tar_stream = tar_stream
+        self.filename = os.path.normpath(filename)
+        self.expected_size = size
+        self.file_path = None
+        self.obj = None
+
+    def __eq__(self, other):
+        """FileInStream are equal if they have the same filename and stream.
+
+        Args:
+          other (object): Other object to compare against
+        Returns:
+          bool: True if filename and tar_stream are the same, else False
+        """
+        return (type(other) is type(self) and
+                self.tar_stream is other.tar_stream and
+                self.filename == other.filename)
+
+    def __ne__(self, other):
+        """FileInStream are not equal if they have different names or streams.
+
+        Args:
+          other (object): Other object to compare against
+        Returns:
+          bool: False if filename and tar_stream are the same, else True
+        """
+        return not self.__eq__(other)
+
+    @property
+    def exists(self):
+        """False if the file is known to be no longer available, else True."""
+        return self.tar_stream.may_contain(self.filename)
+
+    @property
+    def size(self):
+        """The size of this file in bytes.
+
+        If the size is not known in advance, the stream is read up to
+        this file to find out.
+        """
+        if self.expected_size is not None:
+            return self.expected_size
+        return self.tar_stream.getmember(self.filename).size
+
+    @property
+    def extents(self):
+        """Not available for a file in a stream.
+
+        Raises:
+          IOError: always, as the file has no fixed location to refer to.
+        """
+        raise IOError("{0} cannot be split into chunks when read from a "
+                      "stream".format(self.filename))
+
+    identity = None
+    """A file in a stream can't be identified for caching its digests."""
+
+    def open(self, mode):
+        """Read up to this file in the stream and open it for reading.
+
+        Args:
+          mode (str): Only 'r' and 'rb' modes are supported.
+        Returns:
+          file: File object
+        Raises:
+          ValueError: if ``mode`` is not valid.
+        """
+        if mode != 'r' and mode != 'rb':
+            raise ValueError("FileInStream.open() only supports 'r'/'rb' "
+                             "mode")
+        self.obj = io.BufferedReader(self.tar_stream.open(self.filename))
+        return self.obj
+
+    def close(self):
+        """Close the file object previously opened."""
+        if self.obj is not None:
+            self.obj.close()
+            self.obj = None
+
+    def _member(self):
+        """Get the TAR header of this file, checking its size.
+
+        Returns:
+          tarfile.TarInfo: Header
+        Raises:
+          IOError: if the size is not the expected size.
+        """
+        member = self.tar_stream.getmember(self.filename)
+        if (self.expected_size is not None and
+                member.size != self.expected_size):
+            raise IOError("Size of {0} in the stream ({1}) does not match "
+                          "its expected size ({2})"
+                          .format(self.filename, member.size,
+                                  self.expected_size))
+        return member
+
+    def copy_to(self, dest_dir, link_mode='copy'):
+        """Write this file out to the given destination directory.
+
+        Args:
+          dest_dir (str): Destination directory or filename.
+          link_mode (str): Ignored, as the file can only be copied.
+        """
+        # pylint: disable=unused-argument
+        if os.path.isdir(dest_dir):
+            dest_path = os.path.join(dest_dir, self.filename)
+        else:
+            dest_path = dest_dir
+        logger.info("Copying %s from stream to %s", self.filename, dest_path)
+        member = self._member()
+        _stream_copy(self, dest_path)
+        os.utime(dest_path, (member.mtime, member.mtime))
+
+    def add_to_archive(self, tarf, checksum_types=()):
+        """Copy this file into the given tarfile object as it is read.
+
+        Args:
+          tarf (tarfile.TarFile): Add this file to that archive.
+          checksum_types (list): Digest algorithms (such as 'sha1') to
+              compute from the file contents as they are copied.
+        Returns:
+          dict: ``{checksum_type: hexdigest}`` for each of ``checksum_types``
+        """
+        logger.info("Copying %s from stream to TAR file", self.filename)
+        member = self._member()
+        tarinfo = tarfile.TarInfo(self.filename)
+        tarinfo.size = member.size
+        tarinfo.mtime = member.mtime
+        tarinfo.mode = 0o644
+        self.open('rb')
+        try:
+            reader = HashingReader(self.obj, checksum_types)
+            tarf.addfile(tarinfo, reader)
+        finally:
+            self.close()
+        return reader.hexdigests()
+
+
+def chunk_file_name(filename, index):
+    """Get the name of the given chunk of a chunked file.
+
+    As specified by the OVF standard, the chunks of a file are named by
+    appending a nine-digit, zero-padded chunk number to the file name.
+
+    Args:
+      filename (str): Name of the file as a whole.
+      index (int): Chunk number, starting from 0.
+    Returns:
+      str: Chunk file name
+
+    Examples:
+      ::
+
+        >>> chunk_file_name("disk.vmdk", 0)
+        'disk.vmdk.000000000'
+        >>> chunk_file_name("disk.vmdk", 12)
+        'disk.vmdk.000000012'
+    """
+    return "{0}.{1:09d}".format(filename, index)
+
+
+def _slice_extents(extents, offset, length):
+    """Get the extents covering a range of the data in the given extents.
+
+    Args:
+      extents (list): ``(path, offset, length)`` tuples, in order.
+      offset (int): Start of the desired range, relative to the data as a
+          whole.
+      length (int): Length of the desired range.
+    Returns:
+      list: ``(path, offset, length)`` tuples covering only that range.
+    """
+    result = []
+    position = 0
+    for (path, start, extent_length) in extents:
+        low = max(offset, position)
+        high = min(offset + length, position + extent_length)
+        if low < high:
+            result.append((path, start + low - position, high - low))
+        position += extent_length
+    return result
+
+
+class FileSpan(FileReference):
+    """Wrapper for a file made up of byte ranges of one or more other files.
+
+    Used to represent an OVF chunked file (which is stored as a series of
+    numbered chunk files but is logically a single file) as a whole, and
+    conversely to represent each chunk of a file being written out in
+    chunks, without copying any data until the file is written.
+    """
+
+    def __init__(self, filename, extents):
+        """Create a reference to the data in the given byte ranges.
+
+        Args:
+          filename (str): Name of the file as a whole.
+          extents (list): ``(path, offset, length)`` tuples, in order.
+              Empty extents are discarded and contiguous extents merged.
+        """
+        self.filename = filename
+        self.extents = []
+        for (path, offset, length) in extents:
+            if not length:
+                continue
+            if self.extents:
+                (prev_path, prev_offset, prev_len) = self.extents[-1]
+                if prev_path == path and prev_offset + prev_len == offset:
+                    # Merge contiguous extents
+                    self.extents[-1] = (path, prev_offset, prev_len + length)
+                    continue
+            self.extents.append((path, offset, length))
+        self.obj = None
+
+    @classmethod
+    def join(cls, filename, file_refs):
+        """Combine several files into a single logical file.
+
+        Args:
+          filename (str): Name of the combined file.
+          file_refs (list): :class:`FileOnDisk`, :class:`FileInTAR`, or
+              :class:`FileSpan` objects, in order.
+        Returns:
+          FileSpan: Reference to the combined file.
+        """
+        extents = []
+        for file_ref in file_refs:
+            extents.extend(file_ref.extents)
+        return cls(filename, extents)
+
+    @classmethod
+    def split(cls, file_ref, chunk_size, filename=None):
+        """Split a file into fixed-size chunks.
+
+        Args:
+          file_ref (object): :class:`FileOnDisk`, :class:`FileInTAR`, or
+              :class:`FileSpan` to split.
+          chunk_size (int): Maximum size of each chunk, in bytes.
+          filename (str): Name of the file as a whole, if different from
+              ``file_ref.filename``.
+        Returns:
+          list: :class:`FileSpan` for each chunk, named as described under
+          :func:`chunk_file_name`.
+        """
+        if filename is None:
+            filename = file_ref.filename
+        extents = file_ref.extents
+        return [cls(chunk_file_name(filename, index),
+                    _slice_extents(extents, offset, chunk_size))
+                for (index, offset) in enumerate(
+                    range(0, max(file_ref.size, 1), chunk_size))]
+
+    def __eq__(self, other):
+        """FileSpan instances are equal if they have the same name and data.
+
+        Args:
+          other (object): Other object to compare against
+        Returns:
+          bool: True if filename and extents are the same, else False
+        """
+        return (type(other) is type(self) and
+                self.filename == other.filename and
+                self.extents == other.extents)
+
+    def __ne__(self, other):
+        """FileSpan instances are not equal if they have different data.
+
+        Args:
+          other (object): Other object to compare against
+        Returns:
+          bool: False if filename and extents are the same, else True
+        """
+        return not self.__eq__(other)
+
+    @property
+    def exists(self):
+        """True if all of the underlying data exists, else False."""
+        for (path, offset, length) in self.extents:
+            if is_url(path):
+                size = open_url(path).size
+            elif os.path.exists(path):
+                size = os.path.getsize(path)
+            else:
+                return False
+            if size < offset + length:
+                return False
+        return True
+
+    @property
+    def size(self):
+        """The size of this file, in bytes."""
+        return sum(extent[2] for extent in self.extents)
+
+    @property
+    def file_path(self):
+        """Path to this file on disk, if it is stored as a single file."""
+        if len(self.extents) != 1:
+            return None
+        (path, offset, length) = self.extents[0]
+        if (offset != 0 or not os.path.isfile(path) or
+                os.path.getsize(path) != length):
+            return None
+        return path
+
+    @property
+    def mtime(self):
+        """The latest modification time of any of the underlying files."""
+        paths = set(extent[0] for extent in self.extents)
+        if not paths:
+            return int(time.time())
+        return int(max(open_url(path).mtime if is_url(path)
+                       else os.path.getmtime(path) for path in paths))
+
+    @property
+    def identity(self):
+        """Tuple identifying the current contents of this file.
+
+        Used as a key for caching file digests. Consists of the identity of
+        each underlying file (see :func:`COT.digest.path_identity`) plus the
+        location of the data within that file.
+        """
+        result = ('span', )
+        for (path, offset, length) in self.extents:
+            if is_url(path):
+                path_id = open_url(path).identity
+            else:
+                path_id = path_identity(path)
+            if path_id is None:
+                return None
+            result += path_id + (offset, length)
+        return result
+
+    def open(self, mode):
+        """Open the underlying files and return a file object for the span.
+
+        Args:
+          mode (str): Only 'r' and 'rb' modes are supported.
+        Returns:
+          file: File object
+        Raises:
+          ValueError: if ``mode`` is not valid.
+        """
+        if mode != 'r' and mode != 'rb':
+            raise ValueError("FileSpan.open() only supports 'r'/'rb' mode")
+        self.obj = io.BufferedReader(SpanReader(self.extents))
+        return self.obj
+
+    def close(self):
+        """Close the file object previously opened."""
+        if self.obj is not None:
+            self.obj.close()
+            self.obj = None
+
+    def copy_to(self, dest_dir, link_mode='copy'):
+        """Write this file to the given destination directory.
+
+        The underlying byte ranges are copied in parallel, and any holes in
+        the underlying files are preserved.
+
+        Args:
+          dest_dir (str): Destination directory or filename. Must not be
+              one of the underlying files, unless it is the only one and
+              its contents are exactly this file.
+          link_mode (str): Ignored, as the file must be assembled by copying.
+        """
+        # pylint: disable=unused-argument
+        if os.path.isdir(dest_dir):
+            dest_path = os.path.join(dest_dir, self.filename)
+        else:
+            dest_path = dest_dir
+        if (self.file_path is not None and
+                os.path.abspath(self.file_path) == os.path.abspath(dest_path)):
+            return
+        logger.info("Copying %s to %s", self.filename, dest_path)
+        if any(is_url(extent[0]) for extent in self.extents):
+            _stream_copy(self, dest_path)
+            return
+        pieces = []
+        position = 0
+        for extent in self.extents:
+            pieces.append((extent, position))
+            position += extent[2]
+
+        with open(dest_path, 'wb') as dest:
+            # Size the file up front so that each piece can be written
+            # independently, with any holes left unwritten.
+            os.ftruncate(dest.fileno(), position)
+
+        def _copy_piece(piece):
+            """Copy a single extent into place in the destination.
+
+            Each piece is written through its own file descriptor, as not
+            all copy strategies write at an explicit offset.
+            """
+            ((path, offset, length), dest_offset) = piece
+            with open(path, 'rb') as src:
+                with open(dest_path, 'r+b') as dest:
+                    return copy_range(src.fileno(), dest.fileno(), length,
+                                      src_offset=offset,
+                                      dst_offset=dest_offset, sparse=True)
+
+        strategies = parallel_map(_copy_piece, pieces, default_workers())
+        logger.verbose("Copied %s using %s", self.filename,
+                       ", ".join(sorted(set(strategies))) or "nothing")
+
+    def add_to_archive(self, tarf, checksum_types=()):
+        """Copy this file into the given tarfile object.
+
+        Args:
+          tarf (tarfile.TarFile): Add this file to that archive.
+          checksum_types (list): Digest algorithms (such as 'sha1') to
+              compute from the file contents as they are copied.
+        Returns:
+          dict: ``{checksum_type: hexdigest}`` for each of ``checksum_types``
+        """
+        logger.info("Adding %s to TAR file", self.filename)
+        tarinfo = tarfile.TarInfo(self.filename)
+        tarinfo.size = self.size
+        tarinfo.mtime = self.mtime
+        tarinfo.mode = 0o644
+        if (not checksum_types and len(self.extents) == 1 and
+                not is_url(self.extents[0][0])):
+            (path, offset, _) = self.extents[0]
+            with open(path, 'rb') as src:
+                strategy = copy_into_tarfile(tarf, tarinfo, src.fileno(),
+                                             src_offset=offset)
+            logger.verbose("Copied %s using %s", self.filename, strategy)
+            return {}
+        self.open('rb')
+        try:
+            reader = HashingReader(self.obj, checksum_types)
+            tarf.addfile(tarinfo, reader)
         finally:
             self.close()
+        return reader.hexdigests()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+#
+# http_file.py - Random access to remote files using HTTP range requests
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Random access to files on an HTTP(S) server, using range requests.
+
+This allows an OVA on a web server to be read in place: only the TAR
+headers and the OVF descriptor need to be fetched to inspect it, and the
+other files in the OVA are only downloaded if and when they are read.
+
+Data is requested a block at a time, with the amount requested growing
+as long as a file is read sequentially, and recently fetched blocks are
+cached in memory. Each thread makes its requests with its own
+:class:`requests.Session`, so connections to the server are kept alive and
+reused.
+
+**Classes**
+
+.. autosummary::
+  :nosignatures:
+
+  HTTPFile
+
+**Functions**
+
+.. autosummary::
+  :nosignatures:
+
+  is_url
+  open_url
+
+**Constants**
+
+.. autosummary::
+  BLOCK_SIZE
+  MAX_READAHEAD
+  CACHE_SIZE
+  TIMEOUT
+"""
+
+import logging
+import re
+import threading
+import time
+import weakref
+
+from email.utils import mktime_tz, parsedate_tz
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 64 * 1024
+"""Minimum number of bytes to request from the server at a time."""
+
+MAX_READAHEAD = 8 * 1024 * 1024
+"""Maximum number of bytes to request at a time when reading sequentially."""
+
+CACHE_SIZE = 16 * 1024 * 1024
+"""Maximum number of bytes of each remote file to cache in memory."""
+
+TIMEOUT = 60
+"""Seconds to wait for the server to connect or send data before failing."""
+
+# requests.Session of each thread, for connection reuse, created on demand.
+# Sessions are not thread-safe, so one cannot be shared by all threads.
+_LOCAL = threading.local()
+
+_OPEN_FILES = weakref.WeakValueDictionary()
+_OPEN_FILES_LOCK = threading.Lock()
+
+
+def is_url(path):
+    """Check whether the given path is actually an HTTP or HTTPS URL.
+
+    Args:
+      path (str): File path or URL.
+    Returns:
+      bool: True if ``path`` is an ``http://`` or ``https://`` URL.
+
+    Examples:
+      ::
+
+        >>> is_url("http://example.com/foo.ova")
+        True
+        >>> is_url("/tmp/foo.ova")
+        False
+    """
+    return bool(path and re.match(r"https?://", path, re.IGNORECASE))
+
+
+def _session():
+    """Get the :class:`requests.Session` used by the current thread.
+
+    Returns:
+      requests.Session: Session object
+    """
+    session = getattr(_LOCAL, 'session', None)
+    if session is None:
+        session = requests.Session()
+        _LOCAL.session = session
+    return session
+
+
+def open_url(url):
+    """Get an :class:`HTTPFile` for the given URL.
+
+    Repeated calls for the same URL return the same object for as long as
+    it is in use, so that its block cache is shared between all readers.
+
+    Args:
+      url (str): ``http://`` or ``https://`` URL.
+    Returns:
+      HTTPFile: Remote file object.
+    Raises:
+      IOError: if the file cannot be accessed.
+    """
+    with _OPEN_FILES_LOCK:
+        remote = _OPEN_FILES.get(url)
+        if remote is None:
+            remote = HTTPFile(url)
+            _OPEN_FILES[url] = remote
+        return remote
+
+
+class HTTPFile(object):
+    """A file on an HTTP(S) server, read by means of range requests.
+
+    The file is assumed not to change while in use; if the server reports
+    an ``ETag`` or ``Last-Modified`` validator, any change is detected and
+    reported as an error rather than returning inconsistent data. Only a
+    strong ``ETag`` is sent in ``If-Range``, as servers may not honor a
+    range request conditional on any other validator.
+    """
+
+    def __init__(self, url):
+        """Look up the size of the given remote file.
+
+        Args:
+          url (str): ``http://`` or ``https://`` URL.
+        Raises:
+          IOError: if the file cannot be accessed or its size is unknown.
+        """
+        response = _session().head(url, allow_redirects=True,
+                                   timeout=TIMEOUT)
+        if response.status_code != 200:
+            raise IOError("Unable to access {0}: HTTP {1} {2}"
+                          .format(url, response.status_code,
+                                  response.reason))
+        try:
+            self.size = int(response.headers['Content-Length'])
+        except (KeyError, ValueError):
+            raise IOError("Server did not report the size of {0}"
+                          .format(url))
+        self.url = response.url
+        """URL of the file, after following any redirects."""
+        self.validator = (response.headers.get('ETag') or
+                          response.headers.get('Last-Modified'))
+        """Value identifying the current version of the file, if known."""
+        etag = response.headers.get('ETag')
+        # Weak ETags ('W/"..."') can't be used for range requests
+        self._if_range = etag if etag and not etag.startswith('W/') else None
+        last_modified = response.headers.get('Last-Modified')
+        self.mtime = int(time.time())
+        """Modification time of the file, if known, else the current time."""
+        if last_modified and parsedate_tz(last_modified):
+            self.mtime = mktime_tz(parsedate_tz(last_modified))
+        self._lock = threading.Lock()
+        # [(offset, data)], most recently used last
+        self._cache = []
+        # End offset of each recent request -> number of bytes requested,
+        # for detecting sequential reads and growing the readahead.
+        self._streams = {}
+        logger.verbose("Opened %s (%d bytes)", self.url, self.size)
+
+    @property
+    def identity(self):
+        """Tuple identifying the current contents of this file.
+
+        Used as a key for caching file digests, in the same manner as
+        :func:`COT.digest.path_identity`. ``None`` if the server does not
+        provide a validator by which changes can be detected.
+        """
+        if not self.validator:
+            return None
+        return ('url', self.url, self.size, self.validator)
+
+    def _cached(self, offset, size):
+        """Get data from the block cache, if present.
+
+        Args:
+          offset (int): Offset into the file.
+          size (int): Number of bytes desired.
+        Returns:
+          bytes: Data, or ``None`` if not entirely present in the cache.
+        """
+        for (index, (start, data)) in enumerate(self._cache):
+            if start <= offset and offset + size <= start + len(data):
+                # Mark as most recently used
+                self._cache.append(self._cache.pop(index))
+                return data[offset - start:offset - start + size]
+        return None
+
+    def _fetch(self, offset, size):
+        """Request a range of data from the server.
+
+        Args:
+          offset (int): Offset into the file.
+          size (int): Number of bytes to request.
+        Returns:
+          bytes: Data received.
+        Raises:
+          IOError: if the server does not honor the request, or if the
+              file has changed since it was opened.
+        """
+        headers = {'Range': 'bytes={0}-{1}'.format(offset, offset + size - 1)}
+        if self._if_range:
+            headers['If-Range'] = self._if_range
+        logger.debug("Requesting %d bytes at offset %d of %s",
+                     size, offset, self.url)
+        response = _session().get(self.url, headers=headers, stream=True,
+                                  timeout=TIMEOUT)
+        try:
+            if response.status_code != 206:
+                raise IOError("Server did not honor range request for {0} "
+                              "(HTTP {1} {2}); either it does not support "
+                              "range requests or the file has changed"
+                              .format(self.url, response.status_code,
+                                      response.reason))
+            validator = (response.headers.get('ETag') or
+                         response.headers.get('Last-Modified'))
+            if validator and self.validator and validator != self.validator:
+                raise IOError("{0} has changed since it was opened"
+                              .format(self.url))
+            data = response.content
+        finally:
+            # Unless the body has been read, this closes the connection
+            # rather than downloading a possibly large unwanted body.
+            response.close()
+        if len(data) != size:
+            raise IOError("Expected {0} bytes from {1} but received {2}"
+                          .format(size, self.url, len(data)))
+        return data
+
+    def pread(self, size, offset):
+        """Read data from the given offset, as :func:`os.pread` does.
+
+        Args:
+          size (int): Maximum number of bytes to read.
+          offset (int): Offset into the file.
+        Returns:
+          bytes: Data read, which will be empty at the end of the file.
+        Raises:
+          IOError: see :meth:`_fetch`.
+        """
+        size = min(size, self.size - offset)
+        if size <= 0:
+            return b''
+        with self._lock:
+            data = self._cached(offset, size)
+            if data is not None:
+                return data
+            # Double the readahead each time a previous request is
+            # continued, up to a limit; otherwise start over from one block.
+            readahead = min(self._streams.pop(offset, BLOCK_SIZE // 2) * 2,
+                            MAX_READAHEAD)
+        start = offset - (offset % BLOCK_SIZE)
+        end = min(max(offset + size, start + readahead), self.size)
+        data = self._fetch(start, end - start)
+        with self._lock:
+            if len(self._streams) > 64:
+                self._streams.clear()
+            self._streams[end] = readahead
+            if len(data) <= CACHE_SIZE:
+                self._cache.append((start, data))
+                while sum(len(entry[1]) for entry in self._cache) > CACHE_SIZE:
+                    self._cache.pop(0)
+        return data[offset - start:offset - start + size]
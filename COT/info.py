@@ -24,6 +24,8 @@ import os.path
 from .submodule import COTGenericSubmodule
 from .vm_context_manager import VMContextManager
 from .data_validation import InvalidInputError
+from .file_reference import STREAM_PATH
+from .http_file import is_url
 
 logger = logging.getLogger(__name__)
 
@@ -57,7 +59,8 @@ class COTInfo(COTGenericSubmodule):
     @package_list.setter
     def package_list(self, value):
         for package in value:
-            if not os.path.exists(package):
+            if (package != STREAM_PATH and not is_url(package) and
+                    not os.path.exists(package)):
                 raise InvalidInputError("Specified package {0} does not exist!"
                                         .format(package))
         self._package_list = value
@@ -129,5 +132,6 @@ Show a summary of the contents of the given OVF(s) and/or OVA(s).""")
         p.add_argument('PACKAGE_LIST',
                        nargs='+',
                        metavar='PACKAGE [PACKAGE ...]',
-                       help="OVF descriptor(s) and/or OVA file(s) to describe")
+                       help="OVF descriptor(s) and/or OVA file(s) or URL(s) "
+                       "to describe")
         p.set_defaults(instance=self)
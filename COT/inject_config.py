@@ -242,6 +242,7 @@ be included as-is and will not be renamed.""")
         p.add_argument('-o', '--output',
                        help="Name/path of new VM package to create "
                        "instead of updating the existing package")
+        self.add_package_arguments(p)
 
         p.add_argument('-c', '--config-file',
                        help="Text file to embed as primary configuration")
@@ -25,7 +25,6 @@
   OVFHardwareDataError
 """
 
-import copy
 import logging
 
 from COT.data_validation import natural_sort
@@ -48,6 +47,12 @@ class OVFHardware(object):
 
     Fundamentally it's just a dict of :class:`~COT.ovf.item.OVFItem` objects
     with a bunch of helper methods.
+
+    To speed up :meth:`find_all_items`, the items are also indexed by
+    their ``ResourceType``, ``Parent``, and ``Parent`` plus
+    ``AddressOnParent`` values. Items must therefore be added and removed
+    only via :meth:`new_item`, :meth:`clone_item`, and :meth:`delete_item`,
+    rather than by editing :attr:`item_dict` directly.
     """
 
     def __init__(self, ovf):
@@ -61,6 +66,16 @@ class OVFHardware(object):
         """
         self.ovf = ovf
         self.item_dict = {}
+        self._sorted_instances = None
+        self.indexed_properties = (ovf.RESOURCE_TYPE, ovf.PARENT,
+                                   ovf.ADDRESS_ON_PARENT)
+        """Properties that an item's indexes depend on."""
+        # Indexes of items by ResourceType, by Parent, and by
+        # (Parent, AddressOnParent), each mapping the property value(s)
+        # of interest to a dict of {instance: ovfitem}.
+        self._indexes = ({}, {}, {})
+        # id(ovfitem) -> (instance, keys) for each indexed item
+        self._index_keys = {}
         valid_profiles = set(ovf.config_profiles)
         item_count = 0
         for item in ovf.virtual_hw_section:
@@ -95,8 +110,9 @@ class OVFHardware(object):
             "OVF contains %s hardware Item elements describing %s "
             "unique devices", item_count, len(self.item_dict))
         # Treat the current state as golden:
-        for ovfitem in self.item_dict.values():
+        for (instance, ovfitem) in self.item_dict.items():
             ovfitem.modified = False
+            self._index_item(instance, ovfitem)
 
     def update_xml(self):
         """Regenerate all Items under the VirtualHardwareSection, if needed.
@@ -119,18 +135,19 @@ class OVFHardware(object):
                          "so no XML update is required")
             return
         # Delete the existing Items:
-        delete_count = 0
-        for item in list(self.ovf.virtual_hw_section):
-            if (item.tag == self.ovf.ITEM or
-                    item.tag == self.ovf.STORAGE_ITEM or
-                    item.tag == self.ovf.ETHERNET_PORT_ITEM):
-                self.ovf.virtual_hw_section.remove(item)
-                delete_count += 1
+        item_tags = (self.ovf.ITEM, self.ovf.STORAGE_ITEM,
+                     self.ovf.ETHERNET_PORT_ITEM)
+        children = list(self.ovf.virtual_hw_section)
+        kept = [child for child in children if child.tag not in item_tags]
+        delete_count = len(children) - len(kept)
+        # Removing Items one at a time would be quadratic in their number
+        self.ovf.virtual_hw_section[:] = kept
+        XML.mark_dirty(self.ovf.virtual_hw_section)
         logger.verbose("Cleared %d existing items from VirtualHWSection",
                        delete_count)
         # Generate the new XML Items, in appropriately sorted order by Instance
         ordering = [self.ovf.INFO, self.ovf.SYSTEM, self.ovf.ITEM]
-        for instance in natural_sort(self.item_dict):
+        for instance in self._instance_order():
             logger.debug("Writing Item(s) with InstanceID %s", instance)
             ovfitem = self.item_dict[instance]
             new_items = ovfitem.generate_items()
@@ -142,6 +159,86 @@ class OVFHardware(object):
                        len(self.ovf.virtual_hw_section.findall(self.ovf.ITEM)),
                        len(self.item_dict))
 
+    def _instance_order(self):
+        """Get the instance IDs of all items, in natural sort order.
+
+        Returns:
+          list: Instance ID strings.
+        """
+        if self._sorted_instances is None:
+            self._sorted_instances = natural_sort(self.item_dict)
+        return self._sorted_instances
+
+    def _keys_for_item(self, ovfitem):
+        """Get the keys under which the given item is indexed.
+
+        Returns:
+          tuple: ``(resource_type, parent, (parent, address_on_parent))``
+        """
+        # Equivalent to ovfitem.get_value(name) for these properties,
+        # which have no wildcards to substitute.
+        (resource_type, parent, address) = [
+            values[0] if len(values) == 1 else None
+            for values in (ovfitem.get_all_values(name)
+                           for name in self.indexed_properties)]
+        return (resource_type, parent, (parent, address))
+
+    def _index_item(self, instance, ovfitem):
+        """Add the given item to the indexes.
+
+        Args:
+          instance (str): Instance ID under which the item is stored in
+              :attr:`item_dict`.
+          ovfitem (OVFItem): Item to index.
+        """
+        keys = self._keys_for_item(ovfitem)
+        for (index, key) in zip(self._indexes, keys):
+            index.setdefault(key, {})[instance] = ovfitem
+        self._index_keys[id(ovfitem)] = (instance, keys)
+        ovfitem.hardware = self
+
+    def _unindex_item(self, ovfitem):
+        """Remove the given item from the indexes.
+
+        Args:
+          ovfitem (OVFItem): Item previously indexed by :meth:`_index_item`.
+
+        Returns:
+          str: Instance ID under which the item was indexed.
+        """
+        (instance, keys) = self._index_keys.pop(id(ovfitem))
+        for (index, key) in zip(self._indexes, keys):
+            bucket = index[key]
+            del bucket[instance]
+            if not bucket:
+                del index[key]
+        ovfitem.hardware = None
+        return instance
+
+    def update_indexes(self, ovfitem):
+        """Re-index the given item after a change to its properties.
+
+        Called by :class:`~COT.ovf.item.OVFItem` as needed.
+
+        Args:
+          ovfitem (OVFItem): Item that was changed.
+        """
+        (instance, keys) = self._index_keys[id(ovfitem)]
+        if self._keys_for_item(ovfitem) != keys:
+            self._unindex_item(ovfitem)
+            self._index_item(instance, ovfitem)
+
+    def _add_item(self, instance, ovfitem):
+        """Add the given item to :attr:`item_dict` and to the indexes.
+
+        Args:
+          instance (str): Instance ID of the item.
+          ovfitem (OVFItem): Item to add.
+        """
+        self.item_dict[instance] = ovfitem
+        self._sorted_instances = None
+        self._index_item(instance, ovfitem)
+
     def find_unused_instance_id(self):
         """Find the first available ``InstanceID`` number.
 
@@ -175,7 +272,7 @@ class OVFHardware(object):
         # so provide a simple default value.
         ovfitem.set_property(self.ovf.ELEMENT_NAME, resource_type,
                              profile_list)
-        self.item_dict[instance] = ovfitem
+        self._add_item(instance, ovfitem)
         ovfitem.modified = True
         logger.info("Added new %s under %s, instance is %s",
                     resource_type, profile_list, instance)
@@ -190,6 +287,8 @@ class OVFHardware(object):
         instance = item.get_value(self.ovf.INSTANCE_ID)
         if self.item_dict[instance] == item:
             del self.item_dict[instance]
+            self._sorted_instances = None
+            self._unindex_item(item)
         # TODO: error handling - currently a no-op if item not in item_dict
 
     def clone_item(self, parent_item, profile_list):
@@ -203,10 +302,10 @@ class OVFHardware(object):
           tuple: ``(instance_id, ovfitem)``
         """
         instance = self.find_unused_instance_id()
-        ovfitem = copy.deepcopy(parent_item)
+        ovfitem = parent_item.clone()
         ovfitem.set_property(self.ovf.INSTANCE_ID, instance, profile_list)
         ovfitem.modified = True
-        self.item_dict[instance] = ovfitem
+        self._add_item(instance, ovfitem)
         logger.debug("Added clone of %s under %s, instance is %s",
                      parent_item, profile_list, instance)
         return (instance, ovfitem)
@@ -235,6 +334,38 @@ class OVFHardware(object):
                 return False
         return True
 
+    def _candidate_items(self, resource_type, properties):
+        """Use the indexes to narrow down the items that could match.
+
+        Args:
+          resource_type (str): Resource type string like 'scsi' or 'serial'
+          properties (dict): Properties and their values to match
+
+        Returns:
+          list: :class:`~COT.ovf.item.OVFItem` instances, in instance order,
+          that include all items matching the given type and properties.
+        """
+        (by_type, by_parent, by_address) = self._indexes
+        buckets = []
+        if resource_type:
+            buckets.append(by_type.get(self.ovf.RES_MAP[resource_type], {}))
+        if self.ovf.PARENT in properties:
+            parent = properties[self.ovf.PARENT]
+            if self.ovf.ADDRESS_ON_PARENT in properties:
+                buckets.append(by_address.get(
+                    (parent, properties[self.ovf.ADDRESS_ON_PARENT]), {}))
+            else:
+                buckets.append(by_parent.get(parent, {}))
+        if self.ovf.INSTANCE_ID in properties:
+            instance = properties[self.ovf.INSTANCE_ID]
+            buckets.append(dict((i, self.item_dict[i]) for i in [instance]
+                                if i in self.item_dict))
+        if not buckets:
+            return [self.item_dict[instance]
+                    for instance in self._instance_order()]
+        bucket = min(buckets, key=len)
+        return [bucket[instance] for instance in natural_sort(bucket)]
+
     def find_all_items(self, resource_type=None, properties=None,
                        profile_list=None):
         """Find all items matching the given type, properties, and profiles.
@@ -247,12 +378,11 @@ class OVFHardware(object):
         Returns:
           list: Matching :class:`~COT.ovf.item.OVFItem` instances
         """
-        items = [self.item_dict[instance] for instance in
-                 natural_sort(self.item_dict)]
-        filtered_items = []
         if properties is None:
             properties = {}
-        for item in items:
+        candidates = self._candidate_items(resource_type, properties)
+        filtered_items = []
+        for item in candidates:
             if self.item_match(item, resource_type, properties, profile_list):
                 filtered_items.append(item)
         logger.debug("Found %s %s Items", len(filtered_items), resource_type)
@@ -37,9 +37,9 @@ hardware configuration profiles.
 
 import re
 import logging
-import xml.etree.ElementTree as ET
 
 from COT.data_validation import natural_sort, ValueUnsupportedError
+from COT.xml_backend import Element, fromstring, tostring
 from COT.xml_file import XML
 
 from COT.ovf.name_helper import name_helper
@@ -108,6 +108,8 @@ class OVFItem(object):
         self.properties = {}
         """Dict of dicts. properties[name][value] = (profile1, profile2)."""
         self.modified = False
+        self.hardware = None
+        """OVFHardware whose indexes include this item, if any."""
         self.NS = self.RASD   # default for most item types
         if item is not None:
             self.add_item(item)
@@ -204,6 +206,26 @@ class OVFItem(object):
             return default
         return set.union(*value_dict.values())
 
+    def clone(self):
+        """Create a copy of this OVFItem that can be modified independently.
+
+        Only the property values and their profile sets are copied; the
+        clone shares this item's :class:`OVF` and name helper, rather than
+        copying the entire OVF as :func:`copy.deepcopy` would.
+
+        Returns:
+          OVFItem: New item with the same contents as this one.
+        """
+        clone = self.__class__(self.ovf)
+        clone.name_helper = self.name_helper
+        clone.NS = self.NS
+        clone.modified = self.modified
+        for (name, value_dict) in self.properties.items():
+            clone.properties[name] = dict(
+                (value, set(profiles))
+                for (value, profiles) in value_dict.items())
+        return clone
+
     def add_item(self, item):
         """Add the given ``Item`` element to this OVFItem.
 
@@ -260,9 +282,9 @@ class OVFItem(object):
                 # vmw:Config elements, each distinguished by its vmw:key attr.
                 # Rather than try to guess how these items do or do not match,
                 # we simply store the whole item
-                self.set_property((ET.tostring(child).decode().strip() +
+                self.set_property((tostring(child).strip() +
                                    self.ELEMENT_KEY_SUFFIX),
-                                  ET.tostring(child).decode(),
+                                  tostring(child),
                                   profiles, overwrite=False)
                 continue
             # Store the value of this element:
@@ -474,6 +496,9 @@ class OVFItem(object):
 
         if self.modified:
             self.validate()
+            if (self.hardware is not None and
+                    name in self.hardware.indexed_properties):
+                self.hardware.update_indexes(self)
 
     def add_profile(self, new_profile, from_item=None):
         """Add a new profile to this item.
@@ -558,6 +583,8 @@ class OVFItem(object):
                     del self.properties[name][value]
         self.modified = True
         self.validate()
+        if self.hardware is not None:
+            self.hardware.update_indexes(self)
 
     def get(self, tag):
         """Get the dict associated with the given XML tag, if any.
@@ -763,11 +790,11 @@ class OVFItem(object):
         for set_string in set_string_list:
             if not set_string:
                 # no config profile
-                item = ET.Element(item_tag)
+                item = Element(item_tag)
                 final_set = set([None])
                 set_string = '<generic>'
             else:
-                item = ET.Element(item_tag, {self.ITEM_CONFIG: set_string})
+                item = Element(item_tag, {self.ITEM_CONFIG: set_string})
                 final_set = set(set_string.split())
             logger.debug("set string: %s; final_set: %s",
                          set_string, final_set)
@@ -802,13 +829,13 @@ class OVFItem(object):
                     child.set(child_attrib.group(2), val)
                 elif custom_elem:
                     # Recreate the element in question and append it
-                    item.append(ET.fromstring(val))
+                    item.append(fromstring(val))
                 else:
                     # Children of Item must be in sorted order
                     XML.set_or_make_child(item, self.NS + name, val,
                                           ordering=child_ordering,
                                           known_namespaces=self.NSM.values())
-            logger.debug("Item is:\n%s", ET.tostring(item))
+            logger.debug("Item is:\n%s", tostring(item))
             item_list.append(item)
 
         return item_list
@@ -167,6 +167,8 @@ class OVFNameHelper1(object):
         FILE_ID=_Tag('ovf', 'id'),
         FILE_HREF=_Tag('ovf', 'href'),
         FILE_SIZE=_Tag('ovf', 'size'),
+        FILE_CHUNK_SIZE=_Tag('ovf', 'chunkSize'),
+        FILE_COMPRESSION=_Tag('ovf', 'compression'),
 
         # Envelope -> DiskSection -> Disk
         DISK_SECTION=_Tag('ovf', 'DiskSection'),
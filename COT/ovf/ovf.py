@@ -24,6 +24,7 @@
   byte_count
   byte_string
   factor_bytes
+  whitespace_padding
 
 **Classes**
 
@@ -33,28 +34,39 @@
   OVF
 """
 
+import io
 import logging
 import os
 import os.path
 import re
+import shutil
+import sys
 import tarfile
-import xml.etree.ElementTree as ET
-# In 2.7+, ET raises a ParseError if XML parsing fails,
-# but in 2.6 it raises an ExpatError. Hide this variation.
+import tempfile
 try:
-    from xml.etree.ElementTree import ParseError
+    from urllib.parse import urlparse
 except ImportError:
-    from xml.parsers.expat import ExpatError as ParseError
+    from urlparse import urlparse
 import textwrap
 from contextlib import closing
 
+from COT.xml_backend import Element, ParseError, SubElement
 from COT.xml_file import XML, register_namespace
 from COT.vm_description import VMDescription, VMInitError
 from COT.data_validation import (
     match_or_die, check_for_conflict, file_checksum,
     ValueTooHighError, ValueUnsupportedError, canonicalize_nic_subtype,
 )
-from COT.file_reference import FileOnDisk, FileInTAR
+from COT.compression import COMPRESSION_TYPES, gzip_compress
+from COT.digest import (
+    CHECKSUM_TYPES, default_digest_cache, default_workers, digest_files,
+    digest_stream, parallel_map,
+)
+from COT.file_reference import (
+    FileOnDisk, FileInTAR, FileInStream, FileSpan, TarIndex, TarStream,
+    STREAM_PATH, chunk_file_name,
+)
+from COT.http_file import is_url
 from COT.platforms import platform_from_product_class, GenericPlatform
 from COT.disks import convert_disk, disk_representation_from_file
 
@@ -64,6 +76,26 @@ from COT.ovf.item import list_union
 
 logger = logging.getLogger(__name__)
 
+# os.replace() is atomic on all platforms but only exists in Python 3.3+;
+# os.rename() is atomic on POSIX platforms.
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _copy_owner(src, dst):
+    """Copy the owner and group of one file to another, if permitted.
+
+    Args:
+      src (str): File whose ownership should be copied.
+      dst (str): File to update.
+    """
+    if not hasattr(os, 'chown'):
+        return
+    stat_result = os.stat(src)
+    try:
+        os.chown(dst, stat_result.st_uid, stat_result.st_gid)
+    except OSError as e:
+        logger.debug("Unable to preserve ownership of %s: %s", src, e)
+
 
 def byte_count(base_val, multiplier):
     """Convert an OVF-style value + multiplier into decimal byte count.
@@ -184,6 +216,32 @@ def byte_string(byte_value, base_shift=0):
     return "{0:.4g} {1}".format(byte_value, tags[shift])
 
 
+def whitespace_padding(length):
+    """Get whitespace to pad an XML document out to a larger size.
+
+    XML permits arbitrary whitespace after the root element, so this can be
+    used to reserve space in a file for later in-place updates.
+
+    Args:
+      length (int): Number of bytes of padding required.
+
+    Returns:
+      bytes: Padding consisting of spaces and ending with a newline,
+      or an empty string if ``length`` is zero.
+
+    Examples:
+      ::
+
+        >>> whitespace_padding(4) == b'   \\n'
+        True
+        >>> whitespace_padding(0) == b''
+        True
+    """
+    if length <= 0:
+        return b''
+    return b' ' * (length - 1) + b'\n'
+
+
 class OVF(VMDescription, XML):
     """Representation of the contents of an OVF or OVA.
 
@@ -195,8 +253,10 @@ class OVF(VMDescription, XML):
       input_file
       output_file
       ovf_version
+      checksum_type
       product_class
       platform
+      hardware
       config_profiles
       default_config_profile
       environment_properties
@@ -208,6 +268,12 @@ class OVF(VMDescription, XML):
       version_long
     """
 
+    MANIFEST_CHECKSUM_TYPES = ('sha1', 'sha256', 'sha512')
+    """Checksum algorithms that may be used in an OVF manifest."""
+
+    MANIFEST_LINE = re.compile(r"^(\w+)\((.+)\)= *([0-9a-fA-F]+)$")
+    """Regular expression matching a single entry in an OVF manifest."""
+
     # API methods to be called by clients
 
     @staticmethod
@@ -220,8 +286,11 @@ class OVF(VMDescription, XML):
 
         Does not check file contents, as the given filename may not yet exist.
 
+        The special filename ``'-'`` (:data:`~COT.file_reference.STREAM_PATH`)
+        denotes an OVA read from standard input or written to standard output.
+
         Args:
-          filename (str): File name/path
+          filename (str): File name/path, or ``http(s)://`` URL
 
         Returns:
           str: '.ovf', '.box' or '.ova'
@@ -229,6 +298,11 @@ class OVF(VMDescription, XML):
         Raises:
           ValueUnsupportedError: if filename doesn't match ovf/ova
         """
+        if filename == STREAM_PATH:
+            return '.ova'
+        if is_url(filename):
+            # We don't care about any query string
+            filename = urlparse(filename).path
         # We don't care about any directory path
         filename = os.path.basename(filename)
         extension = os.path.splitext(filename)[1]
@@ -255,25 +329,35 @@ class OVF(VMDescription, XML):
         """Get the OVF descriptor for the given file.
 
         1. The file may be an OVF descriptor itself.
-        2. The file may be an OVA, in which case we need to untar it and
-           return the path to the extracted OVF descriptor.
+        2. The file may be an OVA, in which case we need to locate the
+           OVF descriptor within the TAR archive.
 
         Args:
-          input_file (str): Path to an OVF descriptor or OVA file.
+          input_file (str): Path to an OVF descriptor or OVA file, or URL
+              of an OVA file.
 
         Returns:
-          str: OVF descriptor path
+          str: OVF descriptor path, or name of the OVF descriptor within
+          the OVA.
+
+        Raises:
+          VMInitError: if ``input_file`` is the URL of an OVF descriptor.
         """
+        if input_file == STREAM_PATH:
+            return self._untar_stream()
         extension = self.detect_type_from_name(input_file)
+        if is_url(input_file) and extension == '.ovf':
+            raise VMInitError(2, "Only OVA files can be read from a URL",
+                              input_file)
         if extension == '.ova' or extension == '.box':
-            # Untar the ova to our working directory
+            # Find the descriptor inside the ova
             return self.untar(input_file)
         elif extension == '.ovf':
             return input_file
         else:
             return None
 
-    def __init__(self, input_file, output_file):
+    def __init__(self, input_file, output_file, lazy=False):
         """Open the specified OVF and read its XML into memory.
 
         Args:
@@ -282,18 +366,27 @@ class OVF(VMDescription, XML):
               (there will never be an output file) this value should be
               ``None``; if the output filename is not yet known, use ``""``
               and subsequently set :attr:`output_file` when it is determined.
+          lazy (bool): If True, the model of the virtual hardware
+              (:attr:`hardware`) and the references to the files in the
+              package are only built when first needed, rather than now.
+              This saves time for callers that only need, for example,
+              :attr:`product_class` or :attr:`environment_properties`,
+              but an invalid hardware description is then only reported
+              when :attr:`hardware` is first used.
 
         Raises:
           VMInitError:
               * if the OVF descriptor cannot be located
               * if an XML parsing error occurs
               * if the XML is not actually an OVF descriptor
-              * if the OVF hardware validation fails
+              * if the OVF hardware validation fails (unless ``lazy``)
           Exception: will call :meth:`destroy` to clean up before reraising
               any exception encountered.
         """
         try:
             self.output_extension = None
+            self._tar_index = None
+            self._tar_stream = None
             VMDescription.__init__(self, input_file, output_file)
 
             # Make sure we know how to read the input
@@ -306,12 +399,7 @@ class OVF(VMDescription, XML):
                     input_file)
 
             # Open the provided OVF
-            try:
-                XML.__init__(self, self.ovf_descriptor)
-            except ParseError as e:
-                raise VMInitError(2,
-                                  "XML error in parsing file: " + str(e),
-                                  self.ovf_descriptor)
+            self._read_descriptor()
 
             # Quick sanity check before we go any further:
             if ((not re.search(r"Envelope", self.root.tag)) or
@@ -324,6 +412,22 @@ class OVF(VMDescription, XML):
                     self.ovf_descriptor)
 
             self._ovf_version = None
+            self._checksum_type = None
+            self.trailing_manifest = False
+            """If True, the manifest is placed at the end of an OVA."""
+            self.descriptor_padding = 0
+            """Bytes of space to reserve after the descriptor in an OVA."""
+            self.link_mode = 'auto'
+            """How to place files into an OVF directory; see
+            :func:`~COT.file_copy.link_or_copy_file`."""
+            self.chunk_size = None
+            """Maximum size of each file written, in bytes. Larger files are
+            split into chunks. ``0`` disables chunking, and ``None`` (the
+            default) keeps the chunk size, if any, of each input file."""
+            self.file_compression = None
+            """Compression to apply to files other than VMDKs, which are
+            already compressed: ``'gzip'`` or ``'none'``. ``None`` (the
+            default) keeps the compression, if any, of each input file."""
             self.name_helper = name_helper(self.ovf_version)
 
             for (prefix, URI) in self.NSM.items():
@@ -369,47 +473,202 @@ class OVF(VMDescription, XML):
                 self.VIRTUAL_HW_SECTION,
                 attrib=self.VIRTUAL_HW_SECTION_ATTRIB,
                 required=True)
+            for section in (self.references, self.disk_section,
+                            self.product_section):
+                self._index_section(section)
 
             # Initialize various caches
             self._configuration_profiles = None
-            self._file_references = {}
+            self._file_refs = None
+            self._hardware = None
             self._platform = None
 
-            try:
-                self.hardware = OVFHardware(self)
-            except OVFHardwareDataError as e:
-                raise VMInitError(1,
-                                  "OVF descriptor is invalid: {0}".format(e),
-                                  self.ovf_descriptor)
-
             assert self.platform
 
-            self._init_check_file_entries()
+            if not lazy:
+                self._init_hardware()
+                self._init_check_file_entries()
 
         except Exception as e:
             self.destroy()
             raise
 
+    def _read_descriptor(self):
+        """Parse the XML of :attr:`ovf_descriptor` into memory.
+
+        If the input is an OVA, the descriptor is read directly from the
+        archive, without extracting it to disk.
+
+        Raises:
+          VMInitError: if an XML parsing error occurs
+        """
+        try:
+            if self._tar_stream is not None:
+                descriptor_ref = FileInStream(self._tar_stream,
+                                              self.ovf_descriptor)
+                try:
+                    XML.__init__(self, descriptor_ref.open('rb'))
+                finally:
+                    descriptor_ref.close()
+            elif self._tar_index is None:
+                XML.__init__(self, self.ovf_descriptor)
+            else:
+                descriptor_ref = FileInTAR(self.input_file,
+                                           self.ovf_descriptor,
+                                           tar_index=self._tar_index)
+                try:
+                    XML.__init__(self, descriptor_ref.open('rb'))
+                finally:
+                    descriptor_ref.close()
+        except ParseError as e:
+            raise VMInitError(2,
+                              "XML error in parsing file: " + str(e),
+                              self.ovf_descriptor)
+
+    @property
+    def hardware(self):
+        """:class:`~COT.ovf.hardware.OVFHardware` describing this VM.
+
+        Built from the ``VirtualHardwareSection`` on first access, if this
+        OVF was opened with ``lazy=True``.
+
+        Raises:
+          VMInitError: if the OVF hardware validation fails
+        """
+        if self._hardware is None:
+            self._init_hardware()
+        return self._hardware
+
+    def _init_hardware(self):
+        """Build :attr:`hardware` from the ``VirtualHardwareSection``.
+
+        Raises:
+          VMInitError: if the OVF hardware validation fails
+        """
+        try:
+            self._hardware = OVFHardware(self)
+        except OVFHardwareDataError as e:
+            raise VMInitError(1,
+                              "OVF descriptor is invalid: {0}".format(e),
+                              self.ovf_descriptor)
+
+    @property
+    def _file_references(self):
+        """Dictionary of file name to reference to that file in the input.
+
+        Built from the ``References`` section on first access, if this OVF
+        was opened with ``lazy=True``; see :meth:`_init_check_file_entries`.
+        """
+        if self._file_refs is None:
+            self._init_check_file_entries()
+        return self._file_refs
+
     def _init_check_file_entries(self):
-        """Check files described in the OVF and store file references."""
-        file_list = [f.get(self.FILE_HREF) for f in
-                     self.references.findall(self.FILE)]
-        if self.input_file == self.ovf_descriptor:
-            # Check files in the directory referenced by the OVF descriptor
-            input_path = os.path.dirname(self.ovf_descriptor)
-            ref_cls = FileOnDisk
-        else:
-            # OVA - check contents of TAR file.
-            input_path = self.input_file
-            ref_cls = FileInTAR
+        """Check files described in the OVF and store file references.
 
-        for f in file_list:
+        The chunks of a chunked file are referenced as a single file.
+        The :attr:`~COT.file_reference.FileReference.compression` of each
+        file is recorded in its reference.
+        """
+        self._file_refs = {}
+        declared_sizes = self._declared_sizes()
+        for file_elem in self.references.findall(self.FILE):
+            f = file_elem.get(self.FILE_HREF)
             try:
-                self._file_references[f] = ref_cls(input_path, f)
+                if file_elem.get(self.FILE_CHUNK_SIZE):
+                    file_ref = FileSpan.join(
+                        f, self._input_chunk_references(file_elem))
+                else:
+                    file_ref = self._input_file_reference(
+                        f, declared_sizes.get(f))
             except IOError:
                 logger.error("File '%s' referenced in the OVF descriptor "
                              "does not exist.", f)
-                self._file_references[f] = None
+                file_ref = None
+            compression = file_elem.get(self.FILE_COMPRESSION, 'identity')
+            if file_ref is not None and compression != 'identity':
+                if compression not in COMPRESSION_TYPES:
+                    logger.warning("File '%s' has unsupported compression "
+                                   "type '%s'", f, compression)
+                file_ref.compression = compression
+            self._file_refs[f] = file_ref
+
+    def _input_chunk_references(self, file_elem):
+        """Get references to each chunk of the given chunked file.
+
+        Args:
+          file_elem (xml.etree.ElementTree.Element): File element with a
+              chunk size.
+
+        Returns:
+          list: File references for each chunk, in order.
+
+        Raises:
+          IOError: if any chunk is missing from the input package.
+          VMInitError: if the input package is being read from a stream.
+        """
+        file_name = file_elem.get(self.FILE_HREF)
+        if self._tar_stream is not None:
+            raise VMInitError(2, "Chunked file {0} cannot be read from a "
+                              "stream".format(file_name), self.input_file)
+        size = file_elem.get(self.FILE_SIZE)
+        if size is not None:
+            chunk_size = int(file_elem.get(self.FILE_CHUNK_SIZE))
+            count = max(1, -(-int(size) // chunk_size))
+            return [self._input_file_reference(chunk_file_name(file_name, i))
+                    for i in range(count)]
+        # FILE_SIZE is optional, so just look for as many chunks as exist
+        chunks = []
+        while True:
+            try:
+                chunks.append(self._input_file_reference(
+                    chunk_file_name(file_name, len(chunks))))
+            except IOError:
+                break
+        if not chunks:
+            raise IOError("No chunks of {0} found".format(file_name))
+        return chunks
+
+    def _input_file_reference(self, file_name, size=None):
+        """Get a reference to the named file in the input package.
+
+        Args:
+          file_name (str): Name of the file, relative to the OVF descriptor.
+          size (int): Size of the file as declared in the descriptor, if
+              any (see :meth:`_declared_sizes`). Only needed if the input
+              package is being read from a stream.
+
+        Returns:
+          FileReference: Reference to the file in the input directory
+          (for an OVF) or TAR archive or stream (for an OVA).
+
+        Raises:
+          IOError: if the file does not exist in the input package.
+        """
+        if self._tar_stream is not None:
+            # Files are located in the stream as it is read
+            return FileInStream(self._tar_stream, file_name, size)
+        if self._tar_index is None:
+            # Check files in the directory referenced by the OVF descriptor
+            return FileOnDisk(os.path.dirname(self.ovf_descriptor), file_name)
+        # OVA - check contents of TAR file.
+        # All references share a single index of the TAR members,
+        # rather than each one rescanning the whole archive.
+        return FileInTAR(self.input_file, file_name,
+                         tar_index=self._tar_index)
+
+    def _declared_sizes(self):
+        """Get the sizes of files as declared in the descriptor.
+
+        Returns:
+          dict: ``{file_name: size}`` for each file whose size is declared.
+        """
+        sizes = {}
+        for file_elem in self.references.findall(self.FILE):
+            size = file_elem.get(self.FILE_SIZE)
+            if size is not None:
+                sizes.setdefault(file_elem.get(self.FILE_HREF), int(size))
+        return sizes
 
     @property
     def output_file(self):
@@ -453,6 +712,29 @@ class OVF(VMDescription, XML):
                     self.ovf_descriptor)
         return self._ovf_version
 
+    @property
+    def checksum_type(self):
+        """Checksum algorithm to use when generating the manifest.
+
+        Unless explicitly set, this is 'sha256' for OVF 2.x and 'sha1'
+        for earlier versions, as specified by the respective standards.
+
+        Raises:
+          ValueUnsupportedError: if set to an unsupported algorithm.
+        """
+        if self._checksum_type is None:
+            if self.ovf_version >= 2.0:
+                return 'sha256'
+            return 'sha1'
+        return self._checksum_type
+
+    @checksum_type.setter
+    def checksum_type(self, value):
+        if value is not None and value not in self.MANIFEST_CHECKSUM_TYPES:
+            raise ValueUnsupportedError("checksum type", value,
+                                        self.MANIFEST_CHECKSUM_TYPES)
+        self._checksum_type = value
+
     @property
     def product_class(self):
         """The product class identifier, such as com.cisco.csr1000v."""
@@ -793,6 +1075,11 @@ class OVF(VMDescription, XML):
 
         prefix = os.path.splitext(self.output_file)[0]
         extension = self.output_extension
+        if self.output_file == STREAM_PATH:
+            # Keep the name of the input descriptor
+            prefix = os.path.splitext(self.ovf_descriptor)[0]
+        if STREAM_PATH in (self.input_file, self.output_file):
+            self._prepare_streaming()
 
         # Update the XML ElementTree to reflect any hardware changes
         self.hardware.update_xml()
@@ -800,6 +1087,9 @@ class OVF(VMDescription, XML):
         # Validate the hardware to be written
         self.validate_hardware()
 
+        # Compress or decompress files if requested
+        self.update_file_compression()
+
         # Make sure file references are correct:
         self.validate_and_update_file_references()
 
@@ -813,17 +1103,21 @@ class OVF(VMDescription, XML):
             ovf_file = os.path.join(self.working_dir, "{0}.ovf"
                                     .format(os.path.basename(prefix)))
             self.write_xml(ovf_file)
-            self.generate_manifest(ovf_file)
+            if self._write_descriptor_in_place(ovf_file):
+                return
+            if self.descriptor_padding:
+                # Reserve space for future in-place updates
+                with open(ovf_file, 'ab') as f:
+                    f.write(whitespace_padding(self.descriptor_padding))
+            if not self.trailing_manifest:
+                self.generate_manifest(ovf_file)
+            # else, tar() will generate the manifest as it goes
             self.tar(ovf_file, self.output_file)
         elif extension == '.ovf':
             self.write_xml(self.output_file)
             # Copy all files from working directory to destination
-            dest_dir = os.path.dirname(os.path.abspath(self.output_file))
-
-            for file_obj in self.references.findall(self.FILE):
-                file_name = file_obj.get(self.FILE_HREF)
-                file_ref = self._file_references[file_name]
-                file_ref.copy_to(dest_dir)
+            self._copy_files(os.path.dirname(os.path.abspath(
+                self.output_file)))
 
             # Generate manifest
             self.generate_manifest(self.output_file)
@@ -832,6 +1126,25 @@ class OVF(VMDescription, XML):
             raise NotImplementedError("Not sure how to write a '{0}' file"
                                       .format(extension))
 
+    def _prepare_streaming(self):
+        """Prepare to read the input and/or write the output as a stream.
+
+        Helper method for :meth:`write`. Since the files in a stream can
+        only be read once, and in order, the manifest is placed at the end
+        of the output OVA and its checksums computed as the files are
+        written. Any input files that are passed over in the input stream
+        before they are needed are spilled to :attr:`working_dir`.
+        """
+        if not self.trailing_manifest:
+            logger.verbose("Placing the manifest at the end of the OVA, "
+                           "as the OVA is being streamed")
+            self.trailing_manifest = True
+        if self._tar_stream is not None:
+            self._tar_stream.spill_dir = self.working_dir
+            self._tar_stream.wanted = set(
+                ref.filename for ref in self._file_references.values()
+                if isinstance(ref, FileInStream))
+
     def validate_and_update_file_references(self):
         """Check all File entries to make sure they are valid and up to date.
 
@@ -850,7 +1163,7 @@ class OVF(VMDescription, XML):
             if file_ref is None:
                 # TODO this should probably have a confirm() check...
                 logger.warning("Removing reference to missing file %s", href)
-                self.references.remove(file_elem)
+                XML.remove_child(self.references, file_elem)
                 # TODO remove references to this file from Disk, Item?
                 continue
 
@@ -859,7 +1172,8 @@ class OVF(VMDescription, XML):
             # We can't check disk capacity inside a tar file.
             # It seems wasteful to extract the disk file (could be
             # quite large) from the TAR just to check, so we don't.
-            if file_ref.file_path is not None:
+            # Likewise for a compressed file.
+            if file_ref.file_path is not None and not file_ref.compression:
                 dr = disk_representation_from_file(file_ref.file_path)
                 real_capacity = dr.capacity
 
@@ -876,6 +1190,7 @@ class OVF(VMDescription, XML):
                                    "The updated OVF will reflect this change.",
                                    href, reported_size, real_size)
                 file_elem.set(self.FILE_SIZE, real_size)
+            self._update_chunk_size(file_elem, file_ref.size)
 
             if disk_item is not None and real_capacity is not None:
                 reported_capacity = str(self.get_capacity_from_disk(disk_item))
@@ -888,6 +1203,195 @@ class OVF(VMDescription, XML):
                         href, reported_capacity, real_capacity)
                     self.set_capacity_of_disk(disk_item, real_capacity)
 
+    def update_file_compression(self):
+        """Compress or decompress files per :attr:`file_compression`.
+
+        Helper method for :meth:`write`. As the descriptor, which must come
+        first in an OVA, records the size of each compressed file, files are
+        compressed into the working directory before being archived.
+        Files that don't get any smaller are left uncompressed.
+        """
+        if self.file_compression is None:
+            return
+        for file_elem in self.references.findall(self.FILE):
+            href = file_elem.get(self.FILE_HREF)
+            file_ref = self._file_references[href]
+            if file_ref is None:
+                continue
+            if self.file_compression == 'none':
+                if file_ref.compression is not None:
+                    self._decompress_file(file_elem, file_ref)
+            elif (file_ref.compression is None and
+                  not href.lower().endswith('.vmdk')):
+                self._compress_file(file_elem, file_ref)
+
+    def _compress_file(self, file_elem, file_ref):
+        """Gzip-compress the given file into the working directory.
+
+        Helper method for :meth:`update_file_compression`.
+
+        Args:
+          file_elem (xml.etree.ElementTree.Element): File element to update
+          file_ref (FileReference): Uncompressed file.
+        """
+        href = file_elem.get(self.FILE_HREF)
+        dest_path = os.path.join(self.working_dir, 'gzip', href)
+        if not os.path.isdir(os.path.dirname(dest_path)):
+            os.makedirs(os.path.dirname(dest_path))
+        logger.info("Compressing %s", href)
+        with open(dest_path, 'wb') as dest:
+            try:
+                size = gzip_compress(file_ref.open('rb'), dest)
+            finally:
+                file_ref.close()
+        compressed_size = os.path.getsize(dest_path)
+        if compressed_size >= size:
+            logger.verbose("Not compressing %s, as that would not make it "
+                           "any smaller", href)
+            os.remove(dest_path)
+            return
+        logger.verbose("Compressed %s from %s to %s", href, byte_string(size),
+                       byte_string(compressed_size))
+        compressed_ref = FileOnDisk(dest_path)
+        compressed_ref.compression = 'gzip'
+        self._file_references[href] = compressed_ref
+        file_elem.set(self.FILE_COMPRESSION, 'gzip')
+        file_elem.set(self.FILE_SIZE, str(compressed_size))
+
+    def _decompress_file(self, file_elem, file_ref):
+        """Decompress the given file into the working directory.
+
+        Helper method for :meth:`update_file_compression`.
+
+        Args:
+          file_elem (xml.etree.ElementTree.Element): File element to update
+          file_ref (FileReference): Compressed file.
+        """
+        href = file_elem.get(self.FILE_HREF)
+        dest_path = os.path.join(self.working_dir, 'decompressed', href)
+        if not os.path.isdir(os.path.dirname(dest_path)):
+            os.makedirs(os.path.dirname(dest_path))
+        logger.info("Decompressing %s", href)
+        with open(dest_path, 'wb') as dest:
+            try:
+                shutil.copyfileobj(file_ref.open_decompressed(), dest,
+                                   1024 * 1024)
+            finally:
+                file_ref.close()
+        self._file_references[href] = FileOnDisk(dest_path)
+        del file_elem.attrib[self.FILE_COMPRESSION]
+        file_elem.set(self.FILE_SIZE, str(os.path.getsize(dest_path)))
+
+    def _update_chunk_size(self, file_elem, size):
+        """Set or clear the chunk size of a File as per :attr:`chunk_size`.
+
+        Helper method for :meth:`validate_and_update_file_references`.
+
+        Args:
+          file_elem (xml.etree.ElementTree.Element): File element to update
+          size (int): Size of the file, in bytes.
+        """
+        if self.chunk_size is None:
+            return
+        if self.chunk_size and size > self.chunk_size:
+            file_elem.set(self.FILE_CHUNK_SIZE, str(self.chunk_size))
+        elif file_elem.get(self.FILE_CHUNK_SIZE) is not None:
+            del file_elem.attrib[self.FILE_CHUNK_SIZE]
+
+    def _package_files(self):
+        """List the files in this package, other than descriptor and manifest.
+
+        Chunked files are listed as each of their chunks.
+
+        Returns:
+          list: ``(file_name, file_ref)`` for each file, in the order that
+          the files are listed in the descriptor.
+        """
+        result = []
+        for file_elem in self.references.findall(self.FILE):
+            href = file_elem.get(self.FILE_HREF)
+            file_ref = self._file_references[href]
+            chunk_size = int(file_elem.get(self.FILE_CHUNK_SIZE, 0))
+            if chunk_size and file_ref is not None:
+                result.extend((chunk.filename, chunk) for chunk in
+                              FileSpan.split(file_ref, chunk_size, href))
+            else:
+                result.append((href, file_ref))
+        return result
+
+    def _copy_files(self, dest_dir):
+        """Copy all files in this package to the given directory, in parallel.
+
+        Helper method for :meth:`write`. File chunks are written to
+        temporary files and only renamed into place once all copying is
+        complete, as they may be read from the very files they are
+        replacing (for example, when changing the chunk size in place).
+        If any input files were replaced, or were read from a stream and
+        so cannot be read again, all file references are updated to refer
+        to the output files instead.
+
+        Args:
+          dest_dir (str): Output directory
+        """
+        package_files = self._package_files()
+        renames = []
+
+        def _copy(item):
+            """Copy a single file or chunk."""
+            (file_name, file_ref) = item
+            if not isinstance(file_ref, FileSpan):
+                file_ref.copy_to(dest_dir, link_mode=self.link_mode)
+                return
+            dest_path = os.path.join(dest_dir, file_name)
+            if (file_ref.file_path is not None and
+                    os.path.abspath(file_ref.file_path) == dest_path):
+                return
+            temp_path = "{0}.{1}.tmp".format(dest_path, os.getpid())
+            renames.append((temp_path, dest_path))
+            file_ref.copy_to(temp_path)
+
+        try:
+            parallel_map(_copy, package_files, default_workers())
+            for (temp_path, dest_path) in renames:
+                _replace(temp_path, dest_path)
+        finally:
+            for (temp_path, _) in renames:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        if self._tar_stream is not None:
+            # The input files cannot be read again
+            self._refer_to_output_files(dest_dir)
+            return
+        if not renames:
+            return
+        sources = set(os.path.abspath(extent[0])
+                      for (_, file_ref) in package_files
+                      for extent in file_ref.extents)
+        if any(dest_path in sources for (_, dest_path) in renames):
+            self._refer_to_output_files(dest_dir)
+
+    def _refer_to_output_files(self, dest_dir):
+        """Update all file references to refer to the files in ``dest_dir``.
+
+        Helper method for :meth:`_copy_files`.
+
+        Args:
+          dest_dir (str): Output directory
+        """
+        logger.debug("Updating file references to refer to %s", dest_dir)
+        for file_elem in self.references.findall(self.FILE):
+            href = file_elem.get(self.FILE_HREF)
+            chunk_size = int(file_elem.get(self.FILE_CHUNK_SIZE, 0))
+            if not chunk_size:
+                self._file_references[href] = FileOnDisk(dest_dir, href)
+                continue
+            chunks = FileSpan.split(self._file_references[href], chunk_size,
+                                    href)
+            self._file_references[href] = FileSpan.join(
+                href, [FileOnDisk(dest_dir, chunk.filename)
+                       for chunk in chunks])
+
     def validate_and_update_networks(self):
         """Make sure all defined networks are actually used by NICs.
 
@@ -908,11 +1412,11 @@ class OVF(VMDescription, XML):
             name = net.get(self.NETWORK_NAME)
             if name not in connected_networks:
                 logger.warning("Removing unused network %s", name)
-                self.network_section.remove(net)
+                XML.remove_child(self.network_section, net)
         # If all networks were removed, remove the NetworkSection too
         if not self.network_section.findall(self.NETWORK):
             logger.warning("No networks left - removing NetworkSection")
-            self.envelope.remove(self.network_section)
+            XML.remove_child(self.envelope, self.network_section)
             self.network_section = None
 
     def _info_string_header(self, width):
@@ -1530,8 +2034,9 @@ class OVF(VMDescription, XML):
                               attrib={self.CONFIG_ID: pid})
         if cfg is None:
             logger.debug("Creating new Configuration element")
-            cfg = ET.SubElement(self.deploy_opt_section, self.CONFIG,
-                                {self.CONFIG_ID: pid})
+            cfg = SubElement(self.deploy_opt_section, self.CONFIG,
+                             {self.CONFIG_ID: pid})
+            XML.mark_dirty(self.deploy_opt_section)
 
         self.set_or_make_child(cfg, self.CFG_LABEL, label)
         self.set_or_make_child(cfg, self.CFG_DESC, description)
@@ -1564,10 +2069,10 @@ class OVF(VMDescription, XML):
             item.remove_profile(profile, split_default=False)
 
         # Delete the profile declaration itself
-        self.deploy_opt_section.remove(cfg)
+        XML.remove_child(self.deploy_opt_section, cfg)
 
         if not self.deploy_opt_section.findall(self.CONFIG):
-            self.envelope.remove(self.deploy_opt_section)
+            XML.remove_child(self.envelope, self.deploy_opt_section)
 
         # Clear cache
         logger.debug("Profile %s deleted - clear config_profiles cache",
@@ -2315,7 +2820,7 @@ class OVF(VMDescription, XML):
         if file_obj is not None:
             file_obj.clear()
         elif disk is None:
-            file_obj = ET.SubElement(self.references, self.FILE)
+            file_obj = SubElement(self.references, self.FILE)
         else:
             # The OVF standard requires that Disks which reference a File
             # be listed in the same order as the Files.
@@ -2340,7 +2845,7 @@ class OVF(VMDescription, XML):
                     break
                 disk_index += 1
 
-            file_obj = ET.Element(self.FILE)
+            file_obj = Element(self.FILE)
             self.references.insert(file_index, file_obj)
 
         file_size_string = str(os.path.getsize(file_path))
@@ -2349,6 +2854,8 @@ class OVF(VMDescription, XML):
         file_obj.set(self.FILE_ID, file_id)
         file_obj.set(self.FILE_HREF, file_name)
         file_obj.set(self.FILE_SIZE, file_size_string)
+        XML.invalidate_index(self.references)
+        XML.mark_dirty(self.references)
 
         # Make a note of the file's location - we'll copy it at write time.
         self._file_references[file_name] = FileOnDisk(file_path)
@@ -2368,11 +2875,11 @@ class OVF(VMDescription, XML):
           ValueUnsupportedError: If the ``disk_drive`` is a device type other
               than 'cdrom' or 'harddisk'
         """
-        self.references.remove(file_obj)
+        XML.remove_child(self.references, file_obj)
         del self._file_references[file_obj.get(self.FILE_HREF)]
 
         if disk is not None:
-            self.disk_section.remove(disk)
+            XML.remove_child(self.disk_section, disk)
 
         if disk_drive is not None:
             # For a CD-ROM drive, we can simply unmap the file.
@@ -2405,10 +2912,10 @@ class OVF(VMDescription, XML):
                 logger.warning("CD-ROMs do not require a Disk element. "
                                "Existing element will be deleted.")
                 if self.disk_section is not None:
-                    self.disk_section.remove(disk)
+                    XML.remove_child(self.disk_section, disk)
                     if not self.disk_section.findall(self.DISK):
                         logger.warning("No Disks left - removing DiskSection")
-                        self.envelope.remove(self.disk_section)
+                        XML.remove_child(self.envelope, self.disk_section)
                         self.disk_section = None
                 disk = None
             else:
@@ -2429,12 +2936,14 @@ class OVF(VMDescription, XML):
             disk.clear()
         else:
             disk_id = file_id
-            disk = ET.SubElement(self.disk_section, self.DISK)
+            disk = SubElement(self.disk_section, self.DISK)
 
         self.set_capacity_of_disk(disk, disk_repr.capacity)
 
         disk.set(self.DISK_ID, disk_id)
         disk.set(self.DISK_FILE_REF, file_id)
+        XML.invalidate_index(self.disk_section)
+        XML.mark_dirty(self.disk_section)
         disk.set(self.DISK_FORMAT,
                  ("http://www.vmware.com/interfaces/"
                   "specifications/vmdk.html#streamOptimized"))
@@ -2591,77 +3100,104 @@ class OVF(VMDescription, XML):
     # Helper methods - for internal use only
 
     def untar(self, file_path):
-        """Untar the OVF descriptor from an .ova to the working directory.
+        """Index the contents of an .ova and locate its OVF descriptor.
+
+        Nothing is extracted to disk; the descriptor can be read directly
+        out of the archive by way of :attr:`_tar_index`.
 
         Args:
           file_path (str): OVA file path
 
         Returns:
-          str: Path to extracted OVF descriptor
+          str: Name of the OVF descriptor within the OVA
 
         Raises:
           VMInitError: if the given file doesn't represent a valid OVA archive.
         """
-        logger.verbose("Untarring %s to working directory %s",
-                       file_path, self.working_dir)
+        logger.verbose("Indexing contents of %s", file_path)
 
         try:
-            tarf = tarfile.open(file_path, 'r')
-        except (EOFError, tarfile.TarError) as e:
+            self._tar_index = TarIndex(file_path)
+            members = self._tar_index.members
+        except (IOError, EOFError, tarfile.TarError) as e:
             raise VMInitError(1, "Could not untar file: {0}".format(e.args),
                               file_path)
 
-        try:
-            # The OVF standard says, with regard to OVAs:
-            # ...the files shall be in the following order inside the archive:
-            # 1) OVF descriptor
-            # 2) OVF manifest (optional)
-            # 3) OVF certificate (optional)
-            # 4) The remaining files shall be in the same order as listed
-            #    in the References section...
-            # 5) OVF manifest (optional)
-            # 6) OVF certificate (optional)
-            #
-            # For now we just validate #1.
-            if not tarf.getmembers():
-                raise VMInitError(1, "No files to untar", file_path)
-            # Make sure the provided file doesn't contain any malicious paths
-            # http://stackoverflow.com/questions/8112742/
-            for n in tarf.getnames():
-                logger.debug("Examining path of %s prior to untar", n)
-                if not (os.path.abspath(os.path.join(self.working_dir, n))
-                        .startswith(self.working_dir)):
-                    raise VMInitError(1, "Tar file contains malicious/unsafe "
-                                      "file path '{0}'!".format(n), file_path)
-
-            ovf_descriptor = tarf.getmembers()[0]
-            if os.path.splitext(ovf_descriptor.name)[1] != '.ovf':
-                # Do we have an OVF descriptor elsewhere in the file?
-                candidates = [mem for mem in tarf.getmembers() if
-                              os.path.splitext(mem.name)[1] == '.ovf']
-                if not candidates:
-                    raise VMInitError(1,
-                                      "TAR file '{0}' does not contain an OVF "
-                                      "descriptor - OVA is invalid!"
-                                      .format(ovf_descriptor.name),
-                                      file_path)
-                ovf_descriptor = candidates[0]
-                logger.warning(
-                    "OVF file %s found, but is not the first file in the TAR "
-                    "as it should be - OVA is not standard-compliant!",
-                    ovf_descriptor.name)
-
-            # TODO: In theory we could read the ovf descriptor XML directly
-            # from the TAR and not need to even extract this file to disk...
-            tarf.extract(ovf_descriptor, path=self.working_dir)
-            logger.verbose(
-                "Extracted OVF descriptor from %s to working dir %s",
-                file_path, self.working_dir)
-        finally:
-            tarf.close()
+        # The OVF standard says, with regard to OVAs:
+        # ...the files shall be in the following order inside the archive:
+        # 1) OVF descriptor
+        # 2) OVF manifest (optional)
+        # 3) OVF certificate (optional)
+        # 4) The remaining files shall be in the same order as listed
+        #    in the References section...
+        # 5) OVF manifest (optional)
+        # 6) OVF certificate (optional)
+        #
+        # For now we just validate #1. The manifest contents, wherever it
+        # may be, can be checked separately with verify_manifest().
+        if not members:
+            raise VMInitError(1, "No files to untar", file_path)
+        # Make sure the provided file doesn't contain any malicious paths
+        # http://stackoverflow.com/questions/8112742/
+        for mem in members:
+            n = mem.name
+            logger.debug("Examining path of %s prior to untar", n)
+            norm_path = os.path.normpath(n)
+            if (os.path.isabs(norm_path) or norm_path == os.pardir or
+                    norm_path.startswith(os.pardir + os.sep)):
+                raise VMInitError(1, "Tar file contains malicious/unsafe "
+                                  "file path '{0}'!".format(n), file_path)
+
+        ovf_descriptor = members[0]
+        if os.path.splitext(ovf_descriptor.name)[1] != '.ovf':
+            # Do we have an OVF descriptor elsewhere in the file?
+            candidates = [mem for mem in members if
+                          os.path.splitext(mem.name)[1] == '.ovf']
+            if not candidates:
+                raise VMInitError(1,
+                                  "TAR file '{0}' does not contain an OVF "
+                                  "descriptor - OVA is invalid!"
+                                  .format(ovf_descriptor.name),
+                                  file_path)
+            ovf_descriptor = candidates[0]
+            logger.warning(
+                "OVF file %s found, but is not the first file in the TAR "
+                "as it should be - OVA is not standard-compliant!",
+                ovf_descriptor.name)
+
+        return ovf_descriptor.name
+
+    def _untar_stream(self):
+        """Begin reading an .ova from standard input.
 
-        # Find the OVF file
-        return os.path.join(self.working_dir, ovf_descriptor.name)
+        Only the OVF descriptor, which must be the first file in the OVA,
+        is read at this time; the remaining files are read from the stream
+        by way of :attr:`_tar_stream` as and when they are needed.
+
+        Returns:
+          str: Name of the OVF descriptor within the OVA
+
+        Raises:
+          VMInitError: if the stream isn't an OVA beginning with an OVF
+              descriptor.
+        """
+        logger.verbose("Reading OVA from standard input")
+        try:
+            self._tar_stream = TarStream(getattr(sys.stdin, 'buffer',
+                                                 sys.stdin))
+            ovf_descriptor = self._tar_stream.peek()
+        except (IOError, tarfile.TarError) as e:
+            raise VMInitError(1, "Could not untar stream: {0}".format(e),
+                              self.input_file)
+        if ovf_descriptor is None:
+            raise VMInitError(1, "No files to untar", self.input_file)
+        if os.path.splitext(ovf_descriptor.name)[1] != '.ovf':
+            raise VMInitError(1,
+                              "First file in TAR stream is '{0}', not an OVF "
+                              "descriptor - OVA is invalid!"
+                              .format(ovf_descriptor.name),
+                              self.input_file)
+        return ovf_descriptor.name
 
     def generate_manifest(self, ovf_file):
         """Construct the manifest file for this package, if possible.
@@ -2674,64 +3210,402 @@ class OVF(VMDescription, XML):
           False if not successful (such as if checksum helper tools are
           unavailable).
         """
-        (prefix, _) = os.path.splitext(ovf_file)
         logger.verbose("Generating manifest for %s", ovf_file)
-        manifest = prefix + '.mf'
-        # TODO: OVF 2.0 uses SHA256 instead of SHA1.
-        sha1sum = file_checksum(ovf_file, 'sha1')
+        checksum_type = self.checksum_type
+        # Files carried over unchanged don't need to be checksummed again
+        cache = default_digest_cache()
+        # Checksum all referenced files (or file chunks), in parallel
+        package_files = self._package_files()
+        digests = digest_files([file_ref for (_, file_ref) in package_files],
+                               [checksum_type], cache=cache)
+        self._write_manifest(ovf_file, zip([file_name for (file_name, _)
+                                            in package_files],
+                                           [digest[checksum_type]
+                                            for digest in digests]))
+        cache.save()
+
+        logger.debug("Manifest generated successfully")
+        return True
+
+    def _write_manifest(self, ovf_file, file_checksums):
+        """Write the manifest file for the given OVF descriptor.
+
+        Args:
+          ovf_file (str): OVF descriptor file path. The manifest will be
+              written alongside it, with the extension ``.mf``.
+          file_checksums (list): ``(file_name, checksum)`` tuples describing
+              all other files in the package, in the desired order, as
+              computed with :attr:`checksum_type`.
+
+        Returns:
+          str: Path to the manifest file
+        """
+        checksum_type = self.checksum_type
+        manifest = os.path.splitext(ovf_file)[0] + '.mf'
         with open(manifest, 'wb') as f:
-            f.write("SHA1({file})= {sum}\n"
-                    .format(file=os.path.basename(ovf_file), sum=sha1sum)
-                    .encode('utf-8'))
-            # Checksum all referenced files as well
-            for file_obj in self.references.findall(self.FILE):
-                file_name = file_obj.get(self.FILE_HREF)
-                file_ref = self._file_references[file_name]
-                try:
-                    file_obj = file_ref.open('rb')
-                    sha1sum = file_checksum(file_obj, 'sha1')
-                finally:
-                    file_ref.close()
+            f.write(self._manifest_data(
+                checksum_type,
+                [(os.path.basename(ovf_file),
+                  file_checksum(ovf_file, checksum_type))] +
+                list(file_checksums)))
+        return manifest
 
-                f.write("SHA1({file})= {sum}\n"
-                        .format(file=file_name, sum=sha1sum)
-                        .encode('utf-8'))
+    @staticmethod
+    def _manifest_data(checksum_type, file_checksums):
+        """Construct the contents of a manifest file.
 
-        logger.debug("Manifest generated successfully")
+        Args:
+          checksum_type (str): Checksum algorithm, such as ``'sha1'``.
+          file_checksums (list): ``(file_name, checksum)`` tuples for each
+              file in the package, including the OVF descriptor.
+
+        Returns:
+          bytes: Manifest file contents.
+        """
+        line_format = checksum_type.upper() + "({file})= {sum}\n"
+        return "".join(line_format.format(file=file_name, sum=checksum)
+                       for (file_name, checksum) in file_checksums
+                       ).encode('utf-8')
+
+    def verify_manifest(self):
+        """Check the files in the input package against its manifest, if any.
+
+        The files listed in the manifest are checksummed in parallel,
+        directly from the OVA if applicable, reusing the cached digests of
+        any files that are unchanged since they were last checksummed.
+
+        Returns:
+          dict: ``{file_name: problem_description}`` for each file that
+          failed verification (empty if all files were verified
+          successfully), or ``None`` if the package has no manifest.
+
+        Raises:
+          NotImplementedError: if the package is being read from a stream,
+              as its files can't be read before writing them out.
+        """
+        if self._tar_stream is not None:
+            raise NotImplementedError("Can't verify an OVA read from a "
+                                      "stream against its manifest")
+        descriptor = os.path.basename(self.ovf_descriptor)
+        manifest = os.path.splitext(descriptor)[0] + '.mf'
+        try:
+            manifest_ref = self._input_file_reference(manifest)
+        except IOError:
+            logger.verbose("No manifest %s found to verify", manifest)
+            return None
+        logger.info("Verifying package contents against manifest %s",
+                    manifest)
+        (entries, problems) = self._read_manifest(manifest_ref)
+
+        # The OVF spec requires all files other than the manifest and
+        # certificate to be listed in the manifest
+        for file_name in [descriptor] + [file_name for (file_name, _)
+                                         in self._package_files()]:
+            if file_name not in entries and file_name not in problems:
+                problems[file_name] = "not listed in the manifest"
+
+        file_refs = {}
+        for file_name in entries:
+            try:
+                file_refs[file_name] = self._input_file_reference(file_name)
+            except IOError:
+                problems[file_name] = ("listed in the manifest but not "
+                                       "present in the package")
+        problems.update(self._verify_checksums(entries, file_refs))
+
+        logger.verbose("Verified %d file(s) against manifest, %d problem(s)",
+                       len(file_refs), len(problems))
+        return problems
+
+    def _read_manifest(self, manifest_ref):
+        """Parse the entries of the given manifest file.
+
+        Args:
+          manifest_ref (FileReference): Manifest file to read.
+
+        Returns:
+          tuple: ``(entries, problems)``, where ``entries`` is a dict of
+          ``{file_name: (checksum_type, checksum)}`` and ``problems`` is a
+          dict of ``{file_name: problem_description}`` for any entries
+          that could not be understood.
+        """
+        entries = {}
+        problems = {}
+        manifest_obj = manifest_ref.open('rb')
+        try:
+            for (line_num, line) in enumerate(manifest_obj, 1):
+                line = line.decode('utf-8').strip()
+                if not line:
+                    continue
+                match = self.MANIFEST_LINE.match(line)
+                if not match:
+                    problems[manifest_ref.filename] = (
+                        "line {0} is not a valid manifest entry: '{1}'"
+                        .format(line_num, line))
+                    continue
+                (checksum_type, file_name, checksum) = match.groups()
+                checksum_type = checksum_type.lower()
+                if checksum_type not in CHECKSUM_TYPES:
+                    problems[file_name] = ("unsupported checksum type '{0}'"
+                                           .format(match.group(1)))
+                    continue
+                entries[file_name] = (checksum_type, checksum.lower())
+        finally:
+            manifest_ref.close()
+        return (entries, problems)
+
+    @staticmethod
+    def _verify_checksums(entries, file_refs):
+        """Compare the actual checksums of files to the expected values.
+
+        Helper method for :meth:`verify_manifest`.
+
+        Args:
+          entries (dict): ``{file_name: (checksum_type, checksum)}``
+          file_refs (dict): ``{file_name: FileReference}`` for each file to
+              be checksummed.
+
+        Returns:
+          dict: ``{file_name: problem_description}`` for each mismatch.
+        """
+        file_names = sorted(file_refs.keys())
+        checksum_types = sorted(set(entries[file_name][0]
+                                    for file_name in file_names))
+        cache = default_digest_cache()
+        digests = digest_files([file_refs[file_name]
+                                for file_name in file_names],
+                               checksum_types, cache=cache)
+        cache.save()
+
+        problems = {}
+        for (file_name, digest) in zip(file_names, digests):
+            (checksum_type, expected) = entries[file_name]
+            if digest[checksum_type] != expected:
+                problems[file_name] = (
+                    "{0} checksum is {1}, but the manifest says {2}"
+                    .format(checksum_type.upper(), digest[checksum_type],
+                            expected))
+        return problems
+
+    def _write_descriptor_in_place(self, ovf_file):
+        """Update the input OVA in place, if only its descriptor has changed.
+
+        If the output OVA is the same as the input OVA, no files have been
+        added, removed, or replaced, and the updated descriptor fits within
+        the space occupied by the original descriptor (see
+        :attr:`descriptor_padding`), then only the descriptor and manifest
+        need to be rewritten, rather than the entire OVA.
+
+        The TAR member headers are left unchanged, so the descriptor is
+        padded with whitespace to exactly its original size. Checksums of
+        other files are carried over from the existing manifest.
+
+        Args:
+          ovf_file (str): Path to the updated OVF descriptor.
+
+        Returns:
+          bool: True if the OVA was updated in place, False if it needs to
+          be rewritten in full instead.
+        """
+        if (self._tar_index is None or
+                os.path.abspath(self.input_file) !=
+                os.path.abspath(self.output_file)):
+            return False
+        try:
+            updates = self._in_place_updates(ovf_file)
+        except ValueError as e:
+            logger.verbose("Unable to update %s in place: %s",
+                           self.output_file, e)
+            return False
+
+        logger.info("Updating descriptor and manifest of %s in place",
+                    self.output_file)
+        with open(self.output_file, 'r+b') as f:
+            for (offset, data) in updates:
+                f.seek(offset)
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
         return True
 
+    def _in_place_updates(self, ovf_file):
+        """Work out what needs to be written to update the input OVA in place.
+
+        Helper method for :meth:`_write_descriptor_in_place`.
+
+        Args:
+          ovf_file (str): Path to the updated OVF descriptor.
+
+        Returns:
+          list: ``(offset, data)`` to be written to the input OVA.
+
+        Raises:
+          ValueError: if the OVA cannot be updated in place.
+        """
+        descriptor_name = os.path.basename(ovf_file)
+        manifest_name = os.path.splitext(descriptor_name)[0] + '.mf'
+        members = self._tar_index.members
+        if os.path.normpath(members[0].name) != descriptor_name:
+            raise ValueError("descriptor {0} is not the first file in the OVA"
+                             .format(descriptor_name))
+        if manifest_name not in self._tar_index:
+            raise ValueError("no manifest {0} to update".format(manifest_name))
+        package_files = self._package_files()
+        for (file_name, file_ref) in package_files:
+            if (file_ref is None or file_name not in self._tar_index or
+                    file_ref.extents != FileInTAR(
+                        self.input_file, file_name,
+                        tar_index=self._tar_index).extents):
+                raise ValueError("files have been added or replaced")
+        expected = set(file_name for (file_name, _) in package_files)
+        expected.update([descriptor_name, manifest_name])
+        for member in members:
+            if os.path.normpath(member.name) not in expected:
+                raise ValueError("{0} needs to be removed from the OVA"
+                                 .format(member.name))
+
+        descriptor = members[0]
+        with open(ovf_file, 'rb') as f:
+            descriptor_data = f.read()
+        if len(descriptor_data) > descriptor.size:
+            raise ValueError("descriptor has grown from {0} to {1} bytes"
+                             .format(descriptor.size, len(descriptor_data)))
+        descriptor_data += whitespace_padding(descriptor.size -
+                                              len(descriptor_data))
+
+        manifest = self._tar_index.getmember(manifest_name)
+        manifest_data = self._in_place_manifest(
+            FileInTAR(self.input_file, manifest_name,
+                      tar_index=self._tar_index),
+            descriptor_name, descriptor_data)
+        if len(manifest_data) != manifest.size:
+            raise ValueError("manifest has changed size from {0} to {1} bytes"
+                             .format(manifest.size, len(manifest_data)))
+
+        return [(descriptor.offset_data, descriptor_data),
+                (manifest.offset_data, manifest_data)]
+
+    def _in_place_manifest(self, manifest_ref, descriptor_name,
+                           descriptor_data):
+        """Construct an updated manifest reflecting a new descriptor.
+
+        Helper method for :meth:`_in_place_updates`. The checksums of all
+        other files are taken from the existing manifest, as those files
+        are not being changed.
+
+        Args:
+          manifest_ref (FileInTAR): Existing manifest.
+          descriptor_name (str): File name of the OVF descriptor.
+          descriptor_data (bytes): Updated contents of the OVF descriptor.
+
+        Returns:
+          bytes: Updated manifest contents.
+
+        Raises:
+          ValueError: if the existing manifest is not usable.
+        """
+        (entries, problems) = self._read_manifest(manifest_ref)
+        if problems:
+            raise ValueError("existing manifest has problems: {0}"
+                             .format(problems))
+        checksum_types = set(entry[0] for entry in entries.values())
+        if len(checksum_types) != 1:
+            raise ValueError("existing manifest uses {0} checksum types"
+                             .format(len(checksum_types)))
+        checksum_type = checksum_types.pop()
+        if self._checksum_type not in (None, checksum_type):
+            raise ValueError("manifest checksum type is changing from {0} "
+                             "to {1}".format(checksum_type,
+                                             self._checksum_type))
+        file_names = [file_name for (file_name, _) in self._package_files()]
+        if set(entries.keys()) != set(file_names + [descriptor_name]):
+            raise ValueError("existing manifest does not list the same files")
+
+        descriptor_checksum = digest_stream(io.BytesIO(descriptor_data),
+                                            [checksum_type])[checksum_type]
+        return self._manifest_data(
+            checksum_type,
+            [(descriptor_name, descriptor_checksum)] +
+            [(file_name, entries[file_name][1]) for file_name in file_names])
+
     def tar(self, ovf_descriptor, tar_file):
         """Create a .ova tar file based on the given OVF descriptor.
 
+        If the OVA is overwriting the input OVA, it is first written to a
+        temporary file alongside the input, reading each file directly from
+        the (still intact) input OVA, then renamed over the input OVA,
+        keeping its permissions and (where possible) its owner. If
+        ``tar_file`` is a symbolic link to the input OVA, the file that it
+        links to is replaced, and the link is kept. However, as the input
+        OVA is replaced rather than rewritten, any other hard links to it
+        still refer to the original, unmodified OVA.
+
         Args:
           ovf_descriptor (str): File path for an OVF descriptor
           tar_file (str): File path for the desired OVA archive.
         """
+        if tar_file == STREAM_PATH or not self._is_input_file(tar_file):
+            self._write_tar(ovf_descriptor, tar_file)
+            return
+
+        # Replace the input OVA itself, rather than any symlink to it
+        tar_file = os.path.realpath(tar_file)
+        (fd, temp_file) = tempfile.mkstemp(
+            prefix=".{0}.".format(os.path.basename(tar_file)),
+            suffix=".tmp", dir=os.path.dirname(os.path.abspath(tar_file)))
+        os.close(fd)
+        try:
+            self._write_tar(ovf_descriptor, temp_file)
+            shutil.copymode(tar_file, temp_file)
+            _copy_owner(tar_file, temp_file)
+            logger.verbose("Replacing %s with %s", tar_file, temp_file)
+            _replace(temp_file, tar_file)
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def _is_input_file(self, path):
+        """Check whether the given path refers to the input OVA file.
+
+        Args:
+          path (str): File path to check.
+
+        Returns:
+          bool: True if ``path`` is the input OVA file or a link to it.
+        """
+        if (self._tar_stream is not None or is_url(self.input_file) or
+                not os.path.exists(path)):
+            return False
+        return os.path.samefile(self.input_file, path)
+
+    def _write_tar(self, ovf_descriptor, tar_file):
+        """Write a .ova tar file based on the given OVF descriptor.
+
+        Helper method for :meth:`tar`.
+
+        Args:
+          ovf_descriptor (str): File path for an OVF descriptor
+          tar_file (str): File path to write the OVA archive to, or
+              :data:`~COT.file_reference.STREAM_PATH` for standard output.
+        """
         logger.verbose("Creating tar file %s", tar_file)
 
         (prefix, _) = os.path.splitext(ovf_descriptor)
 
-        if self.input_file == tar_file:
-            # We're about to overwrite the input OVA with a new OVA.
-            # (Python tarfile module doesn't support in-place edits.)
-            # Any files that we need to carry over need to be extracted NOW!
-            logger.verbose("Extracting files from %s before overwriting it.",
-                           self.input_file)
-            for filename in self._file_references:
-                file_ref = self._file_references[filename]
-                if file_ref.file_path is None:
-                    file_ref.copy_to(self.working_dir)
-                    self._file_references[filename] = FileOnDisk(
-                        self.working_dir, filename)
-
-        # Be sure to dereference any links to the actual file content!
-        with closing(tarfile.open(tar_file, 'w', dereference=True)) as tarf:
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        if tar_file == STREAM_PATH:
+            # Write sequentially, without seeking
+            tarf = tarfile.open(fileobj=stdout, mode='w|', dereference=True)
+        else:
+            # Be sure to dereference any links to the actual file content!
+            tarf = tarfile.open(tar_file, 'w', dereference=True)
+        with closing(tarf):
             # OVF is always first
             logger.verbose("Adding %s to %s", ovf_descriptor, tar_file)
             tarf.add(ovf_descriptor, os.path.basename(ovf_descriptor))
             # Add manifest if present
             manifest_path = prefix + '.mf'
-            if os.path.exists(manifest_path):
+            if not self.trailing_manifest and os.path.exists(manifest_path):
                 logger.verbose("Adding manifest to %s", tar_file)
                 tarf.add(manifest_path, os.path.basename(manifest_path))
             if os.path.exists("{0}.cert".format(prefix)):
@@ -2739,11 +3613,50 @@ class OVF(VMDescription, XML):
                                "so the existing certificate will be omitted "
                                "from %s.", tar_file)
             # Add all other files mentioned in the OVF
-            for file_obj in self.references.findall(self.FILE):
-                file_name = file_obj.get(self.FILE_HREF)
-                file_ref = self._file_references[file_name]
+            file_checksums = self._add_files_to_archive(tarf, tar_file)
+            if self.trailing_manifest:
+                # The OVF spec permits the manifest to come after all files
+                manifest_path = self._write_manifest(ovf_descriptor,
+                                                     file_checksums)
+                logger.verbose("Adding manifest to %s", tar_file)
+                tarf.add(manifest_path, os.path.basename(manifest_path))
+        if tar_file == STREAM_PATH:
+            stdout.flush()
+
+    def _add_files_to_archive(self, tarf, tar_file):
+        """Add all files referenced by this OVF to the given TAR archive.
+
+        Helper method for :meth:`tar`. If :attr:`trailing_manifest` is set,
+        the checksum of each file is computed as it is copied into the
+        archive, rather than requiring a separate read of each file.
+
+        Args:
+          tarf (tarfile.TarFile): Archive to add files to
+          tar_file (str): File path of the archive, for logging.
+
+        Returns:
+          list: ``(file_name, checksum)`` for each file added, or an empty
+          list if :attr:`trailing_manifest` is not set.
+        """
+        checksum_type = self.checksum_type
+        cache = default_digest_cache()
+        file_checksums = []
+        for (file_name, file_ref) in self._package_files():
+            if not self.trailing_manifest:
                 file_ref.add_to_archive(tarf)
-                logger.verbose("Added %s to %s", file_name, tar_file)
+            else:
+                key = file_ref.identity
+                checksum = cache.get(key, checksum_type)
+                if checksum is not None:
+                    file_ref.add_to_archive(tarf)
+                else:
+                    checksum = file_ref.add_to_archive(
+                        tarf, [checksum_type])[checksum_type]
+                    cache.put(key, checksum_type, checksum)
+                file_checksums.append((file_name, checksum))
+            logger.verbose("Added %s to %s", file_name, tar_file)
+        cache.save()
+        return file_checksums
 
     def _ensure_section(self, section_tag, info_string,
                         attrib=None, parent=None):
@@ -2765,13 +3678,14 @@ class OVF(VMDescription, XML):
             parent = self.envelope
         section = self.find_child(parent, section_tag, attrib=attrib)
         if section is not None:
+            self._index_section(section)
             return section
 
         logger.info("No existing %s. Creating it.", XML.strip_ns(section_tag))
         if attrib:
-            section = ET.Element(section_tag, attrib=attrib)
+            section = Element(section_tag, attrib=attrib)
         else:
-            section = ET.Element(section_tag)
+            section = Element(section_tag)
         # Section elements may be in arbitrary order relative to one another,
         # but they MUST come after the References and before the VirtualSystem.
         # We'll construct them immediately before the VirtualSystem.
@@ -2781,12 +3695,35 @@ class OVF(VMDescription, XML):
                 break
             i += 1
         parent.insert(i, section)
+        XML.mark_dirty(parent)
 
         # All Sections must have an Info child
         self.set_or_make_child(section, self.INFO, info_string)
+        self._index_section(section)
 
         return section
 
+    def _index_section(self, section):
+        """Index the children of the given section for fast lookups.
+
+        Files, Disks, and Properties are frequently looked up by their
+        identifiers, and a descriptor may have thousands of them.
+        See :meth:`XML.index_children`.
+
+        Args:
+          section (xml.etree.ElementTree.Element): Section element, or None
+        """
+        if section is None:
+            return
+        if section.tag == self.REFERENCES:
+            XML.index_children(section, self.FILE,
+                               (self.FILE_ID, self.FILE_HREF))
+        elif section.tag == self.DISK_SECTION:
+            XML.index_children(section, self.DISK,
+                               (self.DISK_ID, self.DISK_FILE_REF))
+        elif section.tag == self.PRODUCT_SECTION:
+            XML.index_children(section, self.PROPERTY, (self.PROP_KEY, ))
+
     def _set_product_section_child(self, child_tag, child_text):
         """Update or create the given child of the ProductSection.
 
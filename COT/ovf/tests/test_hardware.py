@@ -14,6 +14,7 @@
 
 """Unit test cases for COT.ovf.OVFHardware class."""
 
+from COT.data_validation import natural_sort
 from COT.tests.ut import COT_UT
 
 from COT.vm_context_manager import VMContextManager
@@ -36,3 +37,64 @@ class TestOVFHardware(COT_UT):
         with VMContextManager(self.input_ovf) as ovf:
             hw = ovf.hardware
             self.assertEqual(None, hw.find_item(resource_type='usb'))
+
+    def check_indexes(self, hw):
+        """Check that indexed lookups match a search of all items.
+
+        Args:
+          hw (OVFHardware): Hardware to check.
+        """
+        ovf = hw.ovf
+        queries = [(None, {})]
+        queries.extend((rtype, {}) for rtype in ovf.RES_MAP)
+        for item in hw.item_dict.values():
+            parent = item.get_value(ovf.PARENT)
+            address = item.get_value(ovf.ADDRESS_ON_PARENT)
+            queries.append((None, {ovf.PARENT: parent}))
+            queries.append((None, {ovf.PARENT: parent,
+                                   ovf.ADDRESS_ON_PARENT: address}))
+            queries.append((item.hardware_type,
+                            {ovf.INSTANCE_ID: item.instance_id}))
+        for (resource_type, properties) in queries:
+            expected = [hw.item_dict[instance]
+                        for instance in natural_sort(hw.item_dict)
+                        if hw.item_match(hw.item_dict[instance],
+                                         resource_type, properties, None)]
+            self.assertEqual(expected,
+                             hw.find_all_items(resource_type, properties))
+
+    def test_indexes(self):
+        """Indexed lookups stay correct as items are added and changed."""
+        with VMContextManager(self.input_ovf) as ovf:
+            hw = ovf.hardware
+            self.check_indexes(hw)
+            self.assertEqual(
+                [item.instance_id for item in hw.find_all_items(
+                    properties={ovf.PARENT: '4'})],
+                ['7', '8'])
+
+            hw.set_item_count_per_profile('ethernet', 8, None)
+            self.assertEqual(hw.get_item_count('ethernet', None), 8)
+            self.check_indexes(hw)
+
+            # Move a disk to another controller
+            disk = hw.find_item(properties={ovf.PARENT: '3',
+                                            ovf.ADDRESS_ON_PARENT: '0'})
+            disk.set_property(ovf.PARENT, '5')
+            self.assertEqual(disk, hw.find_item(
+                properties={ovf.PARENT: '5', ovf.ADDRESS_ON_PARENT: '0'}))
+            self.assertEqual(
+                hw.find_all_items(properties={ovf.PARENT: '3'}), [])
+            self.check_indexes(hw)
+
+            (_, clone) = hw.clone_item(disk, None)
+            clone.set_property(ovf.ADDRESS_ON_PARENT, '1')
+            self.check_indexes(hw)
+
+            hw.delete_item(disk)
+            self.assertIsNone(hw.find_item(
+                properties={ovf.PARENT: '5', ovf.ADDRESS_ON_PARENT: '0'}))
+            self.check_indexes(hw)
+
+            hw.item_dict['11'].remove_profile('1CPU-1GB-1NIC')
+            self.check_indexes(hw)
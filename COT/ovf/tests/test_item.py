@@ -267,3 +267,28 @@ OVFItem:
         ovf.write()
         ovf.destroy()
         self.check_diff("")
+
+    def test_clone(self):
+        """Cloning an item copies its properties but not its OVF."""
+        ovf = OVF(self.input_ovf, None)
+        # InstanceID 11, NIC 0 (default, under all profiles)
+        item = ovf.hardware.item_dict['11']
+        clone = item.clone()
+        self.assertIs(clone.ovf, ovf)
+        self.assertIs(clone.name_helper, item.name_helper)
+        self.assertEqual(clone.NS, item.NS)
+        self.assertEqual(clone.properties, item.properties)
+        self.assertEqual(str(clone), str(item))
+
+        # Changes to the clone don't affect the original
+        clone.set_property(ovf.INSTANCE_ID, '20')
+        clone.set_property(ovf.ELEMENT_NAME, 'clone', ['2CPU-2GB-1NIC'])
+        clone.remove_profile('4CPU-4GB-3NIC')
+        self.assertTrue(clone.modified)
+        self.assertFalse(item.modified)
+        self.assertEqual(item.get_value(ovf.INSTANCE_ID), '11')
+        self.assertNotEqual(item.get_value(ovf.ELEMENT_NAME,
+                                           ['2CPU-2GB-1NIC']), 'clone')
+        self.assertTrue(item.has_profile('4CPU-4GB-3NIC'))
+        self.assertFalse(clone.has_profile('4CPU-4GB-3NIC'))
+        ovf.destroy()
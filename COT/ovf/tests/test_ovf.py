@@ -17,6 +17,7 @@
 """Unit test cases for COT.ovf.OVF class."""
 
 import filecmp
+import io
 import logging
 import os
 import os.path
@@ -33,7 +34,8 @@ from COT.tests.ut import COT_UT
 from COT.ovf import OVF
 from COT.ovf.ovf import byte_count, byte_string, factor_bytes
 from COT.vm_description import VMInitError
-from COT.data_validation import ValueUnsupportedError
+from COT.data_validation import ValueUnsupportedError, file_checksum
+from COT.file_reference import FileInTAR
 from COT.helpers import helpers, HelperError
 from COT.vm_context_manager import VMContextManager
 
@@ -454,6 +456,378 @@ ovf:size="{cfg_size}" />
             tarf.close()
         self.assertRaises(VMInitError, OVF, fake_file, None)
 
+    def test_ova_descriptor_not_extracted(self):
+        """The OVF descriptor is parsed directly from the OVA."""
+        ova_file = os.path.join(self.temp_dir, "minimal.ova")
+        with closing(tarfile.open(ova_file, 'w')) as tarf:
+            tarf.add(self.minimal_ovf, os.path.basename(self.minimal_ovf))
+        with mock.patch('tempfile.mkdtemp') as mock_mkdtemp:
+            with VMContextManager(ova_file, None) as vm:
+                self.assertEqual(vm.ovf_descriptor, "minimal.ovf")
+                self.assertEqual(vm.ovf_version, 1.0)
+            # No working directory is needed to read an OVA
+            mock_mkdtemp.assert_not_called()
+
+        # Relative paths escaping the extraction directory are still unsafe
+        with closing(tarfile.open(ova_file, 'w')) as tarf:
+            tarf.add(self.minimal_ovf, "../minimal.ovf")
+        self.assertRaises(VMInitError, OVF, ova_file, None)
+
+    def test_checksum_type(self):
+        """Manifest checksum type defaults by version or is set explicitly."""
+        output = os.path.join(self.temp_dir, "minimal.ovf")
+        with VMContextManager(self.minimal_ovf, output) as vm:
+            self.assertEqual(vm.checksum_type, 'sha1')
+            with self.assertRaises(ValueUnsupportedError):
+                vm.checksum_type = 'md5'
+        with open(os.path.join(self.temp_dir, "minimal.mf")) as f:
+            self.assertTrue(f.read().startswith("SHA1(minimal.ovf)= "))
+
+        with VMContextManager(self.minimal_ovf, output) as vm:
+            vm.checksum_type = 'sha512'
+        with open(os.path.join(self.temp_dir, "minimal.mf")) as f:
+            self.assertTrue(f.read().startswith("SHA512(minimal.ovf)= "))
+
+        with VMContextManager(self.v20_vbox_ovf, None) as vm:
+            self.assertEqual(vm.checksum_type, 'sha256')
+
+    def test_trailing_manifest(self):
+        """Manifest can be computed while writing and placed last in an OVA."""
+        ova_file = os.path.join(self.temp_dir, "minimal.ova")
+        with VMContextManager(self.minimal_ovf, ova_file) as vm:
+            vm.add_file(self.input_iso, "file1")
+            vm.add_file(self.sample_cfg, "file2")
+            vm.trailing_manifest = True
+        with closing(tarfile.open(ova_file, 'r')) as tarf:
+            self.assertEqual(tarf.getnames(),
+                             ["minimal.ovf", "input.iso", "sample_cfg.txt",
+                              "minimal.mf"])
+            tarf.extractall(self.temp_dir)
+        with open(os.path.join(self.temp_dir, "minimal.mf")) as f:
+            manifest = f.read()
+        self.assertEqual(manifest, "".join(
+            "SHA1({0})= {1}\n".format(
+                name, file_checksum(os.path.join(self.temp_dir, name), 'sha1'))
+            for name in ["minimal.ovf", "input.iso", "sample_cfg.txt"]))
+
+    def test_descriptor_in_place(self):
+        """Descriptor-only changes are written in place into padding."""
+        ova_file = os.path.join(self.temp_dir, "minimal.ova")
+        with VMContextManager(self.minimal_ovf, ova_file) as vm:
+            vm.descriptor_padding = 2048
+        with closing(tarfile.open(ova_file, 'r')) as tarf:
+            self.assertEqual(tarf.getnames(), ["minimal.ovf", "minimal.mf"])
+            self.assertTrue(tarf.getmember("minimal.ovf").size > 2048)
+        orig_stat = os.stat(ova_file)
+
+        with mock.patch.object(OVF, 'tar') as mock_tar:
+            with VMContextManager(ova_file, ova_file) as vm:
+                vm.version_short = "1.2.3"
+            mock_tar.assert_not_called()
+        self.assertEqual(os.stat(ova_file).st_size, orig_stat.st_size)
+        self.assertEqual(os.stat(ova_file).st_ino, orig_stat.st_ino)
+
+        with VMContextManager(ova_file, None) as vm:
+            self.assertEqual(vm.version_short, "1.2.3")
+            self.assertEqual(vm.verify_manifest(), {})
+
+    def test_descriptor_not_in_place(self):
+        """Changes that don't fit in the existing OVA are written in full."""
+        ova_file = os.path.join(self.temp_dir, "minimal.ova")
+        with VMContextManager(self.minimal_ovf, ova_file) as vm:
+            pass
+        with mock.patch.object(OVF, 'tar', autospec=True,
+                               side_effect=OVF.tar) as mock_tar:
+            with VMContextManager(ova_file, ova_file) as vm:
+                vm.version_short = "1.2.3"
+            self.assertEqual(mock_tar.call_count, 1)
+        with VMContextManager(ova_file, None) as vm:
+            self.assertEqual(vm.version_short, "1.2.3")
+            self.assertEqual(vm.verify_manifest(), {})
+
+    def test_overwrite_input_ova(self):
+        """Overwrite the input OVA without extracting its contents first."""
+        input_dir = os.path.dirname(self.input_ovf)
+        ova_file = os.path.join(self.temp_dir, "input.ova")
+        with closing(tarfile.open(ova_file, 'w')) as tarf:
+            for name in ['input.ovf', 'input.mf', 'input.vmdk', 'input.iso',
+                         'sample_cfg.txt']:
+                tarf.add(os.path.join(input_dir, name), name)
+        os.chmod(ova_file, 0o640)
+
+        with mock.patch.object(FileInTAR, 'copy_to') as mock_copy_to:
+            with VMContextManager(ova_file, ova_file) as vm:
+                vm.version_short = "1.2.3"
+                vm.version_long = "A much longer version string than before"
+            mock_copy_to.assert_not_called()
+        self.assertEqual(os.listdir(self.temp_dir), ["input.ova"])
+        self.assertEqual(os.stat(ova_file).st_mode & 0o777, 0o640)
+
+        with VMContextManager(ova_file, None) as vm:
+            self.assertEqual(vm.version_short, "1.2.3")
+            self.assertEqual(vm.verify_manifest(), {})
+        with closing(tarfile.open(ova_file, 'r')) as tarf:
+            self.assertEqual(tarf.getnames(),
+                             ['input.ovf', 'input.mf', 'input.vmdk',
+                              'input.iso', 'sample_cfg.txt'])
+
+    def test_overwrite_input_ova_symlink(self):
+        """Overwriting the input OVA via a symlink keeps the symlink."""
+        ova_file = os.path.join(self.temp_dir, "minimal.ova")
+        with closing(tarfile.open(ova_file, 'w')) as tarf:
+            tarf.add(self.minimal_ovf, "minimal.ovf")
+        link = os.path.join(self.temp_dir, "link.ova")
+        os.symlink(ova_file, link)
+        owner = (os.stat(ova_file).st_uid, os.stat(ova_file).st_gid)
+
+        with VMContextManager(link, link) as vm:
+            vm.version_short = "1.2.3"
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(sorted(os.listdir(self.temp_dir)),
+                         ["link.ova", "minimal.ova"])
+        self.assertEqual((os.stat(ova_file).st_uid,
+                          os.stat(ova_file).st_gid), owner)
+        with VMContextManager(ova_file, None) as vm:
+            self.assertEqual(vm.version_short, "1.2.3")
+
+    def test_overwrite_input_ova_failure(self):
+        """Failure to write the new OVA leaves the input OVA intact."""
+        ova_file = os.path.join(self.temp_dir, "minimal.ova")
+        with closing(tarfile.open(ova_file, 'w')) as tarf:
+            tarf.add(self.minimal_ovf, "minimal.ovf")
+        with open(ova_file, 'rb') as f:
+            orig_data = f.read()
+        vm = OVF(ova_file, ova_file)
+        vm.version_short = "1.2.3"
+        with mock.patch.object(OVF, '_add_files_to_archive',
+                               side_effect=IOError("No space left")):
+            self.assertRaises(IOError, vm.write)
+        vm.destroy()
+        self.assertEqual(os.listdir(self.temp_dir), ["minimal.ova"])
+        with open(ova_file, 'rb') as f:
+            self.assertEqual(f.read(), orig_data)
+
+    def test_link_mode(self):
+        """Files can be hardlinked, rather than copied, into an OVF."""
+        output = os.path.join(self.temp_dir, "output.ovf")
+        with VMContextManager(self.input_ovf, output) as vm:
+            vm.link_mode = 'hardlink'
+        self.assertTrue(os.path.samefile(
+            self.input_vmdk, os.path.join(self.temp_dir, "input.vmdk")))
+
+        output = os.path.join(self.temp_dir, "copy", "output.ovf")
+        os.makedirs(os.path.dirname(output))
+        with VMContextManager(self.input_ovf, output) as vm:
+            vm.link_mode = 'copy'
+        self.assertFalse(os.path.samefile(
+            self.input_vmdk, os.path.join(self.temp_dir, "copy",
+                                          "input.vmdk")))
+
+    def test_chunked_files(self):
+        """Files can be written in chunks and read back transparently."""
+        chunked = os.path.join(self.temp_dir, "chunked", "input.ovf")
+        chunk_dir = os.path.dirname(chunked)
+        os.makedirs(chunk_dir)
+        with VMContextManager(self.input_ovf, chunked) as vm:
+            vm.chunk_size = 100000
+        self.assertEqual(sorted(os.listdir(chunk_dir)), [
+            "input.iso.000000000", "input.iso.000000001",
+            "input.iso.000000002", "input.iso.000000003", "input.mf",
+            "input.ovf", "input.vmdk.000000000", "input.vmdk.000000001",
+            "sample_cfg.txt",
+        ])
+        with VMContextManager(chunked, None) as vm:
+            chunk_sizes = dict((file_elem.get(vm.FILE_HREF),
+                                file_elem.get(vm.FILE_CHUNK_SIZE))
+                               for file_elem in vm.references.findall(vm.FILE))
+            self.assertEqual(chunk_sizes, {'input.vmdk': "100000",
+                                           'input.iso': "100000",
+                                           'sample_cfg.txt': None})
+            self.assertEqual(vm.verify_manifest(), {})
+            self.assertEqual(vm._file_references['input.iso'].size,
+                             self.FILE_SIZE['input.iso'])
+
+        # Files can be re-chunked in place
+        with VMContextManager(chunked, chunked) as vm:
+            vm.chunk_size = 150000
+        self.assertEqual(os.path.getsize(
+            os.path.join(chunk_dir, "input.iso.000000002")), 60448)
+        with VMContextManager(chunked, None) as vm:
+            self.assertEqual(vm.verify_manifest(), {})
+
+        # By default, chunking is preserved
+        output = os.path.join(self.temp_dir, "chunked.ova")
+        with VMContextManager(chunked, output) as vm:
+            pass
+        with closing(tarfile.open(output, 'r')) as tarf:
+            self.assertTrue("input.iso.000000002" in tarf.getnames())
+            self.assertFalse("input.iso.000000003" in tarf.getnames())
+
+        # Chunks are joined back together if chunking is disabled
+        output = os.path.join(self.temp_dir, "unchunked.ova")
+        with VMContextManager(chunked, output) as vm:
+            vm.chunk_size = 0
+        with closing(tarfile.open(output, 'r')) as tarf:
+            self.assertEqual(tarf.getnames(), [
+                "unchunked.ovf", "unchunked.mf", "input.vmdk", "input.iso",
+                "sample_cfg.txt",
+            ])
+            with open(self.input_iso, 'rb') as f:
+                self.assertEqual(tarf.extractfile("input.iso").read(),
+                                 f.read())
+        with VMContextManager(output, None) as vm:
+            self.assertEqual(vm.verify_manifest(), {})
+
+    def test_compressed_files(self):
+        """Files can be written compressed and read back transparently."""
+        output = os.path.join(self.temp_dir, "compressed.ova")
+        with VMContextManager(self.input_ovf, output) as vm:
+            vm.file_compression = 'gzip'
+        with VMContextManager(output, None) as vm:
+            compression = dict((file_elem.get(vm.FILE_HREF),
+                                file_elem.get(vm.FILE_COMPRESSION))
+                               for file_elem in vm.references.findall(vm.FILE))
+            # VMDKs are already compressed, and compressing the tiny text
+            # file wouldn't make it any smaller
+            self.assertEqual(compression, {'input.vmdk': None,
+                                           'input.iso': 'gzip',
+                                           'sample_cfg.txt': None})
+            self.assertEqual(vm.verify_manifest(), {})
+            iso_ref = vm._file_references['input.iso']
+            self.assertLess(iso_ref.size, self.FILE_SIZE['input.iso'])
+            with open(self.input_iso, 'rb') as f:
+                self.assertEqual(iso_ref.open_decompressed().read(),
+                                 f.read())
+            iso_ref.close()
+
+        # Files are decompressed on request
+        decompressed = os.path.join(self.temp_dir, "decompressed.ovf")
+        with VMContextManager(output, decompressed) as vm:
+            vm.file_compression = 'none'
+        self.check_diff("", file1=self.input_ovf, file2=decompressed)
+        with open(self.input_iso, 'rb') as f1:
+            with open(os.path.join(self.temp_dir, "input.iso"), 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def stream_ova(self, names):
+        """Create a mock standard input stream containing an OVA.
+
+        Args:
+          names (list): Files to place in the OVA, in order.
+        Returns:
+          mock.Mock: Mock of :data:`sys.stdin`.
+        """
+        input_dir = os.path.dirname(self.input_ovf)
+        data = io.BytesIO()
+        with closing(tarfile.open(fileobj=data, mode='w|')) as tarf:
+            for name in names:
+                tarf.add(os.path.join(input_dir, name), name)
+        data.seek(0)
+        return mock.Mock(buffer=data)
+
+    def test_stream(self):
+        """Read an OVA from stdin and write it to stdout."""
+        stdin = self.stream_ova(['input.ovf', 'input.mf', 'input.vmdk',
+                                 'input.iso', 'sample_cfg.txt'])
+        stdout = mock.Mock(buffer=io.BytesIO())
+        with mock.patch('sys.stdin', stdin), mock.patch('sys.stdout', stdout):
+            with VMContextManager('-', '-') as vm:
+                self.assertEqual(vm.ovf_descriptor, 'input.ovf')
+                vm.version_short = "5.0"
+                with self.assertRaises(NotImplementedError):
+                    vm.verify_manifest()
+                working_dir = vm.working_dir
+            # Nothing was spilled to disk, as files were read in order
+            self.assertFalse(os.path.exists(os.path.join(working_dir,
+                                                         "stream")))
+
+        output = os.path.join(self.temp_dir, "output.ova")
+        with open(output, 'wb') as f:
+            f.write(stdout.buffer.getvalue())
+        with closing(tarfile.open(output, 'r')) as tarf:
+            # Manifest is generated on the fly, after the other files
+            self.assertEqual(tarf.getnames(), [
+                "input.ovf", "input.vmdk", "input.iso", "sample_cfg.txt",
+                "input.mf",
+            ])
+            with open(self.input_iso, 'rb') as f:
+                self.assertEqual(tarf.extractfile("input.iso").read(),
+                                 f.read())
+        with VMContextManager(output, None) as vm:
+            self.assertEqual(vm.version_short, "5.0")
+            self.assertEqual(vm.verify_manifest(), {})
+
+    def test_stream_out_of_order(self):
+        """Files in the input stream can be read out of order."""
+        stdin = self.stream_ova(['input.ovf', 'sample_cfg.txt', 'input.iso',
+                                 'input.vmdk'])
+        output = os.path.join(self.temp_dir, "output.ovf")
+        with mock.patch('sys.stdin', stdin):
+            with VMContextManager('-', output):
+                pass
+        for name in ['input.vmdk', 'input.iso', 'sample_cfg.txt']:
+            self.assertTrue(filecmp.cmp(
+                os.path.join(os.path.dirname(self.input_ovf), name),
+                os.path.join(self.temp_dir, name), shallow=False))
+        with VMContextManager(output, None) as vm:
+            self.assertEqual(vm.verify_manifest(), {})
+
+    def test_stream_invalid(self):
+        """The OVF descriptor must be the first file in an input stream."""
+        stdin = self.stream_ova(['input.mf', 'input.ovf'])
+        with mock.patch('sys.stdin', stdin):
+            with self.assertRaises(VMInitError):
+                OVF('-', None)
+
+    def test_verify_manifest(self):
+        """Verify package contents against the manifest."""
+        with VMContextManager(self.input_ovf, None) as vm:
+            self.assertEqual(vm.verify_manifest(), {})
+        with VMContextManager(self.minimal_ovf, None) as vm:
+            self.assertEqual(vm.verify_manifest(), None)
+
+        input_dir = os.path.dirname(self.input_ovf)
+        ova_file = os.path.join(self.temp_dir, "input.ova")
+        with closing(tarfile.open(ova_file, 'w')) as tarf:
+            for name in ['input.ovf', 'input.mf', 'input.vmdk', 'input.iso',
+                         'sample_cfg.txt']:
+                tarf.add(os.path.join(input_dir, name), name)
+        with VMContextManager(ova_file, None) as vm:
+            self.assertEqual(vm.verify_manifest(), {})
+
+    def test_verify_manifest_problems(self):
+        """Report files that do not match the manifest."""
+        input_dir = os.path.dirname(self.input_ovf)
+        for name in ['input.ovf', 'input.vmdk', 'input.iso']:
+            shutil.copy(os.path.join(input_dir, name), self.temp_dir)
+        with open(os.path.join(self.temp_dir, 'sample_cfg.txt'), 'w') as f:
+            f.write("hello world!\n")
+        with open(os.path.join(input_dir, 'input.mf')) as f:
+            lines = f.readlines()
+        with open(os.path.join(self.temp_dir, 'input.mf'), 'w') as f:
+            # Drop the input.iso entry, add a bogus entry and a bad line
+            f.writelines(line for line in lines if 'input.iso' not in line)
+            f.write("MD5(foo.txt)= d41d8cd98f00b204e9800998ecf8427e\n")
+            f.write("CRC32(bar.txt)= 12345678\n")
+            f.write("this is not valid\n")
+        with VMContextManager(os.path.join(self.temp_dir, 'input.ovf'),
+                              None) as vm:
+            problems = vm.verify_manifest()
+        self.assertEqual(sorted(problems.keys()),
+                         ['bar.txt', 'foo.txt', 'input.iso', 'input.mf',
+                          'sample_cfg.txt'])
+        self.assertEqual(problems['input.iso'], "not listed in the manifest")
+        self.assertEqual(problems['foo.txt'],
+                         "listed in the manifest but not present in the "
+                         "package")
+        self.assertEqual(problems['bar.txt'],
+                         "unsupported checksum type 'CRC32'")
+        self.assertEqual(problems['input.mf'],
+                         "line 6 is not a valid manifest entry: "
+                         "'this is not valid'")
+        self.assertTrue(problems['sample_cfg.txt'].startswith(
+            "SHA1 checksum is f951b101989b2c3b7471710b4e78fc4dbdfa0ca6"))
+
     def test_invalid_ovf_contents(self):
         """Check for rejection of OVF files with valid XML but invalid data."""
         # Multiple Items under same profile with same InstanceID
@@ -484,6 +858,41 @@ ovf:size="{cfg_size}" />
         # TODO - inconsistent order of File versus Disk?
         # TODO - Sections in wrong order?
 
+    def test_lazy(self):
+        """Hardware and file references are only loaded when needed."""
+        with VMContextManager(self.csr_ovf, None) as vm:
+            properties = vm.environment_properties
+        with VMContextManager(self.csr_ovf, None, lazy=True) as vm:
+            self.assertEqual(vm.product_class, "com.cisco.csr1000v")
+            self.assertEqual(vm.environment_properties, properties)
+            self.assertIsNone(vm._hardware)
+            self.assertIsNone(vm._file_refs)
+
+        with VMContextManager(self.input_ovf, None, lazy=True) as vm:
+            self.assertEqual(vm.get_serial_count(['1CPU-1GB-1NIC']),
+                             {'1CPU-1GB-1NIC': 2})
+            self.assertIsNotNone(vm._hardware)
+            self.assertIsNone(vm._file_refs)
+            self.assertEqual(vm.verify_manifest(), {})
+            self.assertEqual(sorted(vm._file_references),
+                             ['input.iso', 'input.vmdk', 'sample_cfg.txt'])
+
+        # Lazily written output is the same as eagerly written output
+        with VMContextManager(self.input_ovf, self.temp_file, lazy=True):
+            pass
+        self.check_diff("")
+
+        # Invalid hardware is only reported when the hardware is used
+        fake_file = os.path.join(self.temp_dir, "foo.ovf")
+        with open(fake_file, "w") as f:
+            subprocess.check_call(['sed', 's/InstanceID>11</InstanceID>10</',
+                                   self.input_ovf],
+                                  stdout=f)
+        with VMContextManager(fake_file, None, lazy=True) as vm:
+            self.assertEqual(vm.version_short, "DEV")
+            with self.assertRaises(VMInitError):
+                vm.get_serial_count(['1CPU-1GB-1NIC'])
+
     def test_configuration_profiles(self):
         """Check profile id list APIs."""
         # No profiles defined
@@ -135,6 +135,7 @@ Remove a file from the given OVF. Will prompt for confirmation unless
         group.add_argument('-o', '--output',
                            help="""Name/path of new OVF/OVA package to """
                            """create instead of updating the existing OVF""")
+        self.add_package_arguments(p)
 
         group = p.add_argument_group("file selection options")
 
@@ -24,17 +24,56 @@
   COTGenericSubmodule
   COTReadOnlySubmodule
   COTSubmodule
+
+**Functions**
+
+.. autosummary::
+  :nosignatures:
+
+  check_manifest
 """
 
 import os.path
 import logging
 
-from .data_validation import InvalidInputError
+from .compression import COMPRESSION_TYPES
+from .data_validation import InvalidInputError, ValueMismatchError
+from .file_copy import LINK_MODES
+from .file_reference import STREAM_PATH
+from .http_file import is_url
 from .vm_factory import VMFactory
 
 logger = logging.getLogger(__name__)
 
 
+def check_manifest(vm):
+    """Verify the input package of the given VM against its manifest.
+
+    Args:
+      vm (VMDescription): VM whose input package should be verified.
+
+    Returns:
+      bool: ``True`` if verified, ``False`` if there is no manifest to
+      verify against.
+
+    Raises:
+      ValueMismatchError: if any file in the package fails verification.
+    """
+    problems = vm.verify_manifest()
+    if problems is None:
+        logger.warning("Package %s has no manifest to verify against",
+                       vm.input_file)
+        return False
+    if problems:
+        details = ["  {0}: {1}".format(file_name, problems[file_name])
+                   for file_name in sorted(problems)]
+        raise ValueMismatchError(
+            "Package {0} does not match its manifest:\n{1}"
+            .format(vm.input_file, "\n".join(details)))
+    logger.info("Package %s matches its manifest", vm.input_file)
+    return True
+
+
 class COTGenericSubmodule(object):
     """Abstract interface for COT command submodules.
 
@@ -123,6 +162,10 @@ class COTReadOnlySubmodule(COTGenericSubmodule):
         Calls :meth:`COT.vm_factory.VMFactory.create` to instantiate
         :attr:`self.vm` from the provided file.
 
+        May be an ``http://`` or ``https://`` URL of an OVA, which is
+        read in place from the server (see :mod:`COT.http_file`), or
+        ``'-'`` to read an OVA from standard input.
+
         Raises:
           InvalidInputError: if the file does not exist.
         """
@@ -130,7 +173,8 @@ class COTReadOnlySubmodule(COTGenericSubmodule):
 
     @package.setter
     def package(self, value):
-        if value is not None and not os.path.exists(value):
+        if (value is not None and value != STREAM_PATH and
+                not is_url(value) and not os.path.exists(value)):
             raise InvalidInputError("Specified package {0} does not exist!"
                                     .format(value))
         if self.vm is not None:
@@ -160,7 +204,14 @@ class COTSubmodule(COTGenericSubmodule):
 
     Attributes:
     :attr:`package`,
-    :attr:`output`
+    :attr:`output`,
+    :attr:`checksum_type`,
+    :attr:`trailing_manifest`,
+    :attr:`descriptor_padding`,
+    :attr:`link_mode`,
+    :attr:`chunk_size`,
+    :attr:`file_compression`,
+    :attr:`verify_manifest`
     """
 
     def __init__(self, ui):
@@ -173,6 +224,10 @@ class COTSubmodule(COTGenericSubmodule):
         self._package = None
         # Default to an unspecified output rather than no output
         self._output = ""
+        # Options to apply to self.vm, once it exists, when writing output
+        self._output_options = {}
+        self.verify_manifest = False
+        """Verify the input package against its manifest before editing."""
 
     @property
     def package(self):
@@ -181,6 +236,10 @@ class COTSubmodule(COTGenericSubmodule):
         Calls :meth:`COT.vm_factory.VMFactory.create` to instantiate
         :attr:`self.vm` from the provided file.
 
+        May be an ``http://`` or ``https://`` URL of an OVA, which is
+        read in place from the server (see :mod:`COT.http_file`), or
+        ``'-'`` to read an OVA from standard input.
+
         Raises:
           InvalidInputError: if the file does not exist.
         """
@@ -188,7 +247,8 @@ class COTSubmodule(COTGenericSubmodule):
 
     @package.setter
     def package(self, value):
-        if value is not None and not os.path.exists(value):
+        if (value is not None and value != STREAM_PATH and
+                not is_url(value) and not os.path.exists(value)):
             raise InvalidInputError("Specified package {0} does not exist!"
                                     .format(value))
         if self.vm is not None:
@@ -196,11 +256,13 @@ class COTSubmodule(COTGenericSubmodule):
             self.vm = None
         if value is not None:
             self.vm = VMFactory.create(value, self.output)
+            for (name, option) in self._output_options.items():
+                setattr(self.vm, name, option)
         self._package = value
 
     @property
     def output(self):
-        """Output file for this submodule.
+        """Output file for this submodule, or ``'-'`` for standard output.
 
         If the specified file already exists,  will prompt the user
         (:meth:`~COT.ui_shared.UI.confirm_or_die`) to
@@ -217,6 +279,155 @@ class COTSubmodule(COTGenericSubmodule):
         if self.vm is not None:
             self.vm.output_file = value
 
+    @property
+    def checksum_type(self):
+        """Checksum algorithm to use in the manifest of the output package.
+
+        If not set, the default for the output package type is used.
+        """
+        return self._output_options.get('checksum_type')
+
+    @checksum_type.setter
+    def checksum_type(self, value):
+        self._set_output_option('checksum_type', value)
+
+    @property
+    def trailing_manifest(self):
+        """Place the manifest at the end of an output OVA, not the start.
+
+        This allows the manifest to be computed while writing the OVA,
+        rather than requiring an additional read of every file beforehand.
+        """
+        return self._output_options.get('trailing_manifest', False)
+
+    @trailing_manifest.setter
+    def trailing_manifest(self, value):
+        self._set_output_option('trailing_manifest', bool(value))
+
+    @property
+    def descriptor_padding(self):
+        """Bytes of space to reserve after the descriptor in an output OVA.
+
+        Later changes to the descriptor that fit within this space can be
+        written into the OVA in place, rather than rewriting the whole OVA.
+        """
+        return self._output_options.get('descriptor_padding', 0)
+
+    @descriptor_padding.setter
+    def descriptor_padding(self, value):
+        if value is not None and int(value) < 0:
+            raise InvalidInputError("descriptor padding cannot be negative")
+        self._set_output_option('descriptor_padding', value)
+
+    @property
+    def link_mode(self):
+        """How to place unchanged files into an output OVF directory.
+
+        One of :data:`COT.file_copy.LINK_MODES`; default is ``'auto'``.
+        """
+        return self._output_options.get('link_mode', 'auto')
+
+    @link_mode.setter
+    def link_mode(self, value):
+        if value is not None and value not in LINK_MODES:
+            raise InvalidInputError("Link mode must be one of {0}"
+                                    .format(", ".join(LINK_MODES)))
+        self._set_output_option('link_mode', value)
+
+    @property
+    def chunk_size(self):
+        """Maximum size of each file in the output package, in bytes.
+
+        Larger files are split into chunks as described in the OVF standard.
+        ``0`` disables chunking; if unset, the input chunk size is kept.
+        """
+        return self._output_options.get('chunk_size', None)
+
+    @chunk_size.setter
+    def chunk_size(self, value):
+        if value is not None and int(value) < 0:
+            raise InvalidInputError("chunk size cannot be negative")
+        self._set_output_option('chunk_size', value)
+
+    @property
+    def file_compression(self):
+        """Compression to apply to non-VMDK files in the output package.
+
+        ``'gzip'`` or ``'none'``; if unset, the input compression is kept.
+        """
+        return self._output_options.get('file_compression', None)
+
+    @file_compression.setter
+    def file_compression(self, value):
+        if value is not None and value not in COMPRESSION_TYPES + ('none',):
+            raise InvalidInputError("Compression must be one of {0}"
+                                    .format(", ".join(COMPRESSION_TYPES +
+                                                      ('none',))))
+        self._set_output_option('file_compression', value)
+
+    def _set_output_option(self, name, value):
+        """Record an output option and apply it to :attr:`vm` if present.
+
+        Args:
+          name (str): Attribute name on the VM description, such as
+              ``'checksum_type'``.
+          value (object): Value to set, or ``None`` to use the default.
+        """
+        if value is None:
+            self._output_options.pop(name, None)
+        else:
+            self._output_options[name] = value
+        if self.vm is not None:
+            setattr(self.vm, name, value)
+
+    def add_package_arguments(self, parser):  # pylint: disable=no-self-use
+        """Add CLI options common to all submodules that edit a package.
+
+        Args:
+          parser (argparse.ArgumentParser): Subparser for this submodule.
+        """
+        group = parser.add_argument_group("input package options")
+        group.add_argument('--verify-manifest', action='store_true',
+                           default=None,
+                           help="Verify the contents of the input package "
+                           "against its manifest (if any) before proceeding")
+
+        group = parser.add_argument_group("output package options")
+        group.add_argument('--checksum-type',
+                           choices=['sha1', 'sha256', 'sha512'],
+                           help="Checksum algorithm to use in the manifest "
+                           "of the output package (default: sha256 for "
+                           "OVF 2.x, sha1 for earlier versions)")
+        group.add_argument('--trailing-manifest', action='store_true',
+                           default=None,
+                           help="When writing an OVA, place the manifest "
+                           "after all other files, so that it can be "
+                           "computed while the OVA is written")
+        group.add_argument('--descriptor-padding', type=int,
+                           metavar="BYTES",
+                           help="When writing an OVA, reserve this many bytes "
+                           "of space after the OVF descriptor, so that later "
+                           "edits to the descriptor can be made in place "
+                           "without rewriting the entire OVA")
+        group.add_argument('--link-mode', choices=LINK_MODES,
+                           help="When writing an OVF, how to place files "
+                           "from the input package into the output "
+                           "directory. 'auto' (default) creates a reflink "
+                           "clone where possible, or falls back to copying "
+                           "the file. 'hardlink' shares the file with the "
+                           "input package, so later edits to either in "
+                           "place affect both")
+        group.add_argument('--chunk-size', type=int, metavar="BYTES",
+                           help="Split files larger than this into chunks of "
+                           "this size in the output package, for transfer "
+                           "through size-limited systems (0 to not split "
+                           "files; default: keep any chunking of the input)")
+        group.add_argument('--compression', dest='file_compression',
+                           choices=COMPRESSION_TYPES + ('none',),
+                           help="Compress files other than VMDKs in the "
+                           "output package, or decompress all files "
+                           "(default: keep any compression of the input)")
+
     def ready_to_run(self):
         """Check whether the module is ready to :meth:`run`.
 
@@ -225,6 +436,8 @@ class COTSubmodule(COTGenericSubmodule):
         """
         if self.package is None:
             return False, "PACKAGE is a mandatory argument!"
+        if is_url(self.package) and not self.output:
+            return False, "OUTPUT is required when PACKAGE is a URL!"
         return super(COTSubmodule, self).ready_to_run()
 
     def run(self):
@@ -235,9 +448,14 @@ class COTSubmodule(COTGenericSubmodule):
 
         Raises:
           InvalidInputError: if :meth:`ready_to_run` reports ``False``
+          ValueMismatchError: if :attr:`verify_manifest` is set and the
+              input package does not match its manifest.
         """
         super(COTSubmodule, self).run()
 
+        if self.verify_manifest:
+            check_manifest(self.vm)
+
         if not self.output:
             self.output = self.package
         # Do the work now...
@@ -354,6 +354,7 @@ class TestCLIGeneral(TestCOTCLI):
                     Install/verify COT manual pages and any third-party helper
                     programs that COT may require
     remove-file     Remove a file from an OVF package
+    verify          Verify the contents of an OVF package
 """
         else:
             # Spacing in args_str is a bit different due to subcommand aliases
@@ -387,6 +388,8 @@ class TestCLIGeneral(TestCOTCLI):
                         helper programs that COT may require
     remove-file (delete-file)
                         Remove a file from an OVF package
+    verify (check-manifest)
+                        Verify the contents of an OVF package
 """
 
         self.assertMultiLineEqual(
@@ -872,6 +875,7 @@ class TestCLIHelp(TestCOTCLI):
         self.call_cot(['help', 'info'])
         self.call_cot(['help', 'inject-config'])
         self.call_cot(['help', 'remove-file'])
+        self.call_cot(['help', 'verify'])
 
     def test_help_negative(self):
         """Negative tests for cot help."""
@@ -1005,3 +1009,16 @@ class TestCLIRemoveFile(TestCOTCLI):
         self.call_cot(['remove-file', self.input_ovf, '-o', self.temp_file,
                        '--file-path', 'input.vmdk', '--file-id', 'frobozz'],
                       result=2)
+
+
+class TestCLIVerify(TestCOTCLI):
+    """CLI test cases for "cot verify" command."""
+
+    def test_help(self):
+        """Verify help menu for cot verify."""
+        self.call_cot(['verify', "-h"])
+
+    def test_invalid_args(self):
+        """Invalid arguments."""
+        self.call_cot(['verify'], result=2)
+        self.call_cot(['verify', '/foo'], result=2)
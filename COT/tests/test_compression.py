@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+#
+# test_compression.py - Unit test cases for COT file compression
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Unit test cases for COT.compression module."""
+
+import gzip
+import io
+import os
+from multiprocessing.pool import ThreadPool
+
+import mock
+
+from COT.tests.ut import COT_UT
+from COT.compression import gzip_compress, open_decompressed
+
+
+class TestGzipCompress(COT_UT):
+    """Test cases for gzip_compress() function."""
+
+    def compress(self, data, **kwargs):
+        """Compress the given data and check that gzip can decompress it.
+
+        Args:
+          data (bytes): Data to compress.
+          **kwargs: Passed through to :func:`gzip_compress`.
+
+        Returns:
+          bytes: Compressed data.
+        """
+        dst = io.BytesIO()
+        self.assertEqual(gzip_compress(io.BytesIO(data), dst, **kwargs),
+                         len(data))
+        compressed = dst.getvalue()
+        with gzip.GzipFile(fileobj=io.BytesIO(compressed)) as gzf:
+            self.assertEqual(gzf.read(), data)
+        return compressed
+
+    def test_empty(self):
+        """Compress an empty file."""
+        self.compress(b'')
+
+    def test_single_block(self):
+        """Compress less than a single block of data."""
+        compressed = self.compress(b'hello world\n' * 1000)
+        self.assertLess(len(compressed), 1000)
+
+    def test_multiple_blocks(self):
+        """Compress many blocks of data in parallel."""
+        data = (os.urandom(1000) * 50 + b'\0' * 50000) * 4
+        compressed = self.compress(data, workers=4, block_size=4096)
+        self.assertLess(len(compressed), len(data) // 10)
+        # Compressing sequentially produces the same stream
+        self.assertEqual(self.compress(data, workers=1, block_size=4096),
+                         compressed)
+
+    def test_single_pool(self):
+        """A single pool of threads is used for the whole stream."""
+        data = os.urandom(1024) * 100
+        with mock.patch('multiprocessing.pool.ThreadPool',
+                        side_effect=ThreadPool) as pool_class:
+            self.compress(data, workers=2, block_size=1024)
+        self.assertEqual(pool_class.call_count, 1)
+
+    def test_exact_blocks(self):
+        """Compress data that is an exact multiple of the block size."""
+        self.compress(os.urandom(8192), workers=2, block_size=1024)
+
+
+class TestOpenDecompressed(COT_UT):
+    """Test cases for open_decompressed() function."""
+
+    def test_uncompressed(self):
+        """An uncompressed file is returned unchanged."""
+        file_obj = io.BytesIO(b'hello')
+        self.assertIs(open_decompressed(file_obj, None), file_obj)
+
+    def test_gzip(self):
+        """A gzip-compressed file is decompressed on the fly."""
+        dst = io.BytesIO()
+        gzip_compress(io.BytesIO(b'hello world'), dst)
+        dst.seek(0)
+        self.assertEqual(open_decompressed(dst, 'gzip').read(),
+                         b'hello world')
+
+    def test_unsupported(self):
+        """An unsupported compression type is rejected."""
+        with self.assertRaises(NotImplementedError):
+            open_decompressed(io.BytesIO(b''), 'bzip2')
@@ -57,12 +57,26 @@ class TestFileChecksum(COT_UT):
         self.assertEqual(checksum,
                          "5d0635163f6a580442f01466245e122f8412e8d6")
 
+    def test_file_checksum_sha256(self):
+        """Test case for file_checksum() with sha256 sum."""
+        checksum = file_checksum(self.input_ovf, 'sha256')
+        self.assertEqual(checksum, "c8d484af4509e7b18ea78a5f7c25c010"
+                         "d03ee6f0ace821b924fa205e2a886b78")
+
+        checksum = file_checksum(self.minimal_ovf, 'sha256')
+        self.assertEqual(checksum, "e50e4d0da8dc1caf137a2be9145f1906"
+                         "3cfafb5d8e0135aa23a04cf96ef214a4")
+
+    def test_file_checksum_sha512(self):
+        """Test case for file_checksum() with sha512 sum."""
+        checksum = file_checksum(self.minimal_ovf, 'sha512')
+        self.assertEqual(checksum, "93d7f1f7d5fbbe9f9e33486269071d44"
+                         "5276d5bdb1dc137b33eff21e666dc9e9"
+                         "201ae030f137d6f53fafa01bf91592f4"
+                         "322c656f798130c9d8af3d3da90345af")
+
     def test_file_checksum_unsupported(self):
         """Test invalid options to file_checksum()."""
-        self.assertRaises(NotImplementedError,
-                          file_checksum,
-                          self.input_ovf,
-                          'sha256')
         self.assertRaises(NotImplementedError,
                           file_checksum,
                           self.input_ovf,
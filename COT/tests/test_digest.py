@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+#
+# test_digest.py - Unit test cases for COT file digest caching
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Unit test cases for COT.digest module."""
+
+import hashlib
+import io
+import os
+import shutil
+
+import mock
+
+from COT.tests.ut import COT_UT
+import COT.digest
+from COT.data_validation import file_checksum
+from COT.digest import (
+    DigestCache, HashingReader, path_identity, default_digest_cache,
+    digest_files, digest_stream,
+)
+from COT.file_reference import FileOnDisk
+
+
+class TestPathIdentity(COT_UT):
+    """Test cases for path_identity() function."""
+
+    def test_identity(self):
+        """Identity reflects path, size, and modification time."""
+        ident = path_identity(self.input_ovf)
+        self.assertEqual(ident[0], 'file')
+        self.assertEqual(ident[1], os.path.realpath(self.input_ovf))
+        self.assertEqual(ident[2], os.path.getsize(self.input_ovf))
+        self.assertEqual(ident, path_identity(self.input_ovf))
+        self.assertEqual(ident, FileOnDisk(self.input_ovf).identity)
+        self.assertNotEqual(ident, path_identity(self.minimal_ovf))
+
+    def test_racy(self):
+        """Recently modified files have no reliable identity."""
+        temp_file = os.path.join(self.temp_dir, "foo.ovf")
+        shutil.copy(self.input_ovf, temp_file)
+        self.assertEqual(path_identity(temp_file), None)
+        os.utime(temp_file, (0, 0))
+        self.assertNotEqual(path_identity(temp_file), None)
+
+
+class TestDigestCache(COT_UT):
+    """Test cases for DigestCache class."""
+
+    def test_get_put(self):
+        """Basic cache lookup and storage."""
+        cache = DigestCache()
+        key = path_identity(self.input_ovf)
+        self.assertEqual(cache.get(key, 'sha1'), None)
+        cache.put(key, 'sha1', 'abcd')
+        self.assertEqual(cache.get(key, 'sha1'), 'abcd')
+        self.assertEqual(cache.get(key, 'md5'), None)
+        self.assertEqual(len(cache), 1)
+        # A key of None is never cached
+        cache.put(None, 'sha1', 'abcd')
+        self.assertEqual(cache.get(None, 'sha1'), None)
+        self.assertEqual(len(cache), 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    @mock.patch('time.time')
+    def test_lru_eviction(self, mock_time):
+        """Least recently used entries are evicted first."""
+        cache = DigestCache(max_entries=2)
+        mock_time.return_value = 1
+        cache.put(('a',), 'sha1', '1')
+        mock_time.return_value = 2
+        cache.put(('b',), 'sha1', '2')
+        mock_time.return_value = 3
+        self.assertEqual(cache.get(('a',), 'sha1'), '1')
+        mock_time.return_value = 4
+        cache.put(('c',), 'sha1', '3')
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get(('a',), 'sha1'), '1')
+        self.assertEqual(cache.get(('b',), 'sha1'), None)
+        self.assertEqual(cache.get(('c',), 'sha1'), '3')
+
+    def test_persistence(self):
+        """Cache contents are saved to disk and merged across instances."""
+        cache_path = os.path.join(self.temp_dir, "cache", "digests.json")
+        cache1 = DigestCache(cache_path)
+        cache1.put(('a',), 'sha1', '1')
+        cache2 = DigestCache(cache_path)
+        cache2.put(('b',), 'md5', '2')
+        cache1.save()
+        cache2.save()
+        cache3 = DigestCache(cache_path)
+        self.assertEqual(cache3.get(('a',), 'sha1'), '1')
+        self.assertEqual(cache3.get(('b',), 'md5'), '2')
+
+    def test_unreadable_cache(self):
+        """A corrupt cache file is ignored with a warning."""
+        cache_path = os.path.join(self.temp_dir, "digests.json")
+        with open(cache_path, 'w') as f:
+            f.write("{not json")
+        cache = DigestCache(cache_path)
+        self.assertLogged(levelname="WARNING",
+                          msg="Ignoring unreadable digest cache")
+        self.assertEqual(len(cache), 0)
+        cache.put(('a',), 'sha1', '1')
+        cache.save()
+        self.assertEqual(DigestCache(cache_path).get(('a',), 'sha1'), '1')
+
+    def test_default_cache(self):
+        """The default cache is only persisted if requested."""
+        self.assertEqual(default_digest_cache().path, None)
+        cache_path = os.path.join(self.temp_dir, "digests.json")
+        with mock.patch('COT.digest._default_cache', None):
+            with mock.patch.dict(os.environ):
+                del os.environ['COT_DIGEST_CACHE']
+                self.assertEqual(default_digest_cache().path, None)
+        with mock.patch('COT.digest._default_cache', None):
+            with mock.patch.dict(os.environ, {'COT_DIGEST_CACHE': cache_path}):
+                self.assertEqual(default_digest_cache().path, cache_path)
+
+    def test_file_checksum(self):
+        """file_checksum() consults and updates the cache."""
+        cache = DigestCache()
+        checksum = file_checksum(self.input_ovf, 'sha1', cache=cache)
+        self.assertEqual(
+            cache.get(path_identity(self.input_ovf), 'sha1'), checksum)
+        cache.put(path_identity(self.input_ovf), 'sha1', 'cached')
+        self.assertEqual(file_checksum(self.input_ovf, 'sha1', cache=cache),
+                         'cached')
+        self.assertEqual(file_checksum(self.input_ovf, 'sha1'), checksum)
+
+
+class TestDigestFiles(COT_UT):
+    """Test cases for digest_files() function."""
+
+    def setUp(self):
+        """Test case setup function called automatically prior to each test."""
+        super(TestDigestFiles, self).setUp()
+        paths = [self.input_ovf, self.minimal_ovf,
+                 self.input_iso, self.input_vmdk]
+        self.file_refs = [FileOnDisk(path) for path in paths]
+        self.expected = [{'sha1': file_checksum(path, 'sha1')}
+                         for path in paths]
+
+    def test_sequential(self):
+        """Hash files one at a time."""
+        self.assertEqual(digest_files(self.file_refs, ['sha1'], workers=1),
+                         self.expected)
+
+    def test_parallel(self):
+        """Hash files in parallel, with results in the original order."""
+        self.assertEqual(digest_files(self.file_refs, ['sha1'], workers=4,
+                                      block_size=1000),
+                         self.expected)
+        self.assertEqual(digest_files([], ['sha1']), [])
+
+    def test_cached(self):
+        """Files whose digests are cached are not re-read."""
+        cache = DigestCache()
+        self.assertEqual(digest_files(self.file_refs, ['sha1'], cache=cache),
+                         self.expected)
+        self.assertEqual(len(cache), 4)
+        with mock.patch.object(FileOnDisk, 'open') as mock_open:
+            self.assertEqual(
+                digest_files(self.file_refs, ['sha1'], cache=cache),
+                self.expected)
+            mock_open.assert_not_called()
+
+    def test_multiple_algorithms(self):
+        """Several digests are computed from a single read of each file."""
+        cache = DigestCache()
+        results = digest_files(self.file_refs, ['sha1', 'sha256'],
+                               cache=cache)
+        self.assertEqual([result['sha1'] for result in results],
+                         [expected['sha1'] for expected in self.expected])
+        self.assertEqual(results[0]['sha256'],
+                         file_checksum(self.input_ovf, 'sha256'))
+        # Only the missing digest is computed for files already cached
+        with mock.patch('COT.digest.digest_stream',
+                        return_value={'md5': 'fake'}) as mock_digest:
+            results = digest_files(self.file_refs[:1],
+                                   ['sha1', 'sha256', 'md5'], cache=cache)
+            self.assertEqual(mock_digest.call_count, 1)
+            self.assertEqual(mock_digest.call_args[0][1], ['md5'])
+        self.assertEqual(results[0]['md5'], 'fake')
+        self.assertEqual(results[0]['sha1'], self.expected[0]['sha1'])
+
+
+class TestHashingReader(COT_UT):
+    """Test cases for HashingReader class."""
+
+    def test_read(self):
+        """Data read through the wrapper is hashed."""
+        with open(self.input_ovf, 'rb') as f:
+            data = f.read()
+        reader = HashingReader(io.BytesIO(data), ['sha1', 'md5'])
+        self.assertEqual(reader.read(100), data[:100])
+        self.assertEqual(reader.read(), data[100:])
+        self.assertEqual(reader.read(100), b'')
+        self.assertEqual(reader.hexdigests(), {
+            'sha1': file_checksum(self.input_ovf, 'sha1'),
+            'md5': file_checksum(self.input_ovf, 'md5'),
+        })
+
+
+class TestDigestStream(COT_UT):
+    """Test cases for digest_stream() function."""
+
+    def test_sparse(self):
+        """Holes in a sparse file are hashed as zeros without reading them."""
+        path = os.path.join(self.temp_dir, "sparse.img")
+        with open(path, 'wb') as f:
+            f.seek(1024 * 1024)
+            f.write(b'hello world' * 100)
+            f.truncate(3 * 1024 * 1024 + 5)
+        with open(path, 'rb') as f:
+            data = f.read()
+        expected = {
+            'sha1': hashlib.sha1(data).hexdigest(),
+            'md5': hashlib.md5(data).hexdigest(),
+        }
+
+        with mock.patch('COT.digest._digest_sparse',
+                        wraps=COT.digest._digest_sparse) as mock_sparse:
+            with open(path, 'rb') as f:
+                self.assertEqual(digest_stream(f, ['sha1', 'md5'],
+                                               block_size=100000),
+                                 expected)
+            # Filesystems without hole support just report all data
+            with open(path, 'rb') as f:
+                extents = COT.digest.data_extents(f.fileno())
+            self.assertEqual(mock_sparse.called,
+                             any(not is_data for (_, _, is_data) in extents))
+
+        # Non-file streams are simply read
+        self.assertEqual(digest_stream(io.BytesIO(data), ['sha1', 'md5']),
+                         expected)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+#
+# test_file_copy.py - Unit test cases for COT efficient file copying
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Unit test cases for COT.file_copy module."""
+
+import errno
+import os
+import shutil
+import tarfile
+from contextlib import closing
+
+import mock
+
+from COT.tests.ut import COT_UT
+import COT.file_copy
+from COT.file_copy import (
+    available_strategies, copy_file, copy_into_tarfile, copy_range,
+    data_extents, link_or_copy_file,
+)
+
+MEGABYTE = 1024 * 1024
+
+
+def create_sparse_file(path):
+    """Create a 4 MB file with a little data and a lot of holes.
+
+    Returns:
+      bytes: Contents of the file.
+    """
+    with open(path, 'wb') as f:
+        f.seek(MEGABYTE)
+        f.write(b'x' * 1000)
+        f.seek(2 * MEGABYTE)
+        f.write(b'y' * 1000)
+        f.truncate(4 * MEGABYTE)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def holes_supported(path):
+    """Check whether the filesystem reports the holes in a sparse file."""
+    with open(path, 'rb') as f:
+        return any(not is_data for (_, _, is_data) in data_extents(f.fileno()))
+
+
+class TestCopyRange(COT_UT):
+    """Test cases for copy_range() function."""
+
+    def setUp(self):
+        """Test case setup function called automatically prior to each test."""
+        super(TestCopyRange, self).setUp()
+        with open(self.input_iso, 'rb') as f:
+            self.data = f.read()
+        self.dest = os.path.join(self.temp_dir, "output.bin")
+
+    def copy(self, count, src_offset, dst_offset, strategies):
+        """Helper to copy from input_iso to self.dest and check the result."""
+        with open(self.input_iso, 'rb') as src:
+            with open(self.dest, 'wb') as dst:
+                dst.write(b'x' * dst_offset)
+                dst.flush()
+                strategy = copy_range(src.fileno(), dst.fileno(), count,
+                                      src_offset, dst_offset,
+                                      strategies=strategies)
+        with open(self.dest, 'rb') as f:
+            self.assertEqual(f.read(), b'x' * dst_offset +
+                             self.data[src_offset:src_offset + count])
+        return strategy
+
+    def test_each_strategy(self):
+        """Each available strategy copies the requested range correctly."""
+        self.assertEqual(available_strategies()[-1], 'buffered')
+        for strategy in available_strategies():
+            if strategy == 'reflink':
+                continue
+            self.assertEqual(self.copy(5000, 1234, 512, [strategy]),
+                             strategy)
+            self.assertEqual(self.copy(len(self.data), 0, 0, [strategy]),
+                             strategy)
+
+    def test_chunked(self):
+        """Large copies are made in several chunks."""
+        with mock.patch('COT.file_copy.COPY_CHUNK_SIZE', 1000):
+            self.assertEqual(self.copy(len(self.data) - 10, 10, 0,
+                                       ['buffered']),
+                             'buffered')
+
+    def test_fallback(self):
+        """Fall back to the next strategy if the first is unsupported."""
+        def unsupported(*_):
+            """Pretend this strategy isn't supported."""
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+        with mock.patch.dict(COT.file_copy._CHUNK_COPIERS,
+                             {'sendfile': unsupported}):
+            self.assertEqual(self.copy(5000, 0, 0, ['sendfile', 'buffered']),
+                             'buffered')
+
+    def test_errors(self):
+        """Genuine errors and truncated input are reported."""
+        def failure(*_):
+            """Simulate an I/O error."""
+            raise OSError(errno.EIO, "Input/output error")
+        with mock.patch.dict(COT.file_copy._CHUNK_COPIERS,
+                             {'sendfile': failure}):
+            with self.assertRaises(OSError):
+                self.copy(5000, 0, 0, ['sendfile', 'buffered'])
+        with self.assertRaises(EOFError):
+            self.copy(len(self.data), 10, 0, ['buffered'])
+
+
+class TestDataExtents(COT_UT):
+    """Test cases for data_extents() function."""
+
+    def test_sparse(self):
+        """Holes and data regions in a sparse file are reported."""
+        path = os.path.join(self.temp_dir, "sparse.img")
+        data = create_sparse_file(path)
+        with open(path, 'rb') as f:
+            extents = data_extents(f.fileno())
+            self.assertEqual(data_extents(f.fileno(), 100, 0), [])
+            self.assertEqual(data_extents(f.fileno(), 100, 50)[0][0], 100)
+        # Extents are contiguous and cover the whole file
+        position = 0
+        for (offset, length, is_data) in extents:
+            self.assertEqual(offset, position)
+            self.assertTrue(length > 0)
+            if not is_data:
+                self.assertEqual(data[offset:offset + length],
+                                 b'\0' * length)
+            position += length
+        self.assertEqual(position, len(data))
+        if holes_supported(path):
+            self.assertEqual(extents[0], (0, MEGABYTE, False))
+            self.assertEqual(extents[-1][2], False)
+
+    def test_unsupported(self):
+        """Platforms and filesystems without hole support report all data."""
+        real_lseek = os.lseek
+
+        def lseek_failure(err):
+            """Make SEEK_DATA and SEEK_HOLE fail with the given errno."""
+            def lseek(fd, pos, how):
+                """Fake implementation of os.lseek()."""
+                if how in (os.SEEK_SET, os.SEEK_CUR, os.SEEK_END):
+                    return real_lseek(fd, pos, how)
+                raise OSError(err, os.strerror(err))
+            return lseek
+
+        with open(self.input_iso, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            with mock.patch('os.lseek', side_effect=lseek_failure(
+                    errno.EINVAL)):
+                self.assertEqual(data_extents(f.fileno(), 10),
+                                 [(10, size - 10, True)])
+            with mock.patch('os.lseek', side_effect=lseek_failure(
+                    errno.EIO)):
+                self.assertRaises(OSError, data_extents, f.fileno())
+            self.assertEqual(f.tell(), 0)
+
+
+class TestCopyFile(COT_UT):
+    """Test cases for copy_file() function."""
+
+    def test_copy_file(self):
+        """Copy a file to a directory or path."""
+        strategy = copy_file(self.input_ovf, self.temp_dir)
+        self.assertTrue(strategy in available_strategies())
+        self.check_diff("", file2=os.path.join(self.temp_dir, "input.ovf"))
+
+        dest = os.path.join(self.temp_dir, "foo.ovf")
+        self.assertEqual(copy_file(self.input_ovf, dest, ['buffered']),
+                         'buffered')
+        self.check_diff("", file2=dest)
+
+    def test_copy_sparse_file(self):
+        """Holes in a sparse file are preserved in the copy."""
+        src = os.path.join(self.temp_dir, "sparse.img")
+        data = create_sparse_file(src)
+        for strategy in available_strategies():
+            if strategy == 'reflink':
+                continue
+            dst = os.path.join(self.temp_dir, strategy + ".img")
+            self.assertEqual(copy_file(src, dst, [strategy]), strategy)
+            with open(dst, 'rb') as f:
+                self.assertEqual(f.read(), data)
+            if holes_supported(src):
+                self.assertTrue(os.stat(dst).st_blocks * 512 < MEGABYTE)
+
+        # Truncated sources are detected
+        with open(src, 'rb') as f:
+            with open(dst, 'wb') as g:
+                self.assertRaises(EOFError, copy_range, f.fileno(),
+                                  g.fileno(), 4 * MEGABYTE, src_offset=1,
+                                  sparse=True)
+
+
+class TestLinkOrCopyFile(COT_UT):
+    """Test cases for link_or_copy_file() function."""
+
+    def setUp(self):
+        """Test case setup function called automatically prior to each test."""
+        super(TestLinkOrCopyFile, self).setUp()
+        self.src = os.path.join(self.temp_dir, "input.iso")
+        shutil.copy(self.input_iso, self.src)
+        self.dst_dir = os.path.join(self.temp_dir, "output")
+        os.makedirs(self.dst_dir)
+        self.dst = os.path.join(self.dst_dir, "input.iso")
+
+    def check_same_contents(self):
+        """Verify that self.dst has the same contents as self.src."""
+        with open(self.src, 'rb') as f1:
+            with open(self.dst, 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_copy(self):
+        """Copy mode always makes an independent copy."""
+        self.assertTrue(link_or_copy_file(self.src, self.dst_dir, 'copy')
+                        in available_strategies())
+        self.check_same_contents()
+        self.assertFalse(os.path.samefile(self.src, self.dst))
+
+    def test_hardlink(self):
+        """Hardlink mode links the file, replacing any existing file."""
+        with open(self.dst, 'w') as f:
+            f.write("old contents")
+        self.assertEqual(link_or_copy_file(self.src, self.dst, 'hardlink'),
+                         'hardlink')
+        self.assertTrue(os.path.samefile(self.src, self.dst))
+        self.assertEqual(os.listdir(self.dst_dir), ["input.iso"])
+        # Linking again is a no-op
+        self.assertEqual(link_or_copy_file(self.src, self.dst, 'hardlink'),
+                         'hardlink')
+        # Copying breaks the link without touching the source file
+        link_or_copy_file(self.src, self.dst, 'copy')
+        self.assertFalse(os.path.samefile(self.src, self.dst))
+        self.check_same_contents()
+
+    def test_replace_hardlink(self):
+        """Replacing a hard-linked destination leaves the source intact."""
+        with open(self.src, 'rb') as f:
+            src_data = f.read()
+        other = os.path.join(self.temp_dir, "other", "input.iso")
+        os.makedirs(os.path.dirname(other))
+        with open(other, 'wb') as f:
+            f.write(b"other contents")
+        for mode in ['auto', 'copy']:
+            self.assertEqual(link_or_copy_file(self.src, self.dst,
+                                               'hardlink'),
+                             'hardlink')
+            link_or_copy_file(other, self.dst, mode)
+            with open(self.dst, 'rb') as f:
+                self.assertEqual(f.read(), b"other contents")
+            with open(self.src, 'rb') as f:
+                self.assertEqual(f.read(), src_data)
+            self.assertEqual(os.listdir(self.dst_dir), ["input.iso"])
+        # Likewise when the link can only be replaced by a copy
+        link_or_copy_file(self.src, self.dst, 'hardlink')
+        with mock.patch('COT.file_copy._try_link_file', return_value=None):
+            link_or_copy_file(other, self.dst, 'reflink')
+        self.assertLogged(levelname="WARNING",
+                          msg="Unable to %s %s to %s; copying it instead",
+                          args=('reflink', other, self.dst))
+        with open(self.src, 'rb') as f:
+            self.assertEqual(f.read(), src_data)
+
+    def test_auto(self):
+        """Auto mode makes a reflink clone or a copy, never a hard link."""
+        self.assertTrue(link_or_copy_file(self.src, self.dst)
+                        in available_strategies())
+        self.check_same_contents()
+        self.assertFalse(os.path.samefile(self.src, self.dst))
+        # An existing hard link is broken
+        link_or_copy_file(self.src, self.dst, 'hardlink')
+        self.assertTrue(link_or_copy_file(self.src, self.dst)
+                        in available_strategies())
+        self.check_same_contents()
+        self.assertFalse(os.path.samefile(self.src, self.dst))
+        # Falling back to copying is expected, so isn't warned about
+        with mock.patch('COT.file_copy._reflink', return_value=False):
+            self.assertNotEqual(link_or_copy_file(self.src, self.dst),
+                                'reflink')
+        self.check_same_contents()
+
+    def test_fallback(self):
+        """Fall back to copying if linking is not possible."""
+        with mock.patch('COT.file_copy._try_link_file', return_value=None):
+            self.assertTrue(link_or_copy_file(self.src, self.dst, 'reflink')
+                            in available_strategies())
+            self.assertLogged(levelname="WARNING",
+                              msg="Unable to %s %s to %s; copying it instead",
+                              args=('reflink', self.src, self.dst))
+        self.check_same_contents()
+
+    def test_errors(self):
+        """Invalid inputs."""
+        self.assertRaises(ValueError,
+                          link_or_copy_file, self.src, self.dst, 'symlink')
+        self.assertRaises(shutil.Error, copy_file, self.src, self.src)
+
+
+class TestCopyIntoTarfile(COT_UT):
+    """Test cases for copy_into_tarfile() function."""
+
+    def add_files(self, mode):
+        """Add files to a TAR archive and check the contents."""
+        tar_path = os.path.join(self.temp_dir, "test.tar")
+        with closing(tarfile.open(tar_path, mode)) as tarf:
+            for path in [self.input_ovf, self.input_iso]:
+                tarinfo = tarf.gettarinfo(path, os.path.basename(path))
+                with open(path, 'rb') as src:
+                    copy_into_tarfile(tarf, tarinfo, src.fileno())
+        with closing(tarfile.open(tar_path, 'r')) as tarf:
+            self.assertEqual(tarf.getnames(), ["input.ovf", "input.iso"])
+            tarf.extractall(self.temp_dir)
+        self.check_diff("", file2=os.path.join(self.temp_dir, "input.ovf"))
+        with open(self.input_iso, 'rb') as f1:
+            with open(os.path.join(self.temp_dir, "input.iso"), 'rb') as f2:
+                self.assertEqual(f1.read(), f2.read())
+
+    def test_uncompressed(self):
+        """Data is copied directly into an uncompressed archive."""
+        self.add_files('w')
+
+    def test_compressed(self):
+        """Compressed archives fall back to TarFile.addfile()."""
+        self.add_files('w:gz')
+
+    def test_sparse(self):
+        """Holes in the source file remain holes in the archive file."""
+        src = os.path.join(self.temp_dir, "sparse.img")
+        data = create_sparse_file(src)
+        tar_path = os.path.join(self.temp_dir, "test.tar")
+        with closing(tarfile.open(tar_path, 'w')) as tarf:
+            tarinfo = tarf.gettarinfo(src, "sparse.img")
+            with open(src, 'rb') as f:
+                copy_into_tarfile(tarf, tarinfo, f.fileno())
+        with closing(tarfile.open(tar_path, 'r')) as tarf:
+            self.assertEqual(tarf.extractfile("sparse.img").read(), data)
+        if holes_supported(src):
+            self.assertTrue(os.stat(tar_path).st_blocks * 512 < MEGABYTE)
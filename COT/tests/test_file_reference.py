@@ -16,14 +16,23 @@
 
 """Unit test cases for COT.file_reference classes."""
 
+import io
 import os
 import tarfile
+import time
 
 from contextlib import closing
 from pkg_resources import resource_filename
 
+import mock
+
 from COT.tests.ut import COT_UT
-from COT.file_reference import FileOnDisk, FileInTAR
+from COT.compression import gzip_compress
+from COT.data_validation import file_checksum
+from COT.file_reference import (
+    FileOnDisk, FileInTAR, FileInStream, FileSpan, TarIndex,
+    TarMemberReader, TarStream, chunk_file_name,
+)
 
 
 class TestFileOnDisk(COT_UT):
@@ -66,11 +75,43 @@ class TestFileOnDisk(COT_UT):
         """Test the add_to_archive() API."""
         output_tarfile = os.path.join(self.temp_dir, 'test_output.tar')
         with closing(tarfile.open(output_tarfile, 'w')) as tarf:
-            FileOnDisk(self.input_ovf).add_to_archive(tarf)
+            self.assertEqual(FileOnDisk(self.input_ovf).add_to_archive(tarf),
+                             {})
         with closing(tarfile.open(output_tarfile, 'r')) as tarf:
             tarf.extract('input.ovf', self.temp_dir)
         self.check_diff("", file2=os.path.join(self.temp_dir, 'input.ovf'))
 
+    def test_add_to_archive_checksum(self):
+        """Checksums can be computed while adding to an archive."""
+        output_tarfile = os.path.join(self.temp_dir, 'test_output.tar')
+        with closing(tarfile.open(output_tarfile, 'w')) as tarf:
+            digests = FileOnDisk(self.input_ovf).add_to_archive(
+                tarf, ['sha1', 'sha256'])
+        self.assertEqual(digests, {
+            'sha1': file_checksum(self.input_ovf, 'sha1'),
+            'sha256': file_checksum(self.input_ovf, 'sha256'),
+        })
+
+    def test_open_decompressed(self):
+        """The contents of a compressed file can be read decompressed."""
+        ref = FileOnDisk(self.input_ovf)
+        with open(self.input_ovf, 'rb') as file_obj:
+            expected = file_obj.read()
+        try:
+            self.assertEqual(ref.open_decompressed().read(), expected)
+        finally:
+            ref.close()
+
+        gz_path = os.path.join(self.temp_dir, 'input.ovf.gz')
+        with open(self.input_ovf, 'rb') as src, open(gz_path, 'wb') as dst:
+            gzip_compress(src, dst)
+        ref = FileOnDisk(gz_path)
+        ref.compression = 'gzip'
+        try:
+            self.assertEqual(ref.open_decompressed().read(), expected)
+        finally:
+            ref.close()
+
     def test_equality(self):
         """Test the __eq__ and __ne__ operators."""
         a = FileOnDisk(self.input_ovf)
@@ -144,7 +185,9 @@ class TestFileInTAR(COT_UT):
         """Test the add_to_archive() API."""
         output_tarfile = os.path.join(self.temp_dir, 'test_output.tar')
         with closing(tarfile.open(output_tarfile, 'w')) as tarf:
-            self.valid_ref.add_to_archive(tarf)
+            digests = self.valid_ref.add_to_archive(tarf, ['md5'])
+        self.assertEqual(digests, {'md5': file_checksum(
+            resource_filename(__name__, 'sample_cfg.txt'), 'md5')})
         with closing(tarfile.open(output_tarfile, 'r')) as tarf:
             tarf.extract('sample_cfg.txt', self.temp_dir)
         self.check_diff("",
@@ -157,3 +200,331 @@ class TestFileInTAR(COT_UT):
         self.assertEqual(self.valid_ref, same_ref)
         another_ref = FileInTAR(self.tarfile, "input.mf")
         self.assertNotEqual(self.valid_ref, another_ref)
+
+    def test_identity(self):
+        """Test the identity property."""
+        member = self.valid_ref.member
+        self.assertEqual(self.valid_ref.identity[0], 'tar')
+        self.assertEqual(self.valid_ref.identity[-2:],
+                         (member.offset_data, member.size))
+        self.assertNotEqual(self.valid_ref.identity,
+                            FileInTAR(self.tarfile, "input.mf").identity)
+
+    def test_shared_index(self):
+        """Test sharing a single TarIndex between several references."""
+        index = TarIndex(self.tarfile)
+        ref1 = FileInTAR(self.tarfile, "sample_cfg.txt", tar_index=index)
+        ref2 = FileInTAR(self.tarfile, "./input.mf", tar_index=index)
+        self.assertIs(ref1.tar_index, ref2.tar_index)
+        self.assertEqual(ref1.size,
+                         os.path.getsize(resource_filename(__name__,
+                                                           'sample_cfg.txt')))
+        self.assertTrue(ref2.exists)
+        self.assertRaises(IOError, FileInTAR, self.tarfile, "foo.bar",
+                          tar_index=index)
+
+
+class TestTarStream(COT_UT):
+    """Test cases for TarStream and FileInStream classes."""
+
+    def setUp(self):
+        """Test case setup function called automatically prior to each test."""
+        super(TestTarStream, self).setUp()
+        with open(resource_filename(__name__, "test.tar"), 'rb') as f:
+            data = f.read()
+        self.stream = TarStream(io.BytesIO(data))
+        with closing(tarfile.open(resource_filename(__name__, "test.tar"),
+                                  'r')) as tarf:
+            self.names = tarf.getnames()
+            self.contents = dict((name, tarf.extractfile(name).read())
+                                 for name in self.names)
+
+    def test_not_tarfile(self):
+        """Test error handling when the stream is not a TAR archive."""
+        with open(self.input_ovf, 'rb') as f:
+            self.assertRaises(IOError, TarStream, f)
+
+    def test_in_order(self):
+        """Members can be read in order without being saved to disk."""
+        self.assertEqual(self.stream.peek().name, self.names[0])
+        for name in self.names:
+            ref = FileInStream(self.stream, name)
+            self.assertTrue(ref.exists)
+            self.assertEqual(ref.size, len(self.contents[name]))
+            self.assertEqual(ref.open('rb').read(), self.contents[name])
+            ref.close()
+            self.assertFalse(ref.exists)
+            self.assertRaises(IOError, ref.open, 'rb')
+        self.assertEqual(self.stream.peek(), None)
+        self.assertRaises(IOError, self.stream.getmember, "foo.bar")
+
+    def test_out_of_order(self):
+        """Wanted members that are passed over are spilled to disk."""
+        first = self.names[0]
+        last = self.names[-1]
+        # Without a spill directory, members can't be read out of order
+        self.stream.wanted.add(first)
+        self.assertRaises(IOError, self.stream.getmember, last)
+        self.stream.spill_dir = self.temp_dir
+        self.assertEqual(self.stream.getmember(last).name, last)
+        self.assertTrue(os.path.exists(os.path.join(self.temp_dir, 'stream',
+                                                    first)))
+        for name in (last, first):
+            ref = FileInStream(self.stream, name)
+            self.assertEqual(ref.open('rb').read(), self.contents[name])
+            ref.close()
+
+    def test_spilled_file_missing(self):
+        """Failing to reopen a spilled member is reported as such."""
+        first = self.names[0]
+        last = self.names[-1]
+        self.stream.wanted.add(first)
+        self.stream.spill_dir = self.temp_dir
+        self.stream.getmember(last)
+        os.remove(os.path.join(self.temp_dir, 'stream', first))
+        self.assertRaises(IOError, self.stream.open, first)
+        # The stream is still usable afterward
+        with closing(self.stream.open(last)) as f:
+            self.assertEqual(f.read(), self.contents[last])
+
+    def test_unwanted(self):
+        """Unwanted members that are passed over are skipped."""
+        self.stream.getmember(self.names[-1])
+        ref = FileInStream(self.stream, self.names[0])
+        self.assertFalse(ref.exists)
+        self.assertRaises(IOError, ref.open, 'rb')
+
+    def test_size_mismatch(self):
+        """A file whose size differs from the expected size is an error."""
+        name = self.names[0]
+        ref = FileInStream(self.stream, name, len(self.contents[name]) + 1)
+        self.assertRaises(IOError, ref.copy_to, self.temp_dir)
+
+    def test_add_to_archive(self):
+        """Test the add_to_archive() API."""
+        ref = FileInStream(self.stream, "sample_cfg.txt")
+        self.assertRaises(IOError, getattr, ref, 'extents')
+        output_tarfile = os.path.join(self.temp_dir, 'test_output.tar')
+        with closing(tarfile.open(output_tarfile, 'w')) as tarf:
+            digests = ref.add_to_archive(tarf, ['md5'])
+        self.assertEqual(digests, {'md5': file_checksum(
+            resource_filename(__name__, 'sample_cfg.txt'), 'md5')})
+        with closing(tarfile.open(output_tarfile, 'r')) as tarf:
+            self.assertEqual(tarf.extractfile('sample_cfg.txt').read(),
+                             self.contents['sample_cfg.txt'])
+
+
+class TestTarMemberReader(COT_UT):
+    """Test cases for TarMemberReader class."""
+
+    def setUp(self):
+        """Test case setup function called automatically prior to each test."""
+        super(TestTarMemberReader, self).setUp()
+        self.tarfile = resource_filename(__name__, "test.tar")
+        self.member = TarIndex(self.tarfile).getmember("sample_cfg.txt")
+        with open(resource_filename(__name__, 'sample_cfg.txt'), 'rb') as f:
+            self.expected = f.read()
+
+    def test_read(self):
+        """Test read() calls, including reads past the end of the member."""
+        with closing(TarMemberReader(self.tarfile, self.member)) as obj:
+            self.assertEqual(obj.read(2), self.expected[:2])
+            self.assertEqual(obj.tell(), 2)
+            self.assertEqual(obj.read(), self.expected[2:])
+            self.assertEqual(obj.read(), b'')
+            self.assertEqual(obj.read(10), b'')
+        self.assertRaises(ValueError, obj.read)
+
+    def test_readinto(self):
+        """Test readinto() calls."""
+        buf = bytearray(self.member.size + 100)
+        with closing(TarMemberReader(self.tarfile, self.member)) as obj:
+            self.assertEqual(obj.readinto(buf), self.member.size)
+            self.assertEqual(bytes(buf[:self.member.size]), self.expected)
+            self.assertEqual(obj.readinto(buf), 0)
+
+    def test_seek(self):
+        """Test seek() and tell() calls."""
+        with closing(TarMemberReader(self.tarfile, self.member)) as obj:
+            self.assertTrue(obj.seekable())
+            self.assertEqual(obj.seek(-5, os.SEEK_END),
+                             self.member.size - 5)
+            self.assertEqual(obj.read(), self.expected[-5:])
+            obj.seek(3)
+            obj.seek(2, os.SEEK_CUR)
+            self.assertEqual(obj.read(4), self.expected[5:9])
+            self.assertRaises(ValueError, obj.seek, -1)
+            self.assertRaises(ValueError, obj.seek, 0, 42)
+
+
+class TestFileSpan(COT_UT):
+    """Test cases for FileSpan class."""
+
+    def setUp(self):
+        """Test case setup function called automatically prior to each test."""
+        super(TestFileSpan, self).setUp()
+        with open(self.input_iso, 'rb') as f:
+            self.data = f.read()
+        # Split input.iso into three chunks
+        self.chunk_size = len(self.data) // 3 + 1
+        self.chunks = []
+        for index in range(3):
+            path = os.path.join(self.temp_dir,
+                                chunk_file_name("input.iso", index))
+            with open(path, 'wb') as f:
+                f.write(self.data[index * self.chunk_size:
+                                  (index + 1) * self.chunk_size])
+            self.chunks.append(FileOnDisk(path))
+        self.span = FileSpan.join("input.iso", self.chunks)
+
+    def test_join(self):
+        """A joined file looks like a single file."""
+        self.assertTrue(self.span.exists)
+        self.assertEqual(self.span.size, len(self.data))
+        self.assertEqual(self.span.file_path, None)
+        # Recently modified files can't be cached
+        self.assertEqual(self.span.identity, None)
+        with mock.patch('COT.file_reference.path_identity',
+                        side_effect=lambda path: (path, )):
+            self.assertEqual(self.span.identity,
+                             ('span', ) + self.chunks[0].extents[0] +
+                             self.chunks[1].extents[0] +
+                             self.chunks[2].extents[0])
+        self.assertEqual(self.span.open('rb').read(), self.data)
+        self.span.close()
+        self.assertRaises(ValueError, self.span.open, 'w')
+
+        self.assertEqual(FileSpan.join("input.iso", self.chunks), self.span)
+        self.assertNotEqual(FileSpan.join("input.iso", self.chunks[:2]),
+                            self.span)
+        os.remove(self.chunks[2].file_path)
+        self.assertFalse(self.span.exists)
+
+    def test_split(self):
+        """A file can be split into chunks and rejoined."""
+        file_ref = FileOnDisk(self.input_iso)
+        chunks = FileSpan.split(file_ref, 100000)
+        self.assertEqual([chunk.filename for chunk in chunks],
+                         [chunk_file_name("input.iso", i)
+                          for i in range(len(chunks))])
+        self.assertEqual([chunk.size for chunk in chunks[:-1]],
+                         [100000] * (len(chunks) - 1))
+        self.assertEqual(FileSpan.join("input.iso", chunks).extents,
+                         file_ref.extents)
+        self.assertEqual(chunks[0].file_path, None)
+        self.assertEqual(FileSpan.split(file_ref,
+                                        len(self.data))[0].file_path,
+                         self.input_iso)
+
+        # Re-chunking spans several of the original chunks
+        rechunked = FileSpan.split(self.span, self.chunk_size + 100, "foo")
+        self.assertEqual(len(rechunked), 3)
+        self.assertEqual(rechunked[1].filename, "foo.000000001")
+        self.assertEqual(len(rechunked[1].extents), 2)
+        with rechunked[1].open('rb') as f:
+            self.assertEqual(f.read(), self.data[self.chunk_size + 100:
+                                                 2 * self.chunk_size + 200])
+
+    def test_copy_to(self):
+        """The data is copied into a single file."""
+        self.span.copy_to(os.path.join(self.temp_dir, "output.iso"))
+        with open(os.path.join(self.temp_dir, "output.iso"), 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        # Pieces are copied concurrently, whatever the copy strategy.
+        # Yield to other threads after seeking, to shake out any races
+        # on a shared file offset.
+        span = FileSpan.join("input.iso", FileSpan.split(self.span, 4096))
+        lseek = os.lseek
+
+        def _lseek(*args):
+            """Seek, then let other threads run."""
+            result = lseek(*args)
+            time.sleep(0.0001)
+            return result
+
+        for strategies in [['sendfile', 'buffered'], ['buffered']]:
+            with mock.patch('COT.file_copy.available_strategies',
+                            return_value=strategies):
+                with mock.patch('COT.file_reference.default_workers',
+                                return_value=8):
+                    with mock.patch('os.lseek', side_effect=_lseek):
+                        span.copy_to(os.path.join(self.temp_dir,
+                                                  "output.iso"))
+            with open(os.path.join(self.temp_dir, "output.iso"), 'rb') as f:
+                self.assertEqual(f.read(), self.data)
+        # No-op if the file is already in place
+        chunk = FileSpan.split(self.chunks[0], self.chunk_size)[0]
+        chunk.copy_to(self.temp_dir)
+        self.assertEqual(os.path.getsize(self.chunks[0].file_path),
+                         self.chunk_size)
+
+    def test_add_to_archive(self):
+        """The data is added to a TAR file as a single member."""
+        tar_path = os.path.join(self.temp_dir, "test.tar")
+        with closing(tarfile.open(tar_path, 'w')) as tarf:
+            self.assertEqual(
+                self.span.add_to_archive(tarf, ['sha1']),
+                {'sha1': file_checksum(self.input_iso, 'sha1')})
+            self.assertEqual(self.chunks[0].add_to_archive(tarf), {})
+            FileSpan.split(self.chunks[1], self.chunk_size,
+                           "foo")[0].add_to_archive(tarf)
+        with closing(tarfile.open(tar_path, 'r')) as tarf:
+            self.assertEqual(tarf.getnames(), ["input.iso",
+                                               "input.iso.000000000",
+                                               "foo.000000000"])
+            self.assertEqual(tarf.extractfile("input.iso").read(), self.data)
+            self.assertEqual(tarf.extractfile("foo.000000000").read(),
+                             self.data[self.chunk_size:2 * self.chunk_size])
+
+        # Spans can also be made of files within a TAR
+        span = FileSpan.join("input.iso", [
+            FileInTAR(tar_path, "input.iso.000000000"),
+            FileSpan(None, [(tar_path, 0, 0)]),
+            self.chunks[1], self.chunks[2]])
+        self.assertEqual(span.open('rb').read(), self.data)
+        span.close()
+
+
+class TestTarIndex(COT_UT):
+    """Test cases for TarIndex class."""
+
+    def setUp(self):
+        """Test case setup function called automatically prior to each test."""
+        super(TestTarIndex, self).setUp()
+        self.tarfile = resource_filename(__name__, "test.tar")
+
+    def test_not_tarfile(self):
+        """Test error handling when file is not a TAR file."""
+        self.assertRaises(IOError, TarIndex, self.input_ovf)
+        self.assertRaises(IOError, TarIndex, "/foo/bar")
+
+    def test_members(self):
+        """Test member lookup and header information."""
+        index = TarIndex(self.tarfile)
+        self.assertEqual([mem.name for mem in index.members],
+                         ["input.mf", "sample_cfg.txt"])
+        self.assertTrue("sample_cfg.txt" in index)
+        self.assertTrue("./sample_cfg.txt" in index)
+        self.assertFalse("foo.bar" in index)
+        self.assertRaises(KeyError, index.getmember, "foo.bar")
+        mem = index.getmember("sample_cfg.txt")
+        with open(self.tarfile, 'rb') as tarf:
+            tarf.seek(mem.offset_data)
+            data = tarf.read(mem.size)
+        with open(resource_filename(__name__, 'sample_cfg.txt'), 'rb') as f:
+            self.assertEqual(data, f.read())
+
+    def test_refresh_on_change(self):
+        """The index is rebuilt if the archive changes on disk."""
+        tar_path = os.path.join(self.temp_dir, "test.tar")
+        with closing(tarfile.open(tar_path, 'w')) as tarf:
+            tarf.add(self.input_ovf, "input.ovf")
+        index = TarIndex(tar_path)
+        self.assertEqual(index.getmember("input.ovf").size,
+                         os.path.getsize(self.input_ovf))
+        # Append a new member of the same name - last one wins
+        with closing(tarfile.open(tar_path, 'a')) as tarf:
+            tarf.add(self.minimal_ovf, "input.ovf")
+        self.assertEqual(index.getmember("input.ovf").size,
+                         os.path.getsize(self.minimal_ovf))
+        self.assertEqual(len(index.members), 2)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+#
+# test_http_file.py - Unit test cases for remote file access over HTTP
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Unit test cases for COT.http_file module."""
+
+import hashlib
+import os
+import re
+import tarfile
+import threading
+
+from contextlib import closing
+
+import mock
+import requests
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from COT.tests.ut import COT_UT
+from COT.file_reference import FileInTAR
+from COT.http_file import TIMEOUT, _session, open_url
+from COT.submodule import COTSubmodule
+from COT.ui_shared import UI
+from COT.vm_context_manager import VMContextManager
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serve files from a directory, with support for range requests."""
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        """Count each new connection to the server."""
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Don't log requests to stderr."""
+        pass
+
+    def _send_file(self, include_body):
+        """Send the requested file, or the requested range of it.
+
+        Args:
+          include_body (bool): False for a HEAD request.
+        """
+        path = os.path.join(self.server.root, self.path.lstrip('/'))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as file_obj:
+            data = file_obj.read()
+        etag = '"{0}"'.format(hashlib.sha1(data).hexdigest())
+        if self.server.weak_etags:
+            etag = 'W/' + etag
+        match = re.match(r"bytes=(\d+)-(\d+)$",
+                         self.headers.get('Range') or '')
+        # If-Range only matches a strong ETag
+        if_range = self.headers.get('If-Range')
+        if (match and self.server.ranges and
+                (if_range is None or
+                 (if_range == etag and not etag.startswith('W/')))):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), len(data) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'
+                             .format(start, end, len(data)))
+            data = data[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        if include_body:
+            self.server.bytes_sent += len(data)
+            self.server.gets += 1
+            self.wfile.write(data)
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        """Handle a HEAD request."""
+        self._send_file(False)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Handle a GET request."""
+        self._send_file(True)
+
+
+class RangeHTTPServer(ThreadingMixIn, HTTPServer):
+    """Local stand-in for a remote web server, with statistics."""
+
+    daemon_threads = True
+
+    def __init__(self, root):
+        """Serve the given directory on an arbitrary local port.
+
+        Args:
+          root (str): Directory to serve files from.
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', 0), RangeRequestHandler)
+        self.root = root
+        self.ranges = True
+        self.weak_etags = False
+        self.connections = 0
+        self.gets = 0
+        self.bytes_sent = 0
+
+
+class HTTPTestCase(COT_UT):
+    """Test case with a local HTTP server running."""
+
+    def setUp(self):
+        """Start the HTTP server in a background thread."""
+        super(HTTPTestCase, self).setUp()
+        self.server = RangeHTTPServer(self.temp_dir)
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       kwargs={'poll_interval': 0.05})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        """Stop the HTTP server."""
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super(HTTPTestCase, self).tearDown()
+
+    def url(self, filename):
+        """Get the URL of the given file in :attr:`temp_dir`.
+
+        Args:
+          filename (str): File name
+        Returns:
+          str: URL
+        """
+        return "http://127.0.0.1:{0}/{1}".format(self.server.server_port,
+                                                 filename)
+
+
+class TestHTTPFile(HTTPTestCase):
+    """Test cases for HTTPFile class."""
+
+    def setUp(self):
+        """Create a file to serve."""
+        super(TestHTTPFile, self).setUp()
+        self.data = os.urandom(1024 * 1024)
+        with open(os.path.join(self.temp_dir, 'data.bin'), 'wb') as f:
+            f.write(self.data)
+
+    def test_pread(self):
+        """Read arbitrary ranges of the file."""
+        remote = open_url(self.url('data.bin'))
+        self.assertEqual(remote.size, len(self.data))
+        self.assertEqual(remote.identity[0], 'url')
+        self.assertEqual(remote.pread(100, 500000), self.data[500000:500100])
+        self.assertEqual(remote.pread(100, len(self.data) - 10),
+                         self.data[-10:])
+        self.assertEqual(remote.pread(100, len(self.data)), b'')
+        self.assertEqual(remote.pread(300000, 700000),
+                         self.data[700000:1000000])
+        self.assertEqual(remote.pread(400000, 700000), self.data[700000:])
+
+    def test_cache(self):
+        """Nearby reads are served from the cache."""
+        remote = open_url(self.url('data.bin'))
+        for offset in range(0, 10000, 512):
+            self.assertEqual(remote.pread(512, offset),
+                             self.data[offset:offset + 512])
+        self.assertEqual(self.server.gets, 1)
+
+    def test_readahead(self):
+        """Sequential reads make progressively larger requests."""
+        remote = open_url(self.url('data.bin'))
+        for offset in range(0, len(self.data), 8192):
+            self.assertEqual(remote.pread(8192, offset),
+                             self.data[offset:offset + 8192])
+        # 64 KiB, 128 KiB, 256 KiB, 512 KiB, then the last 64 KiB
+        self.assertEqual(self.server.gets, 5)
+        self.assertEqual(self.server.bytes_sent, len(self.data))
+
+    def test_connection_reuse(self):
+        """All requests are made over a single connection."""
+        remote = open_url(self.url('data.bin'))
+        for offset in range(0, len(self.data), 200000):
+            remote.pread(10, offset)
+        self.assertEqual(self.server.gets, 6)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_not_found(self):
+        """A nonexistent file is reported as an error."""
+        with self.assertRaises(IOError):
+            open_url(self.url('nonexistent.bin'))
+
+    def test_no_range_support(self):
+        """A server that doesn't support range requests is an error."""
+        self.server.ranges = False
+        remote = open_url(self.url('data.bin'))
+        with self.assertRaises(IOError):
+            remote.pread(100, 0)
+
+    def test_unwanted_body(self):
+        """The body of a response other than the range isn't downloaded."""
+        self.server.ranges = False
+        remote = open_url(self.url('data.bin'))
+        with mock.patch.object(requests.Session, 'get', autospec=True,
+                               side_effect=requests.Session.get) as get:
+            with self.assertRaises(IOError):
+                remote.pread(100, 0)
+            self.assertTrue(get.call_args[1]['stream'])
+            self.assertEqual(get.call_args[1]['timeout'], TIMEOUT)
+        # The connection was closed rather than read to the end
+        self.server.ranges = True
+        self.assertEqual(remote.pread(100, 0), self.data[:100])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_changed(self):
+        """A change to the remote file is detected."""
+        remote = open_url(self.url('data.bin'))
+        with open(os.path.join(self.temp_dir, 'data.bin'), 'wb') as f:
+            f.write(os.urandom(1024 * 1024))
+        with self.assertRaises(IOError):
+            remote.pread(100, 0)
+
+    def test_weak_etag(self):
+        """A weak ETag isn't sent in If-Range but changes are detected."""
+        self.server.weak_etags = True
+        remote = open_url(self.url('data.bin'))
+        self.assertEqual(remote.pread(100, 0), self.data[:100])
+        with open(os.path.join(self.temp_dir, 'data.bin'), 'wb') as f:
+            f.write(os.urandom(1024 * 1024))
+        with self.assertRaises(IOError):
+            remote.pread(100, 500000)
+
+    def test_session_per_thread(self):
+        """Each thread makes its requests with its own session."""
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(_session()))
+        thread.start()
+        thread.join()
+        self.assertIs(_session(), _session())
+        self.assertIsNot(sessions[0], _session())
+
+
+class TestRemoteOVA(HTTPTestCase):
+    """Test cases for reading an OVA over HTTP."""
+
+    def setUp(self):
+        """Create an OVA to serve."""
+        super(TestRemoteOVA, self).setUp()
+        self.ova = os.path.join(self.temp_dir, 'input.ova')
+        input_dir = os.path.dirname(self.input_ovf)
+        with closing(tarfile.open(self.ova, 'w')) as tarf:
+            for name in ['input.ovf', 'input.mf', 'input.vmdk', 'input.iso',
+                         'sample_cfg.txt']:
+                tarf.add(os.path.join(input_dir, name), name)
+
+    def test_file_in_tar(self):
+        """FileInTAR can read members of a remote OVA."""
+        ref = FileInTAR(self.url('input.ova'), 'sample_cfg.txt')
+        self.assertEqual(ref.size, os.path.getsize(self.sample_cfg))
+        with open(self.sample_cfg, 'rb') as f:
+            self.assertEqual(ref.open('rb').read(), f.read())
+        ref.close()
+        ref.copy_to(os.path.join(self.temp_dir, 'copy.txt'))
+        self.check_diff("", file1=self.sample_cfg,
+                        file2=os.path.join(self.temp_dir, 'copy.txt'))
+
+    def test_read_only(self):
+        """Only headers and the descriptor are fetched to describe an OVA."""
+        with VMContextManager(self.url('input.ova'), None) as vm:
+            self.assertEqual(vm.ovf_descriptor, 'input.ovf')
+            self.assertEqual(vm.get_serial_count(['1CPU-1GB-1NIC']),
+                             {'1CPU-1GB-1NIC': 2})
+        self.assertLess(self.server.bytes_sent,
+                        os.path.getsize(self.ova) // 2)
+
+    def test_verify_manifest(self):
+        """The contents of a remote OVA can be verified."""
+        with VMContextManager(self.url('input.ova'), None) as vm:
+            self.assertEqual(vm.verify_manifest(), {})
+
+    def test_write(self):
+        """A remote OVA can be written to a local OVA."""
+        output = os.path.join(self.temp_dir, 'output.ova')
+        with VMContextManager(self.url('input.ova'), output):
+            pass
+        with closing(tarfile.open(output, 'r')) as tarf:
+            with open(self.input_iso, 'rb') as f:
+                self.assertEqual(tarf.extractfile('input.iso').read(),
+                                 f.read())
+        with VMContextManager(output, None) as vm:
+            self.assertEqual(vm.verify_manifest(), {})
+
+    def test_submodule(self):
+        """An output file must be specified when editing a remote OVA."""
+        instance = COTSubmodule(UI())
+        instance.package = self.url('input.ova')
+        ready, reason = instance.ready_to_run()
+        self.assertFalse(ready)
+        self.assertTrue(re.search("OUTPUT is required", reason))
+        instance.output = os.path.join(self.temp_dir, 'output.ova')
+        self.assertTrue(instance.ready_to_run()[0])
+        instance.destroy()
@@ -16,10 +16,13 @@
 
 """Test cases for COT.submodule.COTSubmodule class."""
 
+import mock
+
 from COT.tests.ut import COT_UT
 from COT.ui_shared import UI
 from COT.submodule import COTSubmodule
 from COT.vm_description import VMInitError
+from COT.data_validation import InvalidInputError, ValueMismatchError
 
 
 class TestCOTSubmodule(COT_UT):
@@ -48,3 +51,77 @@ class TestCOTSubmodule(COT_UT):
         self.assertEqual(self.instance.output, "")
         self.instance.run()
         self.assertEqual(self.instance.output, self.input_ovf)
+
+    def test_checksum_type(self):
+        """The checksum_type attribute is passed through to the VM."""
+        self.instance.checksum_type = 'sha512'
+        self.instance.package = self.minimal_ovf
+        self.assertEqual(self.instance.vm.checksum_type, 'sha512')
+        self.instance.checksum_type = None
+        self.assertEqual(self.instance.vm.checksum_type, 'sha1')
+
+    def test_trailing_manifest(self):
+        """The trailing_manifest attribute is passed through to the VM."""
+        self.assertFalse(self.instance.trailing_manifest)
+        self.instance.trailing_manifest = True
+        self.instance.package = self.minimal_ovf
+        self.assertTrue(self.instance.vm.trailing_manifest)
+        self.instance.trailing_manifest = False
+        self.assertFalse(self.instance.vm.trailing_manifest)
+
+    def test_descriptor_padding(self):
+        """The descriptor_padding attribute is passed through to the VM."""
+        self.assertEqual(self.instance.descriptor_padding, 0)
+        with self.assertRaises(InvalidInputError):
+            self.instance.descriptor_padding = -1
+        self.instance.descriptor_padding = 4096
+        self.instance.package = self.minimal_ovf
+        self.assertEqual(self.instance.vm.descriptor_padding, 4096)
+
+    def test_link_mode(self):
+        """The link_mode attribute is passed through to the VM."""
+        self.assertEqual(self.instance.link_mode, 'auto')
+        with self.assertRaises(InvalidInputError):
+            self.instance.link_mode = 'symlink'
+        self.instance.link_mode = 'copy'
+        self.instance.package = self.minimal_ovf
+        self.assertEqual(self.instance.vm.link_mode, 'copy')
+
+    def test_chunk_size(self):
+        """The chunk_size attribute is passed through to the VM."""
+        self.assertEqual(self.instance.chunk_size, None)
+        with self.assertRaises(InvalidInputError):
+            self.instance.chunk_size = -1
+        self.instance.chunk_size = 1048576
+        self.instance.package = self.minimal_ovf
+        self.assertEqual(self.instance.vm.chunk_size, 1048576)
+        self.instance.chunk_size = 0
+        self.assertEqual(self.instance.vm.chunk_size, 0)
+
+    def test_file_compression(self):
+        """The file_compression attribute is passed through to the VM."""
+        self.assertEqual(self.instance.file_compression, None)
+        with self.assertRaises(InvalidInputError):
+            self.instance.file_compression = 'bzip2'
+        self.instance.file_compression = 'gzip'
+        self.instance.package = self.minimal_ovf
+        self.assertEqual(self.instance.vm.file_compression, 'gzip')
+        self.instance.file_compression = 'none'
+        self.assertEqual(self.instance.vm.file_compression, 'none')
+
+    def test_verify_manifest(self):
+        """The input package is verified on request before proceeding."""
+        self.instance.package = self.input_ovf
+        self.instance.verify_manifest = True
+        self.instance.run()
+        self.assertLogged(levelname="INFO", msg="matches its manifest")
+
+        with mock.patch.object(self.instance.vm, 'verify_manifest',
+                               return_value={'input.iso': "oops"}):
+            with self.assertRaises(ValueMismatchError):
+                self.instance.run()
+
+        self.instance.package = self.minimal_ovf
+        self.instance.run()
+        self.assertLogged(levelname="WARNING",
+                          msg="has no manifest to verify against")
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+#
+# test_verify.py - Unit test cases for COTVerify class.
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Unit test cases for the COT.verify.COTVerify class."""
+
+import os
+import shutil
+
+import mock
+
+from COT.tests.ut import COT_UT
+from COT.ui_shared import UI
+from COT.verify import COTVerify
+from COT.data_validation import InvalidInputError, ValueMismatchError
+
+try:
+    import StringIO
+except ImportError:
+    import io as StringIO
+
+
+class TestCOTVerify(COT_UT):
+    """Test cases for the COTVerify class."""
+
+    def setUp(self):
+        """Test case setup function called automatically prior to each test."""
+        super(TestCOTVerify, self).setUp()
+        self.instance = COTVerify(UI())
+
+    def test_readiness(self):
+        """Test ready_to_run() under various combinations of parameters."""
+        ready, reason = self.instance.ready_to_run()
+        self.assertFalse(ready)
+        self.assertEqual("At least one package must be specified", reason)
+        self.assertRaises(InvalidInputError, self.instance.run)
+
+        self.instance.package_list = [self.input_ovf]
+        ready, reason = self.instance.ready_to_run()
+        self.assertTrue(ready)
+
+    def test_invalid_args(self):
+        """Test various invalid inputs."""
+        with self.assertRaises(InvalidInputError):
+            self.instance.package_list = ["/foo/bar/baz"]
+
+    def test_verify(self):
+        """Verify packages with and without a manifest."""
+        self.instance.package_list = [self.input_ovf, self.minimal_ovf]
+        self.check_cot_output("""
+{0}: OK
+{1}: no manifest to verify against
+""".format(self.input_ovf, self.minimal_ovf))
+
+    def test_verify_failed(self):
+        """A package that does not match its manifest causes an error."""
+        for filename in ['input.ovf', 'input.mf', 'input.vmdk', 'input.iso']:
+            shutil.copy(os.path.join(os.path.dirname(self.input_ovf),
+                                     filename),
+                        self.temp_dir)
+        with open(os.path.join(self.temp_dir, 'sample_cfg.txt'), 'w') as f:
+            f.write("hello world!\n")
+        package = os.path.join(self.temp_dir, 'input.ovf')
+        self.instance.package_list = [self.input_ovf, package]
+        with mock.patch('sys.stdout', new_callable=StringIO.StringIO) as so:
+            with self.assertRaises(ValueMismatchError):
+                self.instance.run()
+            output = so.getvalue()
+        self.assertMultiLineEqual("""
+{0}: OK
+{1}: FAILED
+  sample_cfg.txt: SHA1 checksum is f951b101989b2c3b7471710b4e78fc4dbdfa0ca6\
+, but the manifest says 6e5c894c186e89cc7801031589078070394b7514
+""".format(self.input_ovf, package).strip(), output.strip())
@@ -16,6 +16,8 @@
 
 import os.path
 from pkg_resources import resource_filename
+
+import mock
 try:
     import unittest2 as unittest
 except ImportError:
@@ -42,9 +44,10 @@ class TestVMDescription(unittest.TestCase):
 
         self.assertRaises(NotImplementedError,
                           ins.write)
+        self.assertRaises(NotImplementedError,
+                          ins.verify_manifest)
 
         ins.destroy()
-        self.assertFalse(os.path.exists(ins.working_dir))
 
     def test_abstract_info_apis(self):
         """Get NotImplementedError from abstract info APIs."""
@@ -58,7 +61,6 @@ class TestVMDescription(unittest.TestCase):
                           ins.profile_info_string)
 
         ins.destroy()
-        self.assertFalse(os.path.exists(ins.working_dir))
 
     def test_abstract_disk_file_apis(self):
         """Get NotImplementedError from abstract disk and file APIs."""
@@ -104,7 +106,6 @@ class TestVMDescription(unittest.TestCase):
                           ins.find_empty_drive, None)
 
         ins.destroy()
-        self.assertFalse(os.path.exists(ins.working_dir))
 
     def test_abstract_hardware_apis(self):
         """Get NotImplementedError from abstract hardware APIs."""
@@ -161,7 +162,6 @@ class TestVMDescription(unittest.TestCase):
                           ins.find_device_location, None)
 
         ins.destroy()
-        self.assertFalse(os.path.exists(ins.working_dir))
 
     def test_abstract_product_apis(self):
         """Get NotImplementedError from abstract product APIs."""
@@ -177,7 +177,6 @@ class TestVMDescription(unittest.TestCase):
             ins.version_long = "hello world!"
 
         ins.destroy()
-        self.assertFalse(os.path.exists(ins.working_dir))
 
     def test_abstract_property_apis(self):
         """Get NotImplementedError from abstract property APIs."""
@@ -197,14 +196,12 @@ class TestVMDescription(unittest.TestCase):
                           ins.config_file_to_properties, self.TEXT_FILE)
 
         ins.destroy()
-        self.assertFalse(os.path.exists(ins.working_dir))
 
     def test_generic_instance_apis(self):
         """Verify APIs with generic implementations."""
         ins = VMDescription(self.TEXT_FILE, None)
         self.assertEqual(ins.input_file, self.TEXT_FILE)
         self.assertEqual(ins.output_file, None)
-        self.assertTrue(os.path.exists(ins.working_dir))
 
         ins.output_file = self.TEXT_FILE
         self.assertEqual(ins.output_file, self.TEXT_FILE)
@@ -216,4 +213,21 @@ class TestVMDescription(unittest.TestCase):
         self.assertEqual(out, self.TEXT_FILE)
 
         ins.destroy()
-        self.assertFalse(os.path.exists(ins.working_dir))
+
+    @mock.patch('atexit.register')
+    def test_working_dir(self, mock_register):
+        """The working directory is only created when first used."""
+        with mock.patch('tempfile.mkdtemp') as mock_mkdtemp:
+            ins = VMDescription(self.TEXT_FILE, None)
+            ins.destroy()
+            mock_mkdtemp.assert_not_called()
+        mock_register.assert_not_called()
+
+        ins = VMDescription(self.TEXT_FILE, None)
+        working_dir = ins.working_dir
+        self.assertTrue(os.path.isdir(working_dir))
+        self.assertEqual(ins.working_dir, working_dir)
+        mock_register.assert_called_once_with(ins.destroy)
+
+        ins.destroy()
+        self.assertFalse(os.path.exists(working_dir))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# test_xml_backend.py - Unit test cases for XML library selection
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Unit test cases for COT.xml_backend module.
+
+Whichever XML library is in use, its output is compared against that of
+:mod:`xml.etree.ElementTree`.
+"""
+
+import io
+import os
+import weakref
+import xml.etree.ElementTree as STDLIB_ET
+
+from COT.tests.ut import COT_UT
+from COT.xml_backend import (
+    BACKEND, ET, Element, ParseError, SubElement, fromstring, parse,
+    register_namespace, tostring, write,
+)
+
+
+class TestXMLBackend(COT_UT):
+    """Test cases for the functions of the XML backend."""
+
+    def register_namespaces(self, xml_file):
+        """Register the namespace prefixes declared in the given file.
+
+        Args:
+          xml_file (str): XML file to examine.
+        """
+        for (_, (prefix, uri)) in STDLIB_ET.iterparse(xml_file,
+                                                      events=('start-ns',)):
+            if prefix:
+                register_namespace(prefix, uri)
+
+    def check_write(self, xml_file):
+        """Check that reading and writing a file matches ElementTree.
+
+        Args:
+          xml_file (str): XML file to read and write.
+        """
+        expected = io.BytesIO()
+        STDLIB_ET.parse(xml_file).write(expected, xml_declaration=True,
+                                        encoding='utf-8')
+        actual = io.BytesIO()
+        write(parse(xml_file), actual)
+        self.assertEqual(expected.getvalue().decode('utf-8'),
+                         actual.getvalue().decode('utf-8'))
+        # Writing to a file path works too
+        path = os.path.join(self.temp_dir, 'out.xml')
+        write(parse(xml_file), path)
+        with open(path, 'rb') as file_obj:
+            self.assertEqual(expected.getvalue(), file_obj.read())
+
+    def test_backend(self):
+        """The library in use is consistently identified."""
+        self.assertIn(BACKEND, ['lxml', 'ElementTree'])
+        self.assertEqual(BACKEND == 'ElementTree', ET is STDLIB_ET)
+
+    def test_element_factories(self):
+        """Created and parsed elements can be weakly referenced."""
+        parent = Element('a', {'b': 'c'})
+        child = SubElement(parent, 'd')
+        self.assertEqual(parent.get('b'), 'c')
+        self.assertEqual(list(parent), [child])
+        root = fromstring('<e><f/></e>')
+        self.assertEqual(root[0].tag, 'f')
+        parsed = parse(self.localfile('minimal.ovf')).getroot()
+        for elem in [parent, child, root, root[0], parsed]:
+            self.assertIs(weakref.ref(elem)(), elem)
+        # Elements added beneath them may be weakly referenced too
+        grandchild = ET.SubElement(child, 'g')
+        self.assertIs(weakref.ref(grandchild)(), grandchild)
+
+    def test_other_lxml_users(self):
+        """Other users of lxml in this process are not affected."""
+        try:
+            from lxml import etree as lxml_et
+        except ImportError:
+            self.skipTest("lxml is not installed")
+        elem = lxml_et.fromstring('<a><!-- hello --></a>')
+        self.assertIs(type(elem), lxml_et._Element)
+        self.assertEqual(len(elem), 1)
+        with self.assertRaises(TypeError):
+            weakref.ref(elem)
+
+    def test_write_descriptors(self):
+        """Output is identical to ElementTree for the test descriptors."""
+        for name in ['input.ovf', 'csr1000v.ovf', 'iosv.ovf', 'minimal.ovf',
+                     'vmware.ovf', 'v0.9.ovf', 'ubuntu.2.0.ovf']:
+            xml_file = self.localfile(name)
+            self.register_namespaces(xml_file)
+            self.check_write(xml_file)
+
+    def test_write_special_cases(self):
+        """Output is identical to ElementTree in corner cases."""
+        register_namespace('xbt', 'urn:cot:xml-backend-test')
+        for text in [
+                # Empty elements and escaped characters
+                '<xbt:a xmlns:xbt="urn:cot:xml-backend-test" b="1&#9;2&gt;">'
+                '<xbt:c/> &amp; &lt;d&gt;<e b="&quot;"/>\té</xbt:a>',
+                # Carriage return in text
+                '<a>line&#13;\n</a>',
+                # Unregistered namespace
+                '<u:a xmlns:u="urn:cot:unregistered"><u:b u:c="d"/></u:a>',
+                # Namespace declared on a child element
+                '<a><xbt:b xmlns:xbt="urn:cot:xml-backend-test"/></a>',
+                # Unused namespace declaration
+                '<a xmlns:xbt="urn:cot:xml-backend-test"><b/></a>',
+                # Comments and processing instructions are discarded
+                '<!-- hello --><a><?pi data?><!-- world --><b/></a>',
+        ]:
+            xml_file = os.path.join(self.temp_dir, 'in.xml')
+            with io.open(xml_file, 'w', encoding='utf-8') as file_obj:
+                file_obj.write(text)
+            self.check_write(xml_file)
+
+    def test_tostring(self):
+        """Element strings are identical to ElementTree."""
+        xml_file = self.localfile('vmware.ovf')
+        self.register_namespaces(xml_file)
+        expected = STDLIB_ET.parse(xml_file).getroot()
+        actual = parse(xml_file).getroot()
+        for (exp, act) in zip(expected.iter(), actual.iter()):
+            self.assertEqual(STDLIB_ET.tostring(exp).decode('ascii'),
+                             tostring(act).encode('ascii',
+                                                  'xmlcharrefreplace')
+                             .decode('ascii'))
+
+    def test_parse_error(self):
+        """Malformed XML raises ParseError."""
+        xml_file = os.path.join(self.temp_dir, 'bad.xml')
+        with open(xml_file, 'w') as file_obj:
+            file_obj.write("<a><b></a>")
+        with self.assertRaises(ParseError):
+            parse(xml_file)
@@ -14,9 +14,11 @@
 
 """Unit test cases for the COT.xml_file.XML class."""
 
+import sys
 import unittest
 from pkg_resources import resource_filename
 
+from COT.xml_backend import Element, SubElement
 from COT.xml_file import XML
 
 
@@ -99,3 +101,124 @@ class TestXMLInstance(unittest.TestCase):
                       self.OVF + "bar"],
             known_namespaces=["http://schemas.dmtf.org/ovf/envelope/1"]
         )
+
+    def test_index_children(self):
+        """Look up indexed children and keep the index up to date."""
+        refs = self.xml.find_child(self.xml.root, self.OVF + "References")
+        file_tag = self.OVF + "File"
+        href = self.OVF + "href"
+        file_id = self.OVF + "id"
+        self.xml.index_children(refs, file_tag, (href, file_id))
+
+        match = self.xml.find_child(refs, file_tag,
+                                    attrib={href: "input.iso"})
+        self.assertEqual(match.get(file_id), "file2")
+        # Unindexed attributes are still checked
+        self.assertEqual(None, self.xml.find_child(
+            refs, file_tag, attrib={href: "input.iso", file_id: "file1"}))
+
+        # Additions and removals through this class are reflected
+        new = self.xml.set_or_make_child(refs, file_tag,
+                                         attrib={href: "new.txt",
+                                                 file_id: "new"})
+        self.assertEqual(new, self.xml.find_child(refs, file_tag,
+                                                  attrib={file_id: "new"}))
+        self.xml.remove_child(refs, match)
+        self.assertEqual(None, self.xml.find_child(
+            refs, file_tag, attrib={href: "input.iso"}))
+
+        # As are direct additions and removals
+        refs.remove(new)
+        self.assertEqual(None, self.xml.find_child(refs, file_tag,
+                                                   attrib={file_id: "new"}))
+        refs.append(match)
+        self.assertEqual(match, self.xml.find_child(
+            refs, file_tag, attrib={href: "input.iso"}))
+
+        # Direct changes to indexed attributes require invalidation
+        match.set(href, "renamed.iso")
+        self.assertEqual(None, self.xml.find_child(
+            refs, file_tag, attrib={href: "input.iso"}))
+        self.xml.invalidate_index(refs)
+        self.assertEqual(match, self.xml.find_child(
+            refs, file_tag, attrib={href: "renamed.iso"}))
+
+        # Multiple matches are found in document order
+        for elem in self.xml.find_all_children(refs, file_tag):
+            elem.set(file_id, "same")
+        self.xml.invalidate_index(refs)
+        self.assertEqual(self.xml.find_all_children(refs, file_tag),
+                         self.xml.find_all_children(refs, file_tag,
+                                                    attrib={file_id: "same"}))
+
+        # Removing a child whose indexed attribute has changed since it was
+        # indexed doesn't leave it behind in the index
+        match.set(href, "old.iso")
+        self.xml.invalidate_index(refs)
+        self.assertEqual(match, self.xml.find_child(
+            refs, file_tag, attrib={href: "old.iso"}))
+        match.set(href, "new.iso")
+        self.xml.remove_child(refs, match)
+        match.set(href, "old.iso")
+        self.assertEqual(None, self.xml.find_child(
+            refs, file_tag, attrib={href: "old.iso"}))
+
+    def test_add_child_ordering(self):
+        """Children are inserted according to the given ordering."""
+        parent = Element("parent")
+        ordering = ["a", "b", "c"]
+        for tag in ["c", "a", "b", "a", "c", "b"]:
+            self.xml.add_child(parent, Element(tag), ordering)
+        self.assertEqual([child.tag for child in parent],
+                         ["a", "a", "b", "b", "c", "c"])
+
+        # Children not in the ordering go after all children that are
+        self.xml.add_child(parent, Element("custom"), ordering)
+        self.xml.add_child(parent, Element("b"), ordering)
+        self.assertEqual([child.tag for child in parent],
+                         ["a", "a", "b", "b", "b", "c", "c", "custom"])
+
+        # Direct changes to the parent are detected
+        parent.remove(parent[0])
+        parent.insert(0, Element("c"))
+        parent[:] = sorted(parent, key=lambda child: child.tag)
+        self.xml.add_child(parent, Element("b"), ordering)
+        self.assertEqual([child.tag for child in parent],
+                         ["a", "b", "b", "b", "b", "c", "c", "c", "custom"])
+
+        # Out-of-order children: insert before the first later child
+        parent[:] = [Element(tag) for tag in ["a", "c", "a", "b"]]
+        self.xml.add_child(parent, Element("b"), ordering)
+        self.assertEqual([child.tag for child in parent],
+                         ["a", "b", "c", "a", "b"])
+
+    def test_reindent_dirty(self):
+        """Only changed subtrees are reindented when writing."""
+        refs = self.xml.find_child(self.xml.root, self.OVF + "References")
+        disks = self.xml.find_child(self.xml.root, self.OVF + "DiskSection")
+        # Mess up the formatting of both sections, but only change one
+        refs.text = disks.text = "\n"
+        self.xml.set_or_make_child(refs, self.OVF + "File",
+                                   attrib={self.OVF + "href": "new.txt"})
+        self.xml.reindent_dirty()
+        self.assertEqual(refs.text, "\n    ")
+        self.assertEqual(refs[-1].tail, "\n  ")
+        self.assertEqual(disks.text, "\n")
+
+        # Changes made directly must be marked as such
+        disks.append(Element(self.OVF + "Disk"))
+        self.xml.mark_dirty(disks)
+        self.xml.reindent_dirty()
+        self.assertEqual(disks.text, "\n    ")
+        self.assertEqual(disks[-2].tail, "\n    ")
+        self.assertEqual(disks[-1].tail, "\n  ")
+
+    def test_reindent_deep(self):
+        """Deeply nested XML can be reindented without recursion."""
+        elem = self.xml.root
+        for _ in range(sys.getrecursionlimit() + 100):
+            elem = SubElement(elem, "nested")
+        self.xml.mark_dirty(self.xml.root)
+        self.xml.reindent_dirty()
+        self.assertEqual(elem.tail, "\n" + " " * (2 * len(
+            list(self.xml.root.iter("nested"))) - 2))
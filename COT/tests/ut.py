@@ -67,6 +67,9 @@ logger = logging.getLogger(__name__)
 
 logging.getLogger('COT').addHandler(NullHandler())
 
+# Unit tests should never read or write the user's persistent digest cache.
+os.environ['COT_DIGEST_CACHE'] = ''
+
 
 class UTLoggingHandler(BufferingHandler):
     """Captures log messages to a buffer so we can inspect them for testing."""
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+#
+# verify.py - Implements "verify" sub-command
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Implements "verify" subcommand."""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os.path
+
+from .submodule import COTGenericSubmodule
+from .vm_context_manager import VMContextManager
+from .data_validation import InvalidInputError, ValueMismatchError
+from .http_file import is_url
+
+logger = logging.getLogger(__name__)
+
+
+class COTVerify(COTGenericSubmodule):
+    """Verify the contents of OVF packages against their manifests.
+
+    Inherited attributes:
+    :attr:`~COTGenericSubmodule.ui`
+
+    Attributes:
+    :attr:`package_list`
+    """
+
+    def __init__(self, ui):
+        """Instantiate this submodule with the given UI.
+
+        Args:
+          ui (UI): User interface instance.
+        """
+        super(COTVerify, self).__init__(ui)
+        self._package_list = None
+
+    @property
+    def package_list(self):
+        """List of VM definitions to verify."""
+        return self._package_list
+
+    @package_list.setter
+    def package_list(self, value):
+        for package in value:
+            if not is_url(package) and not os.path.exists(package):
+                raise InvalidInputError("Specified package {0} does not exist!"
+                                        .format(package))
+        self._package_list = value
+
+    def ready_to_run(self):
+        """Check whether the module is ready to :meth:`run`.
+
+        Returns:
+          tuple: ``(True, ready_message)`` or ``(False, reason_why_not)``
+        """
+        if not self.package_list:
+            return False, "At least one package must be specified"
+        return super(COTVerify, self).ready_to_run()
+
+    def run(self):
+        """Do the actual work of this submodule.
+
+        Raises:
+          InvalidInputError: if :func:`ready_to_run` reports ``False``
+          ValueMismatchError: if any package does not match its manifest.
+        """
+        super(COTVerify, self).run()
+
+        failed = []
+        # TODO: UI should provide an "output" method or similar,
+        #       so that we don't call print directly here.
+        for package in self.package_list:
+            with VMContextManager(package, None, lazy=True) as vm:
+                problems = vm.verify_manifest()
+            if problems is None:
+                print("{0}: no manifest to verify against".format(package))
+            elif not problems:
+                print("{0}: OK".format(package))
+            else:
+                print("{0}: FAILED".format(package))
+                for file_name in sorted(problems):
+                    print("  {0}: {1}".format(file_name, problems[file_name]))
+                failed.append(package)
+
+        if failed:
+            raise ValueMismatchError(
+                "{0} of {1} package(s) failed verification: {2}"
+                .format(len(failed), len(self.package_list),
+                        ", ".join(failed)))
+
+    def create_subparser(self):
+        """Create 'verify' CLI subparser."""
+        p = self.ui.add_subparser(
+            'verify',
+            aliases=['check-manifest'],
+            help="""Verify the contents of an OVF package""",
+            usage="""
+  cot verify --help
+  cot verify PACKAGE [PACKAGE ...]""",
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            description="""
+Check each file in the given OVF(s) and/or OVA(s) against the checksums
+recorded in the package manifest, if any. Files are checksummed directly
+from within an OVA, without extracting it, and the checksums of files that
+have not changed since COT last checksummed them are reused.""",
+            epilog=self.ui.fill_examples([
+                ("Verify a single OVA, reporting any mismatched files",
+                 'cot verify foo.ova'),
+                ("Verify several packages at once. The command fails if any"
+                 " of the given packages fails verification.",
+                 'cot verify foo.ova bar.ovf'),
+            ]),
+        )
+
+        p.add_argument('PACKAGE_LIST',
+                       nargs='+',
+                       metavar='PACKAGE [PACKAGE ...]',
+                       help="OVF descriptor(s) and/or OVA file(s) or URL(s) "
+                       "to verify")
+        p.set_defaults(instance=self)
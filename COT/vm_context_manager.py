@@ -40,12 +40,12 @@ class VMContextManager(object):
     For the parameters, see :class:`~COT.vm_description.VMDescription`.
     """
 
-    def __init__(self, input_file, output_file=None):
+    def __init__(self, input_file, output_file=None, lazy=False):
         """Create a VM instance.
 
-        For the parameters, see :class:`~COT.vm_description.VMDescription`.
+        For the parameters, see :meth:`~COT.vm_factory.VMFactory.create`.
         """
-        self.obj = VMFactory.create(input_file, output_file)
+        self.obj = VMFactory.create(input_file, output_file, lazy=lazy)
 
     def __enter__(self):
         """Use the VM instance as the context manager object."""
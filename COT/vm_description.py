@@ -53,6 +53,7 @@ class VMDescription(object):
 
       input_file
       output_file
+      working_dir
       platform
       config_profiles
       default_config_profile
@@ -89,8 +90,6 @@ class VMDescription(object):
     def __init__(self, input_file, output_file=None):
         """Read the given VM description file into memory.
 
-        Also creates a temporary directory as a working directory.
-
         Args:
           input_file (str): Data file to read in.
           output_file (str): File name to write to.
@@ -102,26 +101,39 @@ class VMDescription(object):
         """
         self._input_file = input_file
         self._product_class = None
-        self.working_dir = tempfile.mkdtemp(prefix="cot")
-        logger.verbose("Temporary directory for VM created from %s: %s",
-                       input_file, self.working_dir)
+        self._working_dir = None
         self._output_file = None
         self.output_file = output_file
-        atexit.register(self.destroy)
+
+    @property
+    def working_dir(self):
+        """Temporary directory for scratch files, created on first use.
+
+        Reading a VM description doesn't require any scratch space, so
+        read-only operations never create this directory. Once created,
+        it is deleted by :meth:`destroy` (or at exit, at the latest).
+        """
+        if self._working_dir is None:
+            self._working_dir = tempfile.mkdtemp(prefix="cot")
+            logger.verbose("Temporary directory for VM created from %s: %s",
+                           self.input_file, self._working_dir)
+            atexit.register(self.destroy)
+        return self._working_dir
 
     def destroy(self):
         """Clean up after ourselves.
 
-        Deletes :attr:`self.working_dir` and its contents.
+        Deletes :attr:`working_dir` and its contents, if it was created.
         """
-        try:
-            if hasattr(self,
-                       'working_dir') and os.path.exists(self.working_dir):
-                logger.debug("Removing temporary directory '%s'",
-                             self.working_dir)
-                shutil.rmtree(self.working_dir)
-        except AttributeError:
-            pass
+        working_dir = getattr(self, '_working_dir', None)
+        if working_dir is None:
+            return
+        if os.path.exists(working_dir):
+            logger.debug("Removing temporary directory '%s'", working_dir)
+            shutil.rmtree(working_dir)
+        # Python 3 only
+        if hasattr(atexit, 'unregister'):
+            atexit.unregister(self.destroy)
 
     def __del__(self):
         """Destructor. Call :meth:`destroy`."""
@@ -145,6 +157,16 @@ class VMDescription(object):
         """Write the VM description to :attr:`output_file`, if any."""
         raise NotImplementedError("write not implemented")
 
+    def verify_manifest(self):
+        """Check the files in the input package against its manifest, if any.
+
+        Returns:
+          dict: ``{file_name: problem_description}`` for each file that
+          failed verification (empty if all files were verified
+          successfully), or ``None`` if the package has no manifest.
+        """
+        raise NotImplementedError("verify_manifest not implemented")
+
     @property
     def product_class(self):
         """The product class identifier, such as com.cisco.csr1000v."""
@@ -29,12 +29,14 @@ class VMFactory(object):
     """Creates a VMDescription instance from a specified input file."""
 
     @classmethod
-    def create(cls, input_file, output_file):
+    def create(cls, input_file, output_file, lazy=False):
         """Create an appropriate VMDescription subclass instance from a file.
 
         Args:
           input_file (str): File to read VM description from
           output_file (str): File to write to when finished (optional)
+          lazy (bool): Defer loading parts of the VM description until
+              they are needed (see :class:`~COT.ovf.ovf.OVF`)
 
         Raises:
           VMInitError: if no appropriate class is identified
@@ -65,7 +67,7 @@ class VMFactory(object):
 
         logger.info("Loading '%s' as %s", input_file, vm_class.__name__)
         try:
-            vm = vm_class(input_file, output_file)
+            vm = vm_class(input_file, output_file, lazy=lazy)
         except ValueUnsupportedError as e:
             raise VMInitError(2, str(e), input_file)
         logger.debug("Loaded VM object from %s", input_file)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+#
+# xml_backend.py - Selection of the library used to handle XML
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Selection of the library used to parse, edit, and write XML.
+
+By default, the standard library's :mod:`xml.etree.ElementTree` is used.
+Set the ``COT_XML_BACKEND`` environment variable to ``lxml`` to use `lxml`_
+(version 4.5 or later) instead, if it is installed, as it parses and
+serializes XML in C and can evaluate XPath expressions natively. Both
+libraries provide the same ElementTree API for editing elements, which is
+exposed here as :data:`ET`; the functions in this module wrap the
+operations that they perform differently, and must be used to create new
+elements.
+
+As lxml elements can't be weakly referenced by default, COT parses and
+creates elements with its own lxml parser, which makes them instances of a
+subclass that can be. Other users of lxml in the same process are not
+affected. lxml's default limits on the size and nesting depth of the XML
+it parses are kept.
+
+Whichever library is used, COT's XML output is byte-for-byte identical.
+To this end, comments and processing instructions are discarded when
+parsing with lxml (as :mod:`xml.etree.ElementTree` always does), and XML
+is only serialized by lxml when its output is known to be the same as
+that of :mod:`xml.etree.ElementTree`; otherwise the latter is used.
+
+**Functions**
+
+.. autosummary::
+  :nosignatures:
+
+  Element
+  SubElement
+  fromstring
+  parse
+  register_namespace
+  tostring
+  write
+
+**Constants**
+
+.. autosummary::
+  BACKEND
+  ET
+  ParseError
+
+.. _lxml: http://lxml.de/
+"""
+
+import logging
+import os
+import sys
+import xml.etree.ElementTree as _STDLIB_ET
+
+logger = logging.getLogger(__name__)
+
+ET = _STDLIB_ET
+"""The ElementTree API module of the XML library in use."""
+
+# Name of the XML library in use, 'lxml' or 'ElementTree'
+BACKEND = 'ElementTree'
+
+if os.environ.get('COT_XML_BACKEND', 'ElementTree') == 'lxml':
+    try:
+        from lxml import etree as _LXML_ET
+        if hasattr(_LXML_ET, 'indent'):
+            ET = _LXML_ET
+            BACKEND = 'lxml'
+        else:
+            logger.debug("lxml is too old (4.5 or later is required); "
+                         "using ElementTree instead")
+    except ImportError:
+        logger.debug("lxml is not installed; using ElementTree instead")
+
+_PARSER = None
+if BACKEND == 'lxml':
+    class _Element(ET.ElementBase):
+        """lxml element that, unlike the default, can be weakly referenced.
+
+        :mod:`COT.xml_file` keeps per-element lookup tables that must not
+        keep the elements alive.
+        """
+
+        __slots__ = ('__weakref__',)
+
+    # Elements parsed or created by this parser, or added beneath them,
+    # are instances of the above class
+    _PARSER = ET.XMLParser(remove_comments=True, remove_pis=True,
+                           resolve_entities=False)
+    _PARSER.set_element_class_lookup(ET.ElementDefaultClassLookup(
+        element=_Element))
+
+# Exception raised by parse() if the XML is not well-formed
+# pylint: disable=invalid-name
+if BACKEND == 'lxml':
+    ParseError = ET.XMLSyntaxError
+else:
+    # In 2.7+, ET raises a ParseError if XML parsing fails,
+    # but in 2.6 it raises an ExpatError. Hide this variation.
+    try:
+        from xml.etree.ElementTree import ParseError
+    except ImportError:
+        from xml.parsers.expat import ExpatError as ParseError  # noqa
+
+# XML declaration written by ElementTree, which lxml writes identically
+_XML_DECLARATION = b"<?xml version='1.0' encoding='utf-8'?>\n"
+
+
+def register_namespace(prefix, uri):
+    """Record a particular mapping between a namespace prefix and URI.
+
+    Args:
+      prefix (str): Namespace prefix such as "ovf"
+      uri (str): Namespace URI such as "http://schemas.dmtf.org/ovf/envelope/1"
+    """
+    # The standard library's mapping is also needed by lxml, see write()
+    try:
+        _STDLIB_ET.register_namespace(prefix, uri)
+    except AttributeError:
+        # 2.6 doesn't have the above API so we must write directly
+        _STDLIB_ET._namespace_map[uri] = prefix  # pylint: disable=W0212
+    if BACKEND == 'lxml':
+        ET.register_namespace(prefix, uri)
+
+
+def parse(xml_file):
+    """Parse the given XML file.
+
+    Args:
+      xml_file (str): File path to read, or an open file object to
+          read from.
+    Returns:
+      ElementTree: Parsed XML tree.
+    Raises:
+      ParseError: if parsing fails
+    """
+    if BACKEND == 'lxml':
+        return ET.parse(xml_file, _PARSER)
+    return ET.parse(xml_file)
+
+
+def fromstring(text):
+    """Parse the given XML string.
+
+    Args:
+      text (str): XML string to parse.
+    Returns:
+      Element: Root element of the parsed XML.
+    Raises:
+      ParseError: if parsing fails
+    """
+    if BACKEND == 'lxml':
+        return ET.fromstring(text, _PARSER)
+    return ET.fromstring(text)
+
+
+def Element(tag, attrib=None):  # pylint: disable=invalid-name
+    """Create a new element.
+
+    Args:
+      tag (str): Element tag.
+      attrib (dict): Element attributes.
+    Returns:
+      Element: New element.
+    """
+    if BACKEND == 'lxml':
+        return _PARSER.makeelement(tag, attrib or {})
+    return ET.Element(tag, attrib or {})
+
+
+def SubElement(parent, tag, attrib=None):  # pylint: disable=invalid-name
+    """Create a new element as the last child of the given element.
+
+    Args:
+      parent (Element): Parent element.
+      tag (str): Element tag.
+      attrib (dict): Element attributes.
+    Returns:
+      Element: New element.
+    """
+    child = Element(tag, attrib)
+    parent.append(child)
+    return child
+
+
+def _to_stdlib(element):
+    """Convert an lxml element to an :mod:`xml.etree.ElementTree` element.
+
+    Args:
+      element (lxml.etree._Element): Element to convert.
+    Returns:
+      xml.etree.ElementTree.Element: Equivalent element.
+    """
+    result = _STDLIB_ET.fromstring(ET.tostring(element, with_tail=False))
+    result.tail = element.tail
+    return result
+
+
+def tostring(element):
+    """Get the XML string representing the given element and its children.
+
+    Args:
+      element (Element): Element to represent.
+    Returns:
+      str: XML string, as :func:`xml.etree.ElementTree.tostring` gives it.
+    """
+    if BACKEND == 'lxml':
+        element = _to_stdlib(element)
+    if sys.version_info[0] >= 3:
+        return _STDLIB_ET.tostring(element, encoding='unicode')
+    return _STDLIB_ET.tostring(element)
+
+
+def _lxml_serialize(root):
+    """Serialize the given tree with lxml if the output would be unchanged.
+
+    :mod:`xml.etree.ElementTree` declares every namespace used anywhere in
+    the tree on the root element, using the registered prefix for each
+    namespace, in order of prefix; its attributes are in document order
+    (under Python 3.8 and later); and it writes empty elements as
+    ``<tag />``. lxml's output is only used if, once unused namespace
+    declarations are removed, it can be made identical.
+
+    Args:
+      root (lxml.etree._Element): Root element of the tree.
+    Returns:
+      bytes: Serialized XML, or ``None`` if lxml can't be used.
+    """
+    if sys.version_info < (3, 8):
+        # ElementTree sorts attributes by name
+        return None
+    ET.cleanup_namespaces(root)
+    nsmap = root.nsmap
+    namespace_map = _STDLIB_ET._namespace_map  # pylint: disable=W0212
+    if any(prefix is None or namespace_map.get(uri) != prefix
+           for (prefix, uri) in nsmap.items()):
+        return None
+    start_tag = "<{0}{1}".format(
+        root.prefix + ":" + ET.QName(root).localname if root.prefix
+        else root.tag,
+        "".join(' xmlns:{0}="{1}"'.format(prefix, nsmap[prefix])
+                for prefix in sorted(nsmap))).encode('utf-8')
+    data = ET.tostring(root, xml_declaration=True, encoding='utf-8')
+    if not data.startswith(_XML_DECLARATION + start_tag):
+        return None
+    if b" xmlns" in data[len(_XML_DECLARATION + start_tag):]:
+        # Namespace declared below the root element
+        return None
+    if b"&#13;" in data:
+        # ElementTree doesn't escape carriage returns in text
+        return None
+    # As ElementTree and lxml escape all '>' and tab characters in text and
+    # attribute values, these can only be the end of an empty-element tag or
+    # an escaped tab, respectively.
+    return data.replace(b"/>", b" />").replace(b"&#9;", b"&#09;")
+
+
+def write(tree, xml_file):
+    """Write the given XML tree out to the given file, in UTF-8.
+
+    Args:
+      tree (ElementTree): XML tree to write.
+      xml_file (str): File path to write to, or an open file object to
+          write to.
+    """
+    if BACKEND == 'lxml':
+        root = tree.getroot()
+        data = _lxml_serialize(root)
+        if data is not None:
+            if hasattr(xml_file, 'write'):
+                xml_file.write(data)
+            else:
+                with open(xml_file, 'wb') as file_obj:
+                    file_obj.write(data)
+            return
+        logger.debug("Serializing XML with ElementTree for identical output")
+        tree = _STDLIB_ET.ElementTree(_to_stdlib(root))
+
+    if sys.hexversion >= 0x02070000:
+        tree.write(xml_file, xml_declaration=True, encoding='utf-8')
+    else:
+        # 2.6 doesn't have the xml_declaration parameter. Sigh.
+        tree.write(xml_file, encoding='utf-8')
@@ -14,28 +14,153 @@
 # of COT, including this file, may be copied, modified, propagated, or
 # distributed except according to the terms contained in the LICENSE.txt file.
 
-"""Reading, editing, and writing XML files."""
+"""Reading, editing, and writing XML files.
 
-import xml.etree.ElementTree as ET
+The XML library used is selected by :mod:`COT.xml_backend`.
+"""
+
+import bisect
+import collections
 import logging
 import re
-import sys
+import weakref
+
+from COT.xml_backend import BACKEND, ET, Element, parse, tostring, write
+from COT.xml_backend import register_namespace   # noqa
 
 logger = logging.getLogger(__name__)
 
+# {parent element: {child tag: _ChildIndex}}, see XML.index_children()
+_CHILD_INDEXES = weakref.WeakKeyDictionary()
+
+# {element: True} for elements whose children have changed since the
+# tree was last written, see XML.mark_dirty()
+_DIRTY = weakref.WeakKeyDictionary()
+
+# {tuple(ordering): {tag: rank}}, see XML.add_child()
+_ORDERING_RANKS = {}
+
+# {parent element: (rank map, [rank of each child])}, see XML.add_child()
+_CHILD_RANKS = weakref.WeakKeyDictionary()
 
-def register_namespace(prefix, uri):
-    """Record a particular mapping between a namespace prefix and URI.
+if BACKEND == 'lxml':
+    # lxml creates Python objects for its elements on demand and discards
+    # them when no longer referenced, so the dirty marks must be held
+    # strongly until the tree is written out. (The other tables only cache
+    # what can be recomputed.)
+    _DIRTY = {}
+
+# {(tag, attribute names): XPath}, see XML._find_xpath()
+_FIND_XPATHS = {}
+
+
+def _xpath_name(name, namespaces):
+    """Get the XPath name test for the given tag or attribute name.
 
     Args:
-      prefix (str): Namespace prefix such as "ovf"
-      uri (str): Namespace URI such as "http://schemas.dmtf.org/ovf/envelope/1"
+      name (str): Name, such as "{http://schemas.dmtf.org/ovf/envelope/1}Info"
+      namespaces (dict): ``{prefix: URI}`` mapping to add the name's
+          namespace to, under an arbitrary prefix, if not already present.
+    Returns:
+      str: Qualified name, such as "n0:Info"
+    """
+    match = re.match(r"\{(.*)\}(.*)", name)
+    if not match:
+        return name
+    (uri, local) = match.groups()
+    for (prefix, known_uri) in namespaces.items():
+        if known_uri == uri:
+            return prefix + ":" + local
+    prefix = "n{0}".format(len(namespaces))
+    namespaces[prefix] = uri
+    return prefix + ":" + local
+
+
+class _ChildIndex(object):
+    """Lookup table of the children of an element with a given tag.
+
+    Maps the values of each of the given attributes to the children having
+    that attribute value. Built on demand, and rebuilt whenever the number
+    of children of the parent has changed behind its back.
     """
-    try:
-        ET.register_namespace(prefix, uri)
-    except AttributeError:
-        # 2.6 doesn't have the above API so we must write directly
-        ET._namespace_map[uri] = prefix  # pylint: disable=protected-access
+
+    def __init__(self, tag, keys):
+        """Create an (as yet unbuilt) index.
+
+        Args:
+          tag (str): Child tag to index
+          keys (list): Attribute names to index children by
+        """
+        self.tag = tag
+        self.keys = tuple(keys)
+        self.tables = None
+        self.count = None
+
+    def build(self, parent):
+        """(Re)build the index from the current children of the parent.
+
+        Args:
+          parent (xml.etree.ElementTree.Element): Parent element
+        """
+        self.tables = dict((key, {}) for key in self.keys)
+        for child in parent.findall(self.tag):
+            self.add(child)
+        self.count = len(parent)
+
+    def add(self, child):
+        """Add the given child to the index.
+
+        Args:
+          child (xml.etree.ElementTree.Element): Child element
+        """
+        for key in self.keys:
+            value = child.get(key)
+            if value is not None:
+                self.tables[key].setdefault(value, []).append(child)
+
+    def discard(self, child):
+        """Remove the given child from the index.
+
+        The child is looked for under its current attribute values only.
+
+        Args:
+          child (xml.etree.ElementTree.Element): Child element
+        Returns:
+          bool: False if the child was not found where expected, as its
+          attributes have changed since it was indexed.
+        """
+        found = True
+        for key in self.keys:
+            value = child.get(key)
+            if value is None:
+                continue
+            children = self.tables[key].get(value, [])
+            if child in children:
+                children.remove(child)
+                if not children:
+                    del self.tables[key][value]
+            else:
+                found = False
+        return found
+
+    def lookup(self, parent, key, value):
+        """Look up the children having the given attribute value.
+
+        Args:
+          parent (xml.etree.ElementTree.Element): Parent element
+          key (str): Indexed attribute name
+          value (str): Attribute value to look for
+        Returns:
+          list: Matching child elements, in document order.
+        """
+        if self.tables is None or self.count != len(parent):
+            self.build(parent)
+        matches = [child for child in self.tables[key].get(value, ())
+                   if child.get(key) == value]
+        if len(matches) > 1:
+            matches = [child for child in parent.findall(self.tag)
+                       if child in matches]
+        return matches
 
 
 class XML(object):
@@ -82,15 +207,14 @@ class XML(object):
         :attr:`root`.
 
         Args:
-          xml_file (str): File path to read.
+          xml_file (str): File path to read, or an open file object to
+              read from.
 
         Raises:
-          xml.etree.ElementTree.ParseError: if parsing fails under Python
-              2.7 or later
-          xml.parsers.expat.ExpatError: if parsing fails under Python 2.6
+          COT.xml_backend.ParseError: if parsing fails
         """
         # Parse the XML into memory
-        self.tree = ET.parse(xml_file)
+        self.tree = parse(xml_file)
         """:class:`xml.etree.ElementTree.ElementTree` describing this file."""
         self.root = self.tree.getroot()
         """Root :class:`xml.etree.ElementTree.Element` instance of the tree."""
@@ -98,13 +222,19 @@ class XML(object):
     def write_xml(self, xml_file):
         """Write pretty XML out to the given file.
 
+        Only the parts of the tree that have changed (see :meth:`mark_dirty`)
+        are reindented; the rest retains its existing formatting.
+
         Args:
           xml_file (str): Filename to write to
         """
         logger.debug("Writing XML to %s", xml_file)
 
         # Pretty-print the XML for readability
-        self.xml_reindent(self.root, 0)
+        self.reindent_dirty()
+        if len(self.root):
+            # Add newline at end of file
+            self.root.tail = "\n"
 
         # We could make cleaner XML by passing "default_namespace=NSM['ovf']",
         # which will leave off the "ovf:" prefix on elements and attributes in
@@ -116,37 +246,213 @@ class XML(object):
         # option
         #
         # This is a bug - see http://bugs.python.org/issue17088
-        if sys.hexversion >= 0x02070000:
-            self.tree.write(xml_file, xml_declaration=True, encoding='utf-8')
-        else:
-            # 2.6 doesn't have the xml_declaration parameter. Sigh.
-            self.tree.write(xml_file, encoding='utf-8')
+        write(self.tree, xml_file)
+
+    @staticmethod
+    def mark_dirty(element):
+        """Note that the children of the given element have been changed.
+
+        The element and its descendants will be reindented the next time the
+        tree is written out. :meth:`add_child`, :meth:`set_or_make_child`, and
+        :meth:`remove_child` do this automatically; anything that otherwise
+        adds, removes, or clears child elements must call this.
+
+        Args:
+          element (xml.etree.ElementTree.Element): Element that has changed
+        """
+        _DIRTY[element] = True
+
+    def reindent_dirty(self):
+        """Reindent all subtrees of this tree that have changed.
+
+        The tree is searched breadth-first, so that finding changed sections
+        near the top of the tree does not require examining every element
+        of large unchanged sections below them.
+        """
+        if BACKEND == 'lxml':
+            self._reindent_dirty_lxml()
+            return
+        queue = collections.deque([(self.root, 0)])
+        count = 0
+        while queue and _DIRTY:
+            (elem, depth) = queue.popleft()
+            if elem in _DIRTY:
+                count += 1
+                self.xml_reindent(elem, depth)
+            else:
+                queue.extend((child, depth + 2) for child in elem)
+        logger.debug("Reindented %d changed subtree(s)", count)
+
+    def _reindent_dirty_lxml(self):
+        """Reindent all subtrees of this tree that have changed, using lxml.
+
+        Helper method for :meth:`reindent_dirty`. As each lxml element knows
+        its ancestors, the changed elements are visited directly instead of
+        searching the tree for them.
+        """
+        count = 0
+        for elem in [e for e in _DIRTY
+                     if e.getroottree().getroot() is self.root]:
+            if elem not in _DIRTY:
+                # Already reindented along with an ancestor
+                continue
+            ancestors = list(elem.iterancestors())
+            if any(ancestor in _DIRTY for ancestor in ancestors):
+                # Will be reindented along with its ancestor
+                continue
+            count += 1
+            self.xml_reindent(elem, 2 * len(ancestors))
+        logger.debug("Reindented %d changed subtree(s)", count)
 
     def xml_reindent(self, parent, depth):
-        """Recursively add indentation to XML to make it look nice.
+        """Add indentation to XML to make it look nice.
+
+        Walks the subtree iteratively, so that deeply nested XML cannot
+        exceed Python's recursion limit. Only whitespace between elements
+        is replaced; any other text is left as-is.
 
         Args:
-          parent (xml.etree.ElementTree.Element): Current parent element
-          depth (int): How far down the rabbit hole we have recursed.
+          parent (xml.etree.ElementTree.Element): Root of subtree to indent
+          depth (int): Indentation of ``parent`` itself.
               Increments by 2 for each successive level of nesting.
         """
-        depth += 2
-        last = None
-        for elem in list(parent):
-            elem.tail = "\n" + (" " * depth)
-            self.xml_reindent(elem, depth)
-            last = elem
-
-        if last is not None:
-            # Parent indents to first child
-            parent.text = "\n" + (" " * depth)
-            # Last element indents back to parent
-            depth -= 2
-            last.tail = "\n" + (" " * depth)
-
-        if depth == 0:
+        if depth == 0 and len(parent):
             # Add newline at end of file
             parent.tail = "\n"
+        if BACKEND == 'lxml':
+            # Same result, in C
+            ET.indent(parent, space="  ", level=depth // 2)
+            for elem in [e for e in _DIRTY
+                         if e is parent or parent in e.iterancestors()]:
+                del _DIRTY[elem]
+            return
+        stack = [(parent, depth)]
+        while stack:
+            (elem, depth) = stack.pop()
+            _DIRTY.pop(elem, None)
+            children = list(elem)
+            if not children:
+                continue
+            # Parent indents to first child, each child to the next
+            indent = "\n" + (" " * (depth + 2))
+            if not (elem.text and elem.text.strip()):
+                elem.text = indent
+            for child in children:
+                if not (child.tail and child.tail.strip()):
+                    child.tail = indent
+                stack.append((child, depth + 2))
+            # Last element indents back to parent
+            if not (children[-1].tail and children[-1].tail.strip()):
+                children[-1].tail = "\n" + (" " * depth)
+
+    @staticmethod
+    def index_children(parent, tag, keys):
+        """Speed up lookups of the children of an element by attribute value.
+
+        Once a parent element is indexed, :meth:`find_child`,
+        :meth:`find_all_children` and :meth:`set_or_make_child` look up
+        its ``tag`` children by any of the given attributes in constant
+        time, rather than by examining every child in turn. This is
+        worthwhile for elements that may have a great many children, such
+        as the ``References`` or ``ProductSection`` of an OVF.
+
+        The index is kept up to date by :meth:`add_child`,
+        :meth:`set_or_make_child` and :meth:`remove_child`, and is rebuilt
+        automatically if children are otherwise added or removed. If an
+        indexed attribute of an existing child is changed directly,
+        :meth:`invalidate_index` must be called.
+
+        Args:
+          parent (xml.etree.ElementTree.Element): Parent element
+          tag (str): Child tag to index
+          keys (list): Attribute names to index children by
+        """
+        indexes = _CHILD_INDEXES.setdefault(parent, {})
+        if tag not in indexes or indexes[tag].keys != tuple(keys):
+            indexes[tag] = _ChildIndex(tag, keys)
+
+    @staticmethod
+    def invalidate_index(parent):
+        """Rebuild any index of the given element's children when next used.
+
+        Args:
+          parent (xml.etree.ElementTree.Element): Parent element
+        """
+        for index in _CHILD_INDEXES.get(parent, {}).values():
+            index.tables = None
+
+    @staticmethod
+    def _find_indexed(parent, tag, attrib):
+        """Look up children using an index, if one is available.
+
+        Helper method for :meth:`find_all_children`.
+
+        Args:
+          parent (xml.etree.ElementTree.Element): Parent element
+          tag (str): Child tag to match on
+          attrib (dict): Child attributes to match on
+        Returns:
+          list: Children matching at least one of the attributes, or
+          ``None`` if none of the attributes are indexed.
+        """
+        index = _CHILD_INDEXES.get(parent, {}).get(tag)
+        if index is None or not attrib:
+            return None
+        for key in index.keys:
+            if key in attrib:
+                return index.lookup(parent, key, attrib[key])
+        return None
+
+    @staticmethod
+    def _update_index(parent, child, added):
+        """Record the addition or removal of a child in any index.
+
+        Args:
+          parent (xml.etree.ElementTree.Element): Parent element
+          child (xml.etree.ElementTree.Element): Child element
+          added (bool): True if the child was added, False if removed.
+        """
+        index = _CHILD_INDEXES.get(parent, {}).get(child.tag)
+        if index is None or index.tables is None:
+            return
+        if index.count != len(parent) + (-1 if added else 1):
+            # Something else changed too; start over
+            index.tables = None
+            return
+        if added:
+            index.add(child)
+        elif not index.discard(child):
+            # It may still be indexed under an old attribute value
+            index.tables = None
+            return
+        index.count = len(parent)
+
+    @staticmethod
+    def _find_xpath(tag, attrib):
+        """Get a compiled XPath finding children by tag and attribute values.
+
+        Helper method for :meth:`find_all_children` under lxml, for lookups
+        that are not indexed (see :meth:`index_children`). The XPath is
+        compiled once for each tag and set of attribute names; the attribute
+        values are passed to it as variables ``$v0``, ``$v1``, etc., in the
+        order of ``attrib``.
+
+        Args:
+          tag (str): Child tag to match on
+          attrib (dict): Child attributes to match on
+        Returns:
+          lxml.etree.XPath: XPath returning the matching children.
+        """
+        keys = tuple(attrib.keys()) if attrib else ()
+        xpath = _FIND_XPATHS.get((tag, keys))
+        if xpath is None:
+            namespaces = {}
+            path = _xpath_name(tag, namespaces) + "".join(
+                "[@{0}=$v{1}]".format(_xpath_name(key, namespaces), i)
+                for (i, key) in enumerate(keys))
+            xpath = ET.XPath(path, namespaces=namespaces)
+            _FIND_XPATHS[(tag, keys)] = xpath
+        return xpath
 
     @classmethod
     def find_child(cls, parent, tag, attrib=None, required=False):
@@ -173,7 +479,7 @@ class XML(object):
                 .format(XML.strip_ns(tag),
                         attrib,
                         XML.strip_ns(parent.tag),
-                        "\n".join([ET.tostring(e).decode() for e in matches])))
+                        "\n".join([tostring(e) for e in matches])))
         elif len(matches) == 0:
             if required:
                 raise KeyError("Mandatory element <{0}> not found under <{1}>"
@@ -197,7 +503,14 @@ class XML(object):
         """
         assert parent is not None
         if isinstance(tag, str):
-            elements = parent.findall(tag)
+            elements = cls._find_indexed(parent, tag, attrib)
+            if (elements is None and BACKEND == 'lxml' and
+                    all(isinstance(v, str) for v in (attrib or {}).values())):
+                elements = cls._find_xpath(tag, attrib)(parent, **dict(
+                    ("v{0}".format(i), value) for (i, value)
+                    in enumerate(attrib.values() if attrib else ())))
+            elif elements is None:
+                elements = parent.findall(tag)
             label = tag
         else:
             elements = []
@@ -243,7 +556,7 @@ class XML(object):
               warning **if and only if** the unaccounted-for tag is in a
               known namespace.
         """
-        if ordering and new_child.tag not in ordering:
+        if ordering and new_child.tag not in cls._rank_map(ordering):
             if (known_namespaces and
                     (XML.get_ns(new_child.tag) in known_namespaces)):
                 logger.warning("New child '%s' is not in the list of "
@@ -258,30 +571,117 @@ class XML(object):
         if not ordering:
             parent.append(new_child)
         else:
-            new_index = ordering.index(new_child.tag)
-            i = 0
-            found_position = False
-            for child in list(parent):
-                try:
-                    if ordering.index(child.tag) > new_index:
-                        found_position = True
-                        break
-                except ValueError:
-                    if (known_namespaces and (XML.get_ns(child.tag) in
-                                              known_namespaces)):
-                        logger.warning(
-                            "Existing child element '%s' is not in expected "
-                            "list of children under '%s': \n%s",
-                            child.tag, XML.strip_ns(parent.tag), ordering)
-                    # Assume this is some sort of custom element - all known
-                    # elements should implicitly come before it.
-                    found_position = True
-                    break
-                i += 1
-            if found_position:
-                parent.insert(i, new_child)
-            else:
-                parent.append(new_child)
+            cls._insert_ordered(parent, new_child, ordering, known_namespaces)
+        cls._update_index(parent, new_child, True)
+        cls.mark_dirty(parent)
+
+    @staticmethod
+    def _rank_map(ordering):
+        """Get the position of each tag in the given ordering.
+
+        Args:
+          ordering (list): See :meth:`add_child`
+        Returns:
+          dict: ``{tag: rank}``, computed once for each distinct ordering.
+        """
+        key = tuple(ordering)
+        rank_map = _ORDERING_RANKS.get(key)
+        if rank_map is None:
+            rank_map = {}
+            for (rank, tag) in enumerate(key):
+                rank_map.setdefault(tag, rank)
+            _ORDERING_RANKS[key] = rank_map
+        return rank_map
+
+    @staticmethod
+    def _child_ranks(parent, ordering, rank_map, refresh=False):
+        """Get the rank of each child of the parent in the given ordering.
+
+        Children not in the ordering rank after all children that are.
+        If the children are correctly ordered, the result is cached until
+        the number of children changes behind our back.
+
+        Args:
+          parent (xml.etree.ElementTree.Element): Parent element
+          ordering (list): See :meth:`add_child`
+          rank_map (dict): See :meth:`_rank_map`
+          refresh (bool): Recompute the ranks even if cached.
+        Returns:
+          tuple: ``(ranks, is_sorted)``
+        """
+        cached = _CHILD_RANKS.get(parent)
+        if (not refresh and cached is not None and cached[0] is rank_map and
+                len(cached[1]) == len(parent)):
+            return (cached[1], True)
+        unknown = len(ordering)
+        ranks = [rank_map.get(child.tag, unknown) for child in parent]
+        is_sorted = all(ranks[i] <= ranks[i + 1]
+                        for i in range(len(ranks) - 1))
+        if is_sorted:
+            _CHILD_RANKS[parent] = (rank_map, ranks)
+        else:
+            _CHILD_RANKS.pop(parent, None)
+        return (ranks, is_sorted)
+
+    @classmethod
+    def _insert_ordered(cls, parent, new_child, ordering, known_namespaces):
+        """Insert the given child after all children that precede it.
+
+        Helper method for :meth:`add_child`. The insertion point is found
+        by bisection over the (cached) ranks of the existing children, so
+        repeatedly adding children to the same parent is not quadratic.
+
+        Args:
+          parent (xml.etree.ElementTree.Element): Parent element
+          new_child (xml.etree.ElementTree.Element): Child element to attach
+          ordering (list): See :meth:`add_child`
+          known_namespaces (list): See :meth:`add_child`
+        """
+        rank_map = cls._rank_map(ordering)
+        unknown = len(ordering)
+        new_rank = rank_map[new_child.tag]
+
+        def _rank(i):
+            """Rank of the child currently at the given position."""
+            return rank_map.get(parent[i].tag, unknown)
+
+        (ranks, is_sorted) = cls._child_ranks(parent, ordering, rank_map)
+        if is_sorted:
+            i = bisect.bisect_right(ranks, new_rank)
+            # Make sure the children haven't been swapped behind our back
+            if ((i > 0 and _rank(i - 1) != ranks[i - 1]) or
+                    (i < len(ranks) and _rank(i) != ranks[i])):
+                (ranks, is_sorted) = cls._child_ranks(parent, ordering,
+                                                      rank_map, refresh=True)
+        if is_sorted:
+            i = bisect.bisect_right(ranks, new_rank)
+        else:
+            i = next((j for (j, rank) in enumerate(ranks) if rank > new_rank),
+                     len(ranks))
+
+        if (i < len(ranks) and ranks[i] == unknown and known_namespaces and
+                XML.get_ns(parent[i].tag) in known_namespaces):
+            logger.warning(
+                "Existing child element '%s' is not in expected "
+                "list of children under '%s': \n%s",
+                parent[i].tag, XML.strip_ns(parent.tag), ordering)
+        # Assume that any custom element not in the ordering should come
+        # after all known elements.
+        parent.insert(i, new_child)
+        if is_sorted:
+            ranks.insert(i, new_rank)
+
+    @classmethod
+    def remove_child(cls, parent, child):
+        """Remove the given child element from the given parent element.
+
+        Args:
+          parent (xml.etree.ElementTree.Element): Parent element
+          child (xml.etree.ElementTree.Element): Child element to remove
+        """
+        parent.remove(child)
+        cls._update_index(parent, child, False)
+        cls.mark_dirty(parent)
 
     @classmethod
     def set_or_make_child(cls, parent, tag, text=None, attrib=None,
@@ -307,7 +707,7 @@ class XML(object):
         if element is None:
             logger.debug("Creating new %s under %s",
                          XML.strip_ns(tag), XML.strip_ns(parent.tag))
-            element = ET.Element(tag)
+            element = Element(tag, attrib)
             XML.add_child(parent, element, ordering, known_namespaces)
         if text is not None:
             element.text = str(text)
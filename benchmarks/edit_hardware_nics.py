@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# edit_hardware_nics.py - Time adding many NICs to a multi-profile OVF
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Time adding increasing numbers of NICs to a multi-profile OVF.
+
+The CSR1000V descriptor from COT's unit tests, which has three hardware
+configuration profiles, is opened and the NIC count is set across all
+profiles, as ``cot edit-hardware --nics N`` does, for increasing ``N``.
+Each added NIC is a clone of the previous one, so the time taken per added
+NIC should stay roughly constant as ``N`` grows.
+
+The CSR1000V platform only supports up to 26 NICs, so the platform's
+validation of the NIC count is bypassed here.
+
+With ``--deepcopy``, items are cloned with :func:`copy.deepcopy`, as COT
+formerly did, for comparison.
+
+Usage::
+
+  python benchmarks/edit_hardware_nics.py [--deepcopy] [N ...]
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
+import os
+import sys
+import time
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DESCRIPTOR = os.path.join(TOP_DIR, 'COT', 'tests', 'csr1000v.ovf')
+
+COUNTS = [8, 16, 32, 64]
+
+
+def time_nic_count(count):
+    """Time setting the NIC count of the CSR1000V descriptor.
+
+    Args:
+      count (int): Number of NICs to have under each profile.
+    Returns:
+      tuple: ``(nics_added, seconds)``
+    """
+    from COT.ovf import OVF
+
+    vm = OVF(DESCRIPTOR, None)
+    try:
+        before = vm.hardware.get_item_count('ethernet', None)
+        start = time.time()
+        vm.hardware.set_item_count_per_profile('ethernet', count, None)
+        elapsed = time.time() - start
+        counts = vm.hardware.get_item_count_per_profile(
+            'ethernet', vm.config_profiles + [None])
+        assert set(counts.values()) == set([count]), counts
+    finally:
+        vm.destroy()
+    return (count - before, elapsed)
+
+
+def main():
+    """Time setting each requested NIC count."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--deepcopy', action='store_true',
+                        help="Clone items with copy.deepcopy()")
+    parser.add_argument('counts', type=int, nargs='*', default=COUNTS,
+                        metavar='N', help="NIC counts to time")
+    args = parser.parse_args()
+
+    sys.path.insert(0, TOP_DIR)
+    if args.deepcopy:
+        from COT.ovf.item import OVFItem
+        OVFItem.clone = copy.deepcopy
+
+    print("{0:>6} {1:>6} {2:>10} {3:>12}".format(
+        "NICs", "added", "seconds", "ms per NIC"))
+    for count in args.counts:
+        (added, elapsed) = time_nic_count(count)
+        print("{0:>6} {1:>6} {2:>10.3f} {3:>12.2f}".format(
+            count, added, elapsed, 1000.0 * elapsed / max(added, 1)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
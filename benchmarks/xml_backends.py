@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+#
+# xml_backends.py - Compare the speed of COT's XML backends
+#
+# March 2017, Glenn F. Matthews
+# Copyright (c) 2017 the COT project developers.
+# See the COPYRIGHT.txt file at the top-level directory of this distribution
+# and at https://github.com/glennmatthews/cot/blob/master/COPYRIGHT.txt.
+#
+# This file is part of the Common OVF Tool (COT) project.
+# It is subject to the license terms in the LICENSE.txt file found in the
+# top-level directory of this distribution and at
+# https://github.com/glennmatthews/cot/blob/master/LICENSE.txt. No part
+# of COT, including this file, may be copied, modified, propagated, or
+# distributed except according to the terms contained in the LICENSE.txt file.
+
+"""Compare the speed of COT's XML backends on scaled-up OVF descriptors.
+
+Each of the OVF descriptors shipped with COT's unit tests is scaled up by
+duplicating its ``File``, ``Disk``, ``Property`` and hardware ``Item``
+elements (with unique identifiers), then each available backend (see
+:mod:`COT.xml_backend`) is timed, in a separate process, as it:
+
+* parses the descriptor,
+* looks up every file, disk, and property by its identifier,
+* adds a new file, disk, and property to each section, and
+* reindents the changed sections and writes the descriptor out.
+
+The output of each backend is checked to be identical.
+
+Usage::
+
+  python benchmarks/xml_backends.py [--scale N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as STDLIB_ET
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = os.path.join(TOP_DIR, 'COT', 'tests')
+
+DESCRIPTORS = ['input.ovf', 'csr1000v.ovf', 'iosv.ovf', 'vmware.ovf']
+
+OVF = "{http://schemas.dmtf.org/ovf/envelope/1}"
+RASD = ("{http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/"
+        "CIM_ResourceAllocationSettingData}")
+
+# (section tag, child tag, identifying attribute) for each scaled section
+SECTIONS = [
+    (OVF + 'References', OVF + 'File', OVF + 'id'),
+    (OVF + 'DiskSection', OVF + 'Disk', OVF + 'diskId'),
+    (OVF + 'ProductSection', OVF + 'Property', OVF + 'key'),
+]
+
+
+def namespaces(xml_file):
+    """Get the namespace prefixes declared in the given file.
+
+    Args:
+      xml_file (str): XML file to examine.
+    Returns:
+      dict: ``{prefix: URI}``
+    """
+    return dict(ns for (_, ns) in STDLIB_ET.iterparse(xml_file,
+                                                      events=('start-ns',)))
+
+
+def scale_descriptor(src, dest, scale):
+    """Write a scaled-up copy of the given OVF descriptor.
+
+    Args:
+      src (str): OVF descriptor to read.
+      dest (str): Path to write the scaled-up descriptor to.
+      scale (int): Number of copies to make of each scaled element.
+    """
+    for (prefix, uri) in namespaces(src).items():
+        STDLIB_ET.register_namespace(prefix, uri)
+    tree = STDLIB_ET.parse(src)
+    for (section_tag, child_tag, key) in SECTIONS:
+        for section in tree.iter(section_tag):
+            children = section.findall(child_tag)
+            for i in range(1, scale):
+                for child in children:
+                    clone = copy.deepcopy(child)
+                    clone.set(key, "{0}-{1}".format(child.get(key), i))
+                    section.append(clone)
+    for section in tree.iter(OVF + 'VirtualHardwareSection'):
+        items = section.findall(OVF + 'Item')
+        for i in range(1, scale):
+            for item in items:
+                clone = copy.deepcopy(item)
+                instance = clone.find(RASD + 'InstanceID')
+                instance.text = "{0}{1:04d}".format(instance.text, i)
+                section.append(clone)
+    tree.write(dest, xml_declaration=True, encoding='utf-8')
+
+
+def run_worker(xml_file, output):
+    """Time the XML operations under the backend in use, and report.
+
+    Prints a JSON dictionary of timings (in seconds) and the SHA-1 digest
+    of the output.
+
+    Args:
+      xml_file (str): Scaled-up descriptor to read.
+      output (str): Path to write the modified descriptor to.
+    """
+    from COT.xml_backend import BACKEND, Element, register_namespace
+    from COT.xml_file import XML
+
+    for (prefix, uri) in namespaces(xml_file).items():
+        register_namespace(prefix, uri)
+    timings = {'backend': BACKEND}
+
+    start = time.time()
+    xml = XML(xml_file)
+    timings['parse'] = time.time() - start
+
+    sections = []
+    for (section_tag, child_tag, key) in SECTIONS:
+        for section in xml.root.iter(section_tag):
+            XML.index_children(section, child_tag, [key])
+            sections.append((section, child_tag, key,
+                             [child.get(key)
+                              for child in section.findall(child_tag)]))
+
+    start = time.time()
+    for (section, child_tag, key, values) in sections:
+        for value in values:
+            XML.find_child(section, child_tag, attrib={key: value},
+                           required=True)
+    timings['lookup'] = time.time() - start
+
+    start = time.time()
+    for (section, child_tag, key, values) in sections:
+        ordering = []
+        for child in section:
+            if child.tag not in ordering:
+                ordering.append(child.tag)
+        for i in range(100):
+            XML.add_child(section,
+                          Element(child_tag, {key: "new-{0}".format(i)}),
+                          ordering=ordering)
+    timings['add'] = time.time() - start
+
+    start = time.time()
+    xml.write_xml(output)
+    timings['write'] = time.time() - start
+
+    with open(output, 'rb') as file_obj:
+        timings['sha1'] = hashlib.sha1(file_obj.read()).hexdigest()
+    print(json.dumps(timings))
+
+
+def time_backend(backend, xml_file, output):
+    """Run the worker process under the given backend.
+
+    Args:
+      backend (str): ``'lxml'`` or ``'ElementTree'``
+      xml_file (str): Scaled-up descriptor to read.
+      output (str): Path to write the modified descriptor to.
+    Returns:
+      dict: Timings reported by :func:`run_worker`.
+    """
+    env = dict(os.environ)
+    env['COT_XML_BACKEND'] = backend
+    env['PYTHONPATH'] = os.pathsep.join(
+        [TOP_DIR] + [p for p in [env.get('PYTHONPATH')] if p])
+    result = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--worker',
+         xml_file, output], env=env)
+    return json.loads(result.decode())
+
+
+def main():
+    """Scale up each test descriptor and compare the backends on it."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=100,
+                        help="Number of copies of each scaled element")
+    parser.add_argument('--worker', nargs=2, metavar=('INPUT', 'OUTPUT'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        run_worker(*args.worker)
+        return 0
+
+    temp_dir = tempfile.mkdtemp(prefix="cot_bench")
+    status = 0
+    try:
+        print("{0:<14} {1:>6} {2:<12} {3:>8} {4:>8} {5:>8} {6:>8}".format(
+            "Descriptor", "KiB", "Backend", "parse", "lookup", "add",
+            "write"))
+        for name in DESCRIPTORS:
+            xml_file = os.path.join(temp_dir, name)
+            scale_descriptor(os.path.join(TEST_DIR, name), xml_file,
+                             args.scale)
+            digests = set()
+            for backend in ['ElementTree', 'lxml']:
+                timings = time_backend(backend, xml_file,
+                                       os.path.join(temp_dir, 'out.ovf'))
+                digests.add(timings['sha1'])
+                print("{0:<14} {1:>6} {2:<12} {3:>8.3f} {4:>8.3f} {5:>8.3f} "
+                      "{6:>8.3f}".format(
+                          name, os.path.getsize(xml_file) // 1024,
+                          timings['backend'], timings['parse'],
+                          timings['lookup'], timings['add'],
+                          timings['write']))
+            if len(digests) != 1:
+                print("ERROR: {0} output differs between backends"
+                      .format(name))
+                status = 1
+    finally:
+        shutil.rmtree(temp_dir)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -51,6 +51,7 @@ def regenerate_usage_contents(force=False):
             "inject-config",
             "install-helpers",
             "remove-file",
+            "verify",
     ]:
         dirpath = os.path.join(os.path.dirname(__file__),
                                "_autogenerated", subcommand)
@@ -550,6 +551,9 @@ man_pages = [
     ('usage_remove_file', 'cot-remove-file',
      u'Remove file from an OVF or OVA',
      [u'Glenn F. Matthews'], 1),
+    ('usage_verify', 'cot-verify',
+     u'Verify the contents of OVF(s) and/or OVA(s) against their manifests',
+     [u'Glenn F. Matthews'], 1),
 ]
 
 # If true, show URL addresses after external links.
@@ -66,6 +66,7 @@ tests_require = install_requires + ['unittest2', 'mock']
 
 extras_require = {
     'tab-completion': ['argcomplete>=1.3.0'],
+    'lxml': ['lxml>=4.5'],
 }
 
 cmdclass = versioneer.get_cmdclass()